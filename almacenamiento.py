@@ -0,0 +1,842 @@
+"""
+Backends de persistencia del Club de Lectura
+
+Cada club (un chat de Telegram) se guarda por separado, identificado por su chat id
+como texto. Los datos de un club son un dict de secciones ('miembros', 'citas',
+'libro_actual'...). Cada backend guarda los cambios elemento a elemento: un elemento
+de una lista, una entrada de un dict o el valor completo de una sección. Los cambios
+llegan ya serializados como tuplas (seccion, clave, valor_json):
+
+- clave None: valor_json es el valor completo de la sección
+- clave int: índice en una sección de tipo lista
+- clave str: clave en una sección de tipo dict
+- valor_json None: el elemento ya no existe y se borra (en listas, trunca desde ahí)
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from collections.abc import MutableMapping, MutableSequence
+
+import instantanea
+from modelo import a_json
+
+logger = logging.getLogger(__name__)
+
+# Nº de registros en el diario a partir del cual se compacta en una nueva instantánea
+MAX_REGISTROS_DIARIO = 1000
+# Filas que se piden de cada vez al recorrer un club guardado en SQL
+FILAS_POR_LECTURA = 1000
+
+
+def serializar_cambio(data, seccion, clave=None):
+    """
+    Devuelve el cambio (seccion, clave, valor_json) con el valor actual del elemento.
+    Los registros del modelo (ver modelo.py) se guardan con su forma JSON.
+    """
+    if clave is None:
+        return seccion, None, json.dumps(data.get(seccion), ensure_ascii=False, default=a_json)
+    contenedor = data.get(seccion)
+    if isinstance(contenedor, MutableSequence):
+        existe = clave < len(contenedor)
+    else:
+        existe = contenedor is not None and clave in contenedor
+    if not existe:
+        return seccion, clave, None
+    return seccion, clave, json.dumps(contenedor[clave], ensure_ascii=False, default=a_json)
+
+
+def aplicar_registro(data, registro):
+    """Aplica un registro del diario sobre los datos. Reaplicarlo no cambia el resultado."""
+    seccion = registro['s']
+    if 'k' not in registro:
+        data[seccion] = registro.get('v')
+        return
+    clave = registro['k']
+    if isinstance(clave, int):
+        contenedor = data.get(seccion)
+        if not isinstance(contenedor, MutableSequence):
+            contenedor = data[seccion] = []
+        if registro.get('borrar'):
+            # En listas, borrar un índice trunca la lista a partir de él
+            del contenedor[clave:]
+        else:
+            if clave >= len(contenedor):
+                contenedor.extend([None] * (clave + 1 - len(contenedor)))
+            contenedor[clave] = registro['v']
+    else:
+        contenedor = data.get(seccion)
+        if not isinstance(contenedor, MutableMapping):
+            contenedor = data[seccion] = {}
+        if registro.get('borrar'):
+            contenedor.pop(clave, None)
+        else:
+            contenedor[clave] = registro['v']
+
+
+def recorrer_datos(data):
+    """
+    Genera los cambios (seccion, clave, valor_json) que reconstruyen unos datos: el
+    valor de cada sección simple y, en listas y dicts, la sección vacía seguida de
+    cada elemento. Los elementos archivados que no se han leído no se decodifican.
+    """
+    for seccion, valor in data.items():
+        if isinstance(valor, MutableSequence):
+            yield seccion, None, '[]'
+            archivada = isinstance(valor, instantanea.ListaArchivada)
+            for i in range(len(valor)):
+                if archivada:
+                    yield seccion, i, valor.crudo(i).decode('utf-8')
+                else:
+                    yield seccion, i, json.dumps(valor[i], ensure_ascii=False, default=a_json)
+        elif isinstance(valor, MutableMapping):
+            yield seccion, None, '{}'
+            if isinstance(valor, instantanea.DiccionarioArchivado):
+                for clave in valor:
+                    yield seccion, clave, valor.crudo(clave).decode('utf-8')
+            else:
+                for clave, elemento in valor.items():
+                    yield seccion, clave, json.dumps(elemento, ensure_ascii=False, default=a_json)
+        else:
+            yield seccion, None, json.dumps(valor, ensure_ascii=False, default=a_json)
+
+
+class Almacenamiento:
+    """Interfaz común de los backends de persistencia"""
+
+    def cargar(self, club):
+        """Devuelve el dict de secciones guardado del club (vacío si no hay datos)"""
+        raise NotImplementedError
+
+    def escribir(self, club, cambios):
+        """Persiste una lista de cambios serializados del club. Devuelve los bytes escritos."""
+        raise NotImplementedError
+
+    def guardar_todo(self, club, data):
+        """Sustituye todo lo guardado del club por una instantánea completa de sus datos"""
+        raise NotImplementedError
+
+    def descargar(self, club):
+        """Libera los recursos de un club que ya no está en memoria"""
+
+    def clubes(self):
+        """Devuelve los ids de todos los clubes guardados, ordenados"""
+        raise NotImplementedError
+
+    def recorrer(self, club):
+        """
+        Genera lo guardado del club como cambios (ver recorrer_datos), para copiarlo
+        sin tenerlo entero en memoria cuando el backend lo permite
+        """
+        raise NotImplementedError
+
+    def registrar_encuesta(self, encuesta, club):
+        """Anota a qué club pertenece una encuesta nativa de Telegram"""
+        raise NotImplementedError
+
+    def buscar_encuesta(self, encuesta):
+        """Devuelve el club de una encuesta nativa, o None si no se conoce"""
+        raise NotImplementedError
+
+    def anotar_difusion(self, club, pendiente):
+        """Anota si un club tiene difusiones a medias, para retomarlas al arrancar"""
+        raise NotImplementedError
+
+    def clubes_con_difusiones(self):
+        """Devuelve los clubes con difusiones a medias"""
+        raise NotImplementedError
+
+    def anotar_reunion(self, club, fecha):
+        """Anota la fecha ISO de la próxima reunión de un club (None la borra)"""
+        raise NotImplementedError
+
+    def reuniones_programadas(self):
+        """Devuelve (club, fecha ISO) de todas las reuniones anotadas"""
+        raise NotImplementedError
+
+    def reuniones_guardadas(self):
+        """
+        Genera (club, fecha ISO) de la proxima_reunion guardada en los datos de cada
+        club. Sirve para anotar una vez las reuniones de antes de reuniones_programadas.
+        """
+        for club in self.clubes():
+            for seccion, _, valor in self.recorrer(club):
+                if seccion == 'proxima_reunion':
+                    fecha = json.loads(valor)
+                    if fecha:
+                        yield club, fecha
+                    break
+
+    def cerrar(self):
+        """Libera archivos y conexiones"""
+
+
+# ==================== JSON + DIARIO ====================
+
+class ArchivoJSON:
+    """
+    Instantánea JSON de un club más un diario de cambios (una línea JSON por cambio).
+    Cuando el diario crece se rota y un hilo lo fusiona con la instantánea.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.ruta_diario = os.path.splitext(ruta)[0] + '.journal'
+        # Segmento del diario que se está compactando en segundo plano
+        self.ruta_segmento = self.ruta_diario + '.1'
+        self.registros_diario = 0
+        self.compactacion = None
+        self.diario = None
+
+    def existe(self):
+        return os.path.exists(self.ruta)
+
+    def leer_instantanea(self):
+        """Lee la última instantánea completa de los datos"""
+        if os.path.exists(self.ruta):
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def escribir_instantanea(self, data):
+        """Escribe una instantánea completa de forma atómica (archivo temporal + rename)"""
+        temporal = self.ruta + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta)
+
+    def aplicar_diario(self, data, ruta):
+        """
+        Reaplica un archivo de diario. Devuelve el nº de registros aplicados y los
+        bytes que ocupan: si hay más, son un registro a medio escribir por una caída.
+        """
+        if not os.path.exists(ruta):
+            return 0, 0
+        aplicados = leidos = 0
+        with open(ruta, 'rb') as f:
+            for linea in f:
+                try:
+                    if not linea.endswith(b'\n'):
+                        raise ValueError('registro sin terminar')
+                    registro = json.loads(linea)
+                except ValueError:
+                    # Última línea a medio escribir por una caída: se descarta
+                    logger.warning(f"Registro incompleto en {ruta}, se ignora el resto del diario")
+                    break
+                aplicar_registro(data, registro)
+                aplicados += 1
+                leidos += len(linea)
+        return aplicados, leidos
+
+    def leer(self):
+        """Lee la instantánea con los segmentos del diario encima, sin escribir nada"""
+        data = self.leer_instantanea()
+        for ruta in (self.ruta_segmento, self.ruta_diario):
+            self.aplicar_diario(data, ruta)
+        return data
+
+    def cargar(self):
+        """
+        Lee la instantánea y reaplica encima los segmentos del diario. No se reescribe
+        la instantánea, que costaría tanto como todo el historial: el diario sigue
+        creciendo desde donde estaba y se compacta como siempre.
+        """
+        data = self.leer_instantanea()
+        self.aplicar_diario(data, self.ruta_segmento)
+        self.registros_diario, validos = self.aplicar_diario(data, self.ruta_diario)
+        if os.path.exists(self.ruta_diario) and os.path.getsize(self.ruta_diario) > validos:
+            # Sin el registro a medio escribir, para que el siguiente no se pegue a él
+            os.truncate(self.ruta_diario, validos)
+        if os.path.exists(self.ruta_segmento):
+            # De una compactación que no llegó a terminar
+            self.iniciar_compactacion()
+        return data
+
+    def abrir_diario(self):
+        self.diario = open(self.ruta_diario, 'a', encoding='utf-8')
+
+    def escribir(self, cambios):
+        """Añade los cambios al diario. Devuelve los bytes escritos."""
+        lineas = []
+        for seccion, clave, valor in cambios:
+            partes = ['{"s":', json.dumps(seccion, ensure_ascii=False)]
+            if clave is not None:
+                partes += [',"k":', json.dumps(clave, ensure_ascii=False)]
+            if valor is None and clave is not None:
+                partes.append(',"borrar":true}\n')
+            else:
+                partes += [',"v":', valor, '}\n']
+            lineas.append(''.join(partes))
+        texto = ''.join(lineas)
+        if self.diario is None:
+            self.abrir_diario()
+        self.diario.write(texto)
+        self.diario.flush()
+        self.registros_diario += len(lineas)
+        if self.registros_diario >= MAX_REGISTROS_DIARIO:
+            self.compactar()
+        return len(texto.encode('utf-8'))
+
+    def compactar_segmento(self):
+        """Fusiona el segmento rotado con la instantánea en disco (sin tocar el estado en memoria)"""
+        data = self.leer_instantanea()
+        self.aplicar_diario(data, self.ruta_segmento)
+        self.escribir_instantanea(data)
+        os.remove(self.ruta_segmento)
+
+    def compactar(self):
+        """Rota el diario y lo fusiona con la instantánea en un hilo en segundo plano"""
+        if self.compactacion and self.compactacion.is_alive():
+            return
+        if os.path.exists(self.ruta_segmento):
+            # Una compactación anterior falló: el segmento se fusionará al reiniciar
+            return
+        self.diario.close()
+        os.replace(self.ruta_diario, self.ruta_segmento)
+        self.abrir_diario()
+        self.registros_diario = 0
+        self.iniciar_compactacion()
+
+    def iniciar_compactacion(self):
+        self.compactacion = threading.Thread(target=self.compactar_segmento, daemon=True)
+        self.compactacion.start()
+
+    def guardar_todo(self, data):
+        """Escribe una instantánea completa y vacía el diario"""
+        if self.compactacion:
+            self.compactacion.join()
+        self.escribir_instantanea(data)
+        for ruta in (self.ruta_segmento, self.ruta_diario):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        self.registros_diario = 0
+        if self.diario is not None:
+            self.diario.close()
+            self.abrir_diario()
+
+    def cerrar(self):
+        if self.compactacion:
+            self.compactacion.join()
+        if self.diario is not None:
+            self.diario.close()
+            self.diario = None
+
+
+class ArchivoBinario(ArchivoJSON):
+    """
+    Como ArchivoJSON, pero con la instantánea binaria de instantanea.py: el historial,
+    las citas y las preguntas no se decodifican hasta que se usan. Si solo existe
+    la instantánea JSON del club, se convierte al cargarlo.
+    """
+
+    def __init__(self, ruta):
+        super().__init__(ruta)
+        self.ruta_json = os.path.splitext(ruta)[0] + '.json'
+
+    def existe(self):
+        return os.path.exists(self.ruta) or os.path.exists(self.ruta_json)
+
+    def leer_instantanea(self):
+        if os.path.exists(self.ruta):
+            return instantanea.leer(self.ruta)
+        if os.path.exists(self.ruta_json):
+            with open(self.ruta_json, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def escribir_instantanea(self, data):
+        instantanea.escribir(self.ruta, data)
+
+    def cargar(self):
+        convertir = os.path.exists(self.ruta_json) and not os.path.exists(self.ruta)
+        data = super().cargar()
+        if os.path.exists(self.ruta_json):
+            if convertir:
+                logger.info(f"Convirtiendo {self.ruta_json} al formato binario")
+                self.guardar_todo(data)
+            # Se conserva como copia, pero ya no se lee
+            os.replace(self.ruta_json, self.ruta_json + '.convertido')
+        return data
+
+
+class AlmacenamientoJSON(Almacenamiento):
+    """Un ArchivoJSON por club dentro de un directorio"""
+
+    ARCHIVO = ArchivoJSON
+    EXTENSION = '.json'
+
+    def __init__(self, directorio, ruta_legado=None, club_legado=None):
+        self.directorio = directorio
+        # club_data.json de antes de separar por chats: lo hereda el chat club_legado
+        self.ruta_legado = ruta_legado
+        self.club_legado = club_legado
+        if ruta_legado and not club_legado and os.path.exists(ruta_legado):
+            logger.warning(
+                f"{ruta_legado} es de una versión anterior y no se carga: indica en CLUB_LEGADO "
+                f"el id del chat de tu grupo para migrar sus datos a ese club"
+            )
+        self.archivos = {}
+        self.cerrojo = threading.Lock()
+        # Un archivo por encuesta con el id del club, para no cargar ningún club al buscar
+        self.directorio_encuestas = os.path.join(directorio, '_encuestas')
+        os.makedirs(self.directorio_encuestas, exist_ok=True)
+        # Un archivo vacío por club con difusiones a medias
+        self.directorio_difusiones = os.path.join(directorio, '_difusiones')
+        os.makedirs(self.directorio_difusiones, exist_ok=True)
+        # Un archivo por club con la fecha de su próxima reunión
+        self.directorio_reuniones = os.path.join(directorio, '_reuniones')
+        if not os.path.isdir(self.directorio_reuniones):
+            self.completar_reuniones()
+
+    def completar_reuniones(self):
+        """Crea _reuniones con las reuniones ya guardadas en los clubes, de una vez"""
+        nuevo = self.directorio_reuniones + '.nuevo'
+        shutil.rmtree(nuevo, ignore_errors=True)
+        os.makedirs(nuevo)
+        for club, fecha in self.reuniones_guardadas():
+            with open(os.path.join(nuevo, club), 'w', encoding='utf-8') as f:
+                f.write(fecha)
+        os.replace(nuevo, self.directorio_reuniones)
+
+    def archivo(self, club):
+        with self.cerrojo:
+            archivo = self.archivos.get(club)
+            if archivo is None:
+                archivo = self.archivos[club] = self.ARCHIVO(os.path.join(self.directorio, club + self.EXTENSION))
+            return archivo
+
+    def cargar(self, club):
+        archivo = self.archivo(club)
+        if (club == self.club_legado and not archivo.existe()
+                and self.ruta_legado and os.path.exists(self.ruta_legado)):
+            logger.info(f"Migrando {self.ruta_legado} al club {club}")
+            archivo.guardar_todo(ArchivoJSON(self.ruta_legado).leer())
+        return archivo.cargar()
+
+    def escribir(self, club, cambios):
+        return self.archivo(club).escribir(cambios)
+
+    def guardar_todo(self, club, data):
+        self.archivo(club).guardar_todo(data)
+
+    def descargar(self, club):
+        with self.cerrojo:
+            archivo = self.archivos.pop(club, None)
+        if archivo is not None:
+            archivo.cerrar()
+
+    def clubes(self):
+        # Un club puede tener solo el diario, si aún no se ha escrito su instantánea
+        extensiones = {self.EXTENSION, '.json', '.journal'}
+        clubes = {
+            os.path.splitext(nombre)[0] for nombre in os.listdir(self.directorio)
+            if os.path.splitext(nombre)[1] in extensiones
+        }
+        if self.club_legado and self.ruta_legado and os.path.exists(self.ruta_legado):
+            clubes.add(self.club_legado)
+        return sorted(clubes)
+
+    def recorrer(self, club):
+        # Se lee aparte del archivo en uso y sin reescribir la instantánea
+        archivo = self.ARCHIVO(os.path.join(self.directorio, club + self.EXTENSION))
+        if (club == self.club_legado and not archivo.existe()
+                and self.ruta_legado and os.path.exists(self.ruta_legado)):
+            archivo = ArchivoJSON(self.ruta_legado)
+        yield from recorrer_datos(archivo.leer())
+
+    def registrar_encuesta(self, encuesta, club):
+        with open(os.path.join(self.directorio_encuestas, encuesta), 'w', encoding='utf-8') as f:
+            f.write(club)
+
+    def buscar_encuesta(self, encuesta):
+        try:
+            with open(os.path.join(self.directorio_encuestas, encuesta), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def anotar_difusion(self, club, pendiente):
+        ruta = os.path.join(self.directorio_difusiones, club)
+        if pendiente:
+            open(ruta, 'w').close()
+        elif os.path.exists(ruta):
+            os.remove(ruta)
+
+    def clubes_con_difusiones(self):
+        return os.listdir(self.directorio_difusiones)
+
+    def anotar_reunion(self, club, fecha):
+        ruta = os.path.join(self.directorio_reuniones, club)
+        if fecha is not None:
+            with open(ruta, 'w', encoding='utf-8') as f:
+                f.write(fecha)
+        elif os.path.exists(ruta):
+            os.remove(ruta)
+
+    def reuniones_programadas(self):
+        reuniones = []
+        for club in os.listdir(self.directorio_reuniones):
+            with open(os.path.join(self.directorio_reuniones, club), 'r', encoding='utf-8') as f:
+                reuniones.append((club, f.read()))
+        return reuniones
+
+    def cerrar(self):
+        with self.cerrojo:
+            archivos, self.archivos = list(self.archivos.values()), {}
+        for archivo in archivos:
+            archivo.cerrar()
+
+
+class AlmacenamientoBinario(AlmacenamientoJSON):
+    """Un ArchivoBinario por club: arranque rápido aunque haya mucho historial"""
+
+    ARCHIVO = ArchivoBinario
+    EXTENSION = '.bin'
+
+
+# ==================== SQL ====================
+
+class AlmacenamientoSQL(Almacenamiento):
+    """
+    Una fila por club y elemento en la tabla club_registros:
+    tipo 'l' = elemento de lista (orden = índice), 'd' = entrada de dict,
+    'v' = valor completo de una sección escalar (libro_actual, proxima_reunion...).
+    Un voto actualiza la fila de una sugerencia, no el documento entero.
+    """
+
+    # Marcador de parámetros del driver ('?' en sqlite3, '%s' en psycopg2)
+    PARAM = '?'
+    TIPO_VALOR = 'TEXT'
+
+    def esquema(self):
+        return [
+            f'''
+            CREATE TABLE IF NOT EXISTS club_registros (
+                club TEXT NOT NULL,
+                seccion TEXT NOT NULL,
+                clave TEXT NOT NULL,
+                tipo CHAR(1) NOT NULL,
+                orden INTEGER,
+                valor {self.TIPO_VALOR} NOT NULL,
+                PRIMARY KEY (club, seccion, clave)
+            )
+            ''',
+            'CREATE INDEX IF NOT EXISTS club_registros_orden ON club_registros (club, seccion, orden)',
+            '''
+            CREATE TABLE IF NOT EXISTS club_encuestas (
+                encuesta TEXT PRIMARY KEY,
+                club TEXT NOT NULL
+            )
+            ''',
+            'CREATE TABLE IF NOT EXISTS club_difusiones (club TEXT PRIMARY KEY)',
+            'CREATE TABLE IF NOT EXISTS club_reuniones (club TEXT PRIMARY KEY, fecha TEXT NOT NULL)'
+        ]
+
+    def crear_esquema(self, cur):
+        """
+        Crea las tablas que falten. Si club_reuniones es nueva, se rellena en la misma
+        transacción con las proxima_reunion ya guardadas, para que tengan recordatorios.
+        """
+        completar = not self.existe_tabla(cur, 'club_reuniones')
+        for sentencia in self.esquema():
+            cur.execute(sentencia)
+        if not completar:
+            return
+        cur.execute(
+            "SELECT club, valor FROM club_registros WHERE seccion = 'proxima_reunion' AND tipo = 'v'"
+        )
+        for club, valor in cur.fetchall():
+            fecha = self.decodificar(valor)
+            if fecha:
+                cur.execute(
+                    f'INSERT INTO club_reuniones (club, fecha) VALUES ({self.PARAM}, {self.PARAM})',
+                    (club, fecha)
+                )
+
+    def existe_tabla(self, cur, tabla):
+        raise NotImplementedError
+
+    def conexion(self):
+        """Context manager que presta una conexión y confirma la transacción al salir"""
+        raise NotImplementedError
+
+    def lector(self):
+        """Como conexion(), para consultas cuyas filas se leen poco a poco"""
+        return self.conexion()
+
+    def decodificar(self, valor):
+        return json.loads(valor)
+
+    def texto(self, valor):
+        """Valor de una fila como texto JSON"""
+        return valor
+
+    def cargar(self, club):
+        data = {}
+        with self.conexion() as cur:
+            cur.execute(
+                f'SELECT seccion, clave, tipo, valor FROM club_registros '
+                f'WHERE club = {self.PARAM} ORDER BY seccion, orden',
+                (club,)
+            )
+            for seccion, clave, tipo, valor in cur.fetchall():
+                valor = self.decodificar(valor)
+                if tipo == 'l':
+                    data.setdefault(seccion, []).append(valor)
+                elif tipo == 'd':
+                    data.setdefault(seccion, {})[clave] = valor
+                else:
+                    data[seccion] = valor
+        return data
+
+    def clubes(self):
+        with self.conexion() as cur:
+            cur.execute('SELECT DISTINCT club FROM club_registros ORDER BY club')
+            return [fila[0] for fila in cur.fetchall()]
+
+    def recorrer(self, club):
+        seccion_anterior = None
+        with self.lector() as cur:
+            cur.execute(
+                f'SELECT seccion, clave, tipo, orden, valor FROM club_registros '
+                f'WHERE club = {self.PARAM} ORDER BY seccion, orden',
+                (club,)
+            )
+            while True:
+                filas = cur.fetchmany(FILAS_POR_LECTURA)
+                if not filas:
+                    break
+                for seccion, clave, tipo, orden, valor in filas:
+                    if tipo == 'v':
+                        yield seccion, None, self.texto(valor)
+                        continue
+                    if seccion != seccion_anterior:
+                        seccion_anterior = seccion
+                        yield seccion, None, '[]' if tipo == 'l' else '{}'
+                    yield seccion, orden if tipo == 'l' else clave, self.texto(valor)
+
+    def sentencias(self, club, seccion, clave, valor):
+        """Traduce un cambio a sentencias SQL (consulta, parámetros)"""
+        p = self.PARAM
+        upsert = (
+            f'INSERT INTO club_registros (club, seccion, clave, tipo, orden, valor) '
+            f'VALUES ({p}, {p}, {p}, {p}, {p}, {p}) '
+            f'ON CONFLICT (club, seccion, clave) DO UPDATE SET valor = excluded.valor, '
+            f'tipo = excluded.tipo, orden = excluded.orden'
+        )
+        if clave is None:
+            # Valor completo: se sustituyen todas las filas de la sección
+            yield f'DELETE FROM club_registros WHERE club = {p} AND seccion = {p}', (club, seccion)
+            contenido = json.loads(valor)
+            if isinstance(contenido, list):
+                for idx, elemento in enumerate(contenido):
+                    yield upsert, (club, seccion, str(idx), 'l', idx, json.dumps(elemento, ensure_ascii=False))
+            elif isinstance(contenido, dict):
+                for k, elemento in contenido.items():
+                    yield upsert, (club, seccion, k, 'd', None, json.dumps(elemento, ensure_ascii=False))
+            else:
+                yield upsert, (club, seccion, '', 'v', None, valor)
+        elif isinstance(clave, int):
+            if valor is None:
+                yield (
+                    f"DELETE FROM club_registros WHERE club = {p} AND seccion = {p} AND tipo = 'l' AND orden >= {p}",
+                    (club, seccion, clave)
+                )
+            else:
+                yield upsert, (club, seccion, str(clave), 'l', clave, valor)
+        elif valor is None:
+            yield f'DELETE FROM club_registros WHERE club = {p} AND seccion = {p} AND clave = {p}', (club, seccion, clave)
+        else:
+            yield upsert, (club, seccion, clave, 'd', None, valor)
+
+    def escribir(self, club, cambios):
+        escritos = 0
+        with self.conexion() as cur:
+            for seccion, clave, valor in cambios:
+                for consulta, parametros in self.sentencias(club, seccion, clave, valor):
+                    cur.execute(consulta, parametros)
+                escritos += len(valor.encode('utf-8')) if valor else 0
+        return escritos
+
+    def guardar_todo(self, club, data):
+        with self.conexion() as cur:
+            cur.execute(f'DELETE FROM club_registros WHERE club = {self.PARAM}', (club,))
+            for seccion, valor in data.items():
+                for consulta, parametros in self.sentencias(club, seccion, None, json.dumps(valor, ensure_ascii=False)):
+                    cur.execute(consulta, parametros)
+
+    def registrar_encuesta(self, encuesta, club):
+        p = self.PARAM
+        with self.conexion() as cur:
+            cur.execute(
+                f'INSERT INTO club_encuestas (encuesta, club) VALUES ({p}, {p}) '
+                f'ON CONFLICT (encuesta) DO UPDATE SET club = excluded.club',
+                (encuesta, club)
+            )
+
+    def buscar_encuesta(self, encuesta):
+        with self.conexion() as cur:
+            cur.execute(f'SELECT club FROM club_encuestas WHERE encuesta = {self.PARAM}', (encuesta,))
+            fila = cur.fetchone()
+        return fila[0] if fila else None
+
+    def anotar_difusion(self, club, pendiente):
+        with self.conexion() as cur:
+            if pendiente:
+                cur.execute(
+                    f'INSERT INTO club_difusiones (club) VALUES ({self.PARAM}) ON CONFLICT (club) DO NOTHING',
+                    (club,)
+                )
+            else:
+                cur.execute(f'DELETE FROM club_difusiones WHERE club = {self.PARAM}', (club,))
+
+    def clubes_con_difusiones(self):
+        with self.conexion() as cur:
+            cur.execute('SELECT club FROM club_difusiones')
+            return [fila[0] for fila in cur.fetchall()]
+
+    def anotar_reunion(self, club, fecha):
+        p = self.PARAM
+        with self.conexion() as cur:
+            if fecha is not None:
+                cur.execute(
+                    f'INSERT INTO club_reuniones (club, fecha) VALUES ({p}, {p}) '
+                    f'ON CONFLICT (club) DO UPDATE SET fecha = excluded.fecha',
+                    (club, fecha)
+                )
+            else:
+                cur.execute(f'DELETE FROM club_reuniones WHERE club = {p}', (club,))
+
+    def reuniones_programadas(self):
+        with self.conexion() as cur:
+            cur.execute('SELECT club, fecha FROM club_reuniones')
+            return [tuple(fila) for fila in cur.fetchall()]
+
+
+class _CursorSQLite:
+    """Transacción sobre una conexión sqlite3 compartida, protegida con un cerrojo"""
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+
+    def __enter__(self):
+        self.almacen.cerrojo.acquire()
+        self.cursor = self.almacen.db.cursor()
+        self.cursor.execute('BEGIN')
+        return self.cursor
+
+    def __exit__(self, tipo, valor, traza):
+        try:
+            if tipo is None:
+                self.cursor.execute('COMMIT')
+            else:
+                self.cursor.execute('ROLLBACK')
+            self.cursor.close()
+        finally:
+            self.almacen.cerrojo.release()
+
+
+class AlmacenamientoSQLite(AlmacenamientoSQL):
+    """SQLite en modo WAL: un solo archivo, sin servidor. Útil en local y para pruebas."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.cerrojo = threading.Lock()
+        # Se escribe desde el hilo de volcado, no solo desde el que la crea
+        self.db = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.conexion() as cur:
+            self.crear_esquema(cur)
+
+    def existe_tabla(self, cur, tabla):
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,))
+        return cur.fetchone() is not None
+
+    def conexion(self):
+        return _CursorSQLite(self)
+
+    def cerrar(self):
+        self.db.close()
+
+
+class _CursorPostgres:
+    """
+    Transacción sobre una conexión prestada por el pool. Con nombre, el cursor es
+    del servidor y las filas llegan según se piden en vez de todas de golpe.
+    """
+
+    def __init__(self, pool, nombre=None):
+        self.pool = pool
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.conn = self.pool.getconn()
+        self.cursor = self.conn.cursor(name=self.nombre) if self.nombre else self.conn.cursor()
+        return self.cursor
+
+    def __exit__(self, tipo, valor, traza):
+        try:
+            self.cursor.close()
+            if tipo is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.pool.putconn(self.conn)
+
+
+class AlmacenamientoPostgres(AlmacenamientoSQL):
+    """PostgreSQL con un pool de conexiones; los valores se guardan como JSONB"""
+
+    PARAM = '%s'
+    TIPO_VALOR = 'JSONB'
+
+    def __init__(self, dsn, max_conexiones=4):
+        # Dependencia opcional: solo hace falta si se elige este backend
+        from psycopg2.pool import ThreadedConnectionPool
+        self.pool = ThreadedConnectionPool(1, max_conexiones, dsn)
+        with self.conexion() as cur:
+            self.crear_esquema(cur)
+
+    def existe_tabla(self, cur, tabla):
+        cur.execute('SELECT to_regclass(%s)', (tabla,))
+        return cur.fetchone()[0] is not None
+
+    def conexion(self):
+        return _CursorPostgres(self.pool)
+
+    def lector(self):
+        return _CursorPostgres(self.pool, 'club_lector')
+
+    def decodificar(self, valor):
+        # psycopg2 ya devuelve los JSONB decodificados
+        return valor
+
+    def texto(self, valor):
+        return json.dumps(valor, ensure_ascii=False)
+
+    def cerrar(self):
+        self.pool.closeall()
+
+
+def crear_almacenamiento(tipo, directorio_json='clubes', ruta_legado='club_data.json'):
+    """Crea el backend indicado por la variable de entorno ALMACENAMIENTO"""
+    tipo = (tipo or 'json').lower()
+    if tipo == 'json':
+        return AlmacenamientoJSON(directorio_json, ruta_legado, os.getenv('CLUB_LEGADO'))
+    if tipo == 'binario':
+        return AlmacenamientoBinario(directorio_json, ruta_legado, os.getenv('CLUB_LEGADO'))
+    if tipo == 'sqlite':
+        return AlmacenamientoSQLite(os.getenv('SQLITE_PATH', 'club_data.db'))
+    if tipo in ('postgres', 'postgresql'):
+        dsn = os.getenv('DATABASE_URL')
+        if not dsn:
+            raise ValueError("ALMACENAMIENTO=postgres requiere la variable DATABASE_URL")
+        return AlmacenamientoPostgres(dsn, int(os.getenv('DB_MAX_CONEXIONES', '4')))
+    raise ValueError(f"Backend de almacenamiento desconocido: {tipo}")
@@ -0,0 +1,190 @@
+"""
+Estadísticas del club sobre una vista por columnas de su historial
+
+Los libros leídos, las citas y las preguntas se copian a columnas: un array('q')
+por campo numérico o de fecha y, para los nombres, un array de códigos con su
+vocabulario. Cada agregado es una pasada de funciones nativas (sum, map, zip,
+Counter) sobre una o dos columnas, sin volver a recorrer los registros. Como las
+secciones solo crecen por el final, al actualizar la vista se copian únicamente
+los elementos nuevos, y los recuentos por miembro solo suman las filas nuevas.
+"""
+
+from array import array
+from collections import Counter
+from datetime import date, timedelta
+from functools import lru_cache
+from itertools import chain, compress
+
+from modelo import MICROSEGUNDOS_POR_DIA, a_epoca
+
+# Valor de una celda vacía (campo a None) en las columnas numéricas
+NULO = -(2 ** 63)
+
+# Campos que se copian de cada sección: (numéricos y fechas, textos)
+COLUMNAS = {
+    'libros_leidos': (('fecha_inicio', 'fecha_fin', 'user_id', 'votos'), ()),
+    'citas': (('fecha', 'user_id'), ('compartida_por',)),
+    'discusiones': (('fecha', 'user_id'), ('autor',))
+}
+
+
+class Columnas:
+    """Vista por columnas de una sección de tipo lista, que se pone al día por el final"""
+
+    def __init__(self, numericos, textos):
+        self.numericos = {campo: array('q') for campo in numericos}
+        self.textos = {campo: array('l') for campo in textos}
+        # Código de cada texto y texto de cada código
+        self.codigos = {}
+        self.vocabulario = []
+        self.largo = 0
+        # Recuentos ya hechos: (campo, campo_nulo) -> (filas contadas, Counter)
+        self.cuentas = {}
+
+    def __len__(self):
+        return self.largo
+
+    def codigo(self, texto):
+        codigo = self.codigos.get(texto)
+        if codigo is None:
+            codigo = self.codigos[texto] = len(self.vocabulario)
+            self.vocabulario.append(texto)
+        return codigo
+
+    def actualizar(self, lista):
+        """Añade los elementos de la lista que aún no están en la vista"""
+        if len(lista) < self.largo:
+            # La sección se recortó: se rehace entera
+            self.__init__(self.numericos, self.textos)
+        for i in range(self.largo, len(lista)):
+            elemento = lista[i]
+            for campo, columna in self.numericos.items():
+                valor = getattr(elemento, campo)
+                columna.append(NULO if valor is None else valor)
+            for campo, columna in self.textos.items():
+                columna.append(self.codigo(getattr(elemento, campo) or ''))
+        self.largo = len(lista)
+        return self
+
+    def columna(self, campo):
+        return self.textos[campo] if campo in self.textos else self.numericos[campo]
+
+    def contar(self, campo, si_vacio=None):
+        """
+        Counter de los valores no vacíos de una columna (los textos, como códigos del
+        vocabulario). Con si_vacio solo cuenta las filas en que ese otro campo está
+        vacío. El recuento se guarda y después solo se suman las filas nuevas.
+        """
+        contadas, cuenta = self.cuentas.get((campo, si_vacio), (0, None))
+        if cuenta is None:
+            cuenta = Counter()
+        if contadas < self.largo:
+            nuevas = self.columna(campo)[contadas:]
+            if si_vacio is not None:
+                nuevas = compress(nuevas, [v == NULO for v in self.numericos[si_vacio][contadas:]])
+            cuenta.update(nuevas)
+            cuenta.pop(NULO, None)
+            self.cuentas[(campo, si_vacio)] = (self.largo, cuenta)
+        return cuenta
+
+
+@lru_cache(maxsize=4096)
+def mes_del_dia(dia):
+    """(año, mes) de un día contado desde 1970"""
+    fecha = date(1970, 1, 1) + timedelta(days=dia)
+    return fecha.year, fecha.month
+
+
+def mes(epoca):
+    return mes_del_dia(epoca // MICROSEGUNDOS_POR_DIA)
+
+
+def meses_hasta(hoy, n):
+    """Los n meses que terminan en el de hoy (epoca), del más antiguo al actual"""
+    anio, numero = mes(hoy)
+    meses = []
+    for _ in range(n):
+        meses.append((anio, numero))
+        anio, numero = (anio, numero - 1) if numero > 1 else (anio - 1, 12)
+    return meses[::-1]
+
+
+def calcular(vistas, miembros, reuniones, proxima_reunion, hoy, meses=12):
+    """
+    Agregados del informe a partir de las vistas por columnas de COLUMNAS, los
+    miembros y el historial de reuniones. Devuelve un dict con las cifras ya hechas.
+    """
+    libros = vistas['libros_leidos']
+    citas = vistas['citas']
+    discusiones = vistas['discusiones']
+    inicio, fin = libros.numericos['fecha_inicio'], libros.numericos['fecha_fin']
+
+    # Libros por mes de fin y duración de cada lectura
+    terminados = [f != NULO for f in fin]
+    por_mes = Counter(map(mes, compress(fin, terminados)))
+    completos = [t and i != NULO for t, i in zip(terminados, inicio)]
+    duraciones = [f - i for f, i in zip(compress(fin, completos), compress(inicio, completos))]
+
+    # Proponentes: libros elegidos frente a sugerencias hechas
+    ganadas = libros.contar('user_id')
+    proponentes = []
+    for user_id, n in ganadas.items():
+        miembro = miembros.get(str(user_id))
+        if miembro is None:
+            continue
+        sugeridas = max(miembro.sugerencias, n)
+        proponentes.append((miembro.nombre, n, sugeridas))
+    proponentes.sort(key=lambda p: (-p[1] / p[2], -p[1]))
+
+    # Asistencia: reuniones pasadas más la próxima si ya se celebró
+    asistentes = [reunion['asistentes'] for reunion in reuniones]
+    if proxima_reunion is not None and proxima_reunion[0] <= hoy:
+        asistentes.append(proxima_reunion[1])
+    asistencia = [len(lista) for lista in asistentes]
+
+    # Participación por miembro; las preguntas anteriores a guardar user_id van por nombre
+    por_nombre = {miembro.nombre: user_id for user_id, miembro in miembros.items()}
+    preguntas = Counter({str(user_id): n for user_id, n in discusiones.contar('user_id').items()})
+    for autor, n in discusiones.contar('autor', si_vacio='user_id').items():
+        user_id = por_nombre.get(discusiones.vocabulario[autor])
+        if user_id is not None:
+            preguntas[user_id] += n
+    citas_por_miembro = Counter({str(user_id): n for user_id, n in citas.contar('user_id').items()})
+    asistencias = Counter(chain.from_iterable(asistentes))
+    participacion = []
+    for user_id, miembro in miembros.items():
+        fila = (citas_por_miembro[user_id], preguntas[user_id], asistencias[user_id], miembro.votaciones)
+        if any(fila):
+            participacion.append((miembro.nombre, *fila))
+    participacion.sort(key=lambda fila: -sum(fila[1:]))
+
+    return {
+        'libros': len(libros),
+        'libros_por_mes': [(m, por_mes[m]) for m in meses_hasta(hoy, meses)],
+        'libros_ultimo_anio': sum(por_mes[m] for m in meses_hasta(hoy, 12)),
+        'duracion_media_dias': sum(duraciones) / len(duraciones) / MICROSEGUNDOS_POR_DIA if duraciones else None,
+        'duracion_min_dias': min(duraciones) // MICROSEGUNDOS_POR_DIA if duraciones else None,
+        'duracion_max_dias': max(duraciones) // MICROSEGUNDOS_POR_DIA if duraciones else None,
+        'votos_medios': sum(v for v in libros.numericos['votos'] if v != NULO) / len(libros) if len(libros) else None,
+        'proponentes': proponentes,
+        'asistencia': asistencia,
+        'citas': len(citas),
+        'preguntas': len(discusiones),
+        'participacion': participacion
+    }
+
+
+def tendencia(valores, ventana=3):
+    """Media de las últimas `ventana` cifras menos la de las `ventana` anteriores, o None"""
+    if len(valores) < 2 * ventana:
+        return None
+    recientes = valores[-ventana:]
+    anteriores = valores[-2 * ventana:-ventana]
+    return sum(recientes) / ventana - sum(anteriores) / ventana
+
+
+def reunion_actual(data):
+    """(epoca, user_ids confirmados) de la próxima reunión, o None"""
+    if not data.get('proxima_reunion'):
+        return None
+    return a_epoca(data['proxima_reunion']), list(data['asistentes'])
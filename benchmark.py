@@ -0,0 +1,580 @@
+"""
+Benchmark de los comandos del Club de Lectura
+
+Ejecuta los handlers reales con Updates sintéticos y un transporte de Telegram
+falso (sin red) sobre clubes sembrados con 10 a 1.000.000 registros: tormentas
+de votos, tráfico mezclado de comandos y ciclos de libro terminado. Para cada
+tamaño mide la latencia p50/p99 de cada comando, el coste de guardar, el pico
+de memoria (RSS) y lo que tarda en cargarse el club al arrancar, con la instantánea
+recién escrita y con una /cita pendiente en el diario.
+
+Cada tamaño se siembra y se mide en procesos aparte, así que el pico de memoria
+es el del bot y no el de la siembra. El resultado es JSON, para comparar dos
+ejecuciones:
+
+    python benchmark.py --tamanos 10,1000,100000 --salida hoy.json
+    python benchmark.py --almacenamiento binario --tamanos 1000000 --salida binario.json
+    python benchmark.py --comparar ayer.json hoy.json
+
+Con --trabajadores mide en cambio el modo particiones: cuántas actualizaciones por
+segundo atiende el bot repartiendo entre 1, 2, 4... procesos el tráfico de muchos chats:
+
+    python benchmark.py --trabajadores 1,2,4,8 --salida particiones.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from telegram.request import BaseRequest
+
+# Chat del club de prueba
+CHAT = -1000000000001
+# Chats entre los que se reparte el tráfico al medir el modo particiones
+CHATS_PARTICIONES = 64
+# Nº de miembros sembrados como mucho (el resto de registros son citas, preguntas...)
+MAX_MIEMBROS = 5000
+# Comandos del tráfico mezclado y su peso
+MEZCLA = {
+    'votacion': 15,
+    'historial': 10,
+    'ranking': 10,
+    'citas': 10,
+    'preguntas': 5,
+    'buscar': 10,
+    'mis_stats': 10,
+    'estadisticas_club': 5,
+    'libro_actual': 5,
+    'proxima_reunion': 5,
+    'cita': 15,
+    'pregunta': 5
+}
+# --comparar marca una regresión si una métrica empeora más de este % y de este mínimo
+# absoluto (los comandos de menos de un milisegundo varían mucho entre ejecuciones)
+UMBRAL_REGRESION = 20
+MINIMO_REGRESION = {'ms': 0.5, 'mb': 5}
+# Vocabulario de los textos sembrados, con frecuencias de Zipf como en un texto real
+SILABAS = 'ma ri po sa le na to ca mi lu ve ro da te ni so'.split()
+VOCABULARIO = [a + b for a in SILABAS for b in SILABAS] + [a + b + c for a in SILABAS for b in SILABAS for c in SILABAS]
+FRECUENCIAS = list(itertools.accumulate(1 / rango for rango in range(1, len(VOCABULARIO) + 1)))
+
+
+class TransporteFalso(BaseRequest):
+    """Responde a la API de Telegram sin salir a la red, con respuestas mínimas válidas"""
+
+    def __init__(self):
+        self.mensajes = itertools.count(1)
+        self.llamadas = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        self.llamadas += 1
+        metodo = url.rsplit('/', 1)[-1]
+        parametros = request_data.parameters if request_data else {}
+        if metodo == 'getMe':
+            resultado = {'id': 1, 'is_bot': True, 'first_name': 'Club', 'username': 'club_bot'}
+        elif metodo in ('sendMessage', 'editMessageText'):
+            resultado = {
+                'message_id': next(self.mensajes),
+                'date': int(time.time()),
+                'chat': {'id': int(parametros.get('chat_id', CHAT)), 'type': 'group'},
+                'text': parametros.get('text', '')
+            }
+        else:
+            resultado = True
+        return 200, json.dumps({'ok': True, 'result': resultado}).encode()
+
+
+class Actualizaciones:
+    """Fabrica los Updates de un chat de grupo como los enviaría Telegram"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.ids = itertools.count(1)
+
+    def usuario(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'Lector{user_id}'}
+
+    def datos_comando(self, texto, user_id, chat=CHAT):
+        orden = texto.split()[0]
+        return {
+            'update_id': next(self.ids),
+            'message': {
+                'message_id': next(self.ids),
+                'date': int(time.time()),
+                'chat': {'id': chat, 'type': 'group', 'title': 'Benchmark'},
+                'from': self.usuario(user_id),
+                'text': texto,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(orden)}]
+            }
+        }
+
+    def comando(self, texto, user_id, chat=CHAT):
+        from telegram import Update
+        return Update.de_json(self.datos_comando(texto, user_id, chat), self.bot)
+
+    def boton(self, datos, user_id, chat=CHAT):
+        from telegram import Update
+        return Update.de_json({
+            'update_id': next(self.ids),
+            'callback_query': {
+                'id': str(next(self.ids)),
+                'chat_instance': 'benchmark',
+                'data': datos,
+                'from': self.usuario(user_id),
+                'message': {
+                    'message_id': 1,
+                    'date': int(time.time()),
+                    'chat': {'id': chat, 'type': 'group', 'title': 'Benchmark'},
+                    'text': 'votación'
+                }
+            }
+        }, self.bot)
+
+
+def frase(aleatorio, n):
+    return ' '.join(aleatorio.choices(VOCABULARIO, cum_weights=FRECUENCIAS, k=n))
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) por rango más cercano"""
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))]
+
+
+def rss_max_mb():
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+# ==================== FASES (un proceso cada una) ====================
+
+def sembrar(registros, semilla):
+    """Guarda en el almacenamiento configurado un club con `registros` citas y proporcionales"""
+    import club_lectura_bot as bot
+    from indices import terminos
+    aleatorio = random.Random(semilla)
+    inicio = time.perf_counter()
+    data = bot.datos_iniciales()
+    fecha = '2024-03-01T19:00:00'
+    data['miembros'] = {
+        str(user_id): {
+            'nombre': f'Lector{user_id}', 'libros_leidos': aleatorio.randint(0, 20),
+            'participaciones': aleatorio.randint(0, 50), 'citas': aleatorio.randint(0, 30),
+            'fecha_union': fecha, 'epoca': 0
+        }
+        for user_id in range(1, min(registros, MAX_MIEMBROS) + 1)
+    }
+    data['citas'] = [
+        {'cita': frase(aleatorio, 12), 'compartida_por': f'Lector{i % MAX_MIEMBROS + 1}',
+         'user_id': i % MAX_MIEMBROS + 1, 'fecha': fecha}
+        for i in range(registros)
+    ]
+    data['discusiones'] = [
+        {'pregunta': '¿' + frase(aleatorio, 8) + '?', 'autor': f'Lector{i % MAX_MIEMBROS + 1}',
+         'fecha': fecha, 'respondida': i % 3 == 0}
+        for i in range(max(1, registros // 10))
+    ]
+    data['libros_leidos'] = [
+        {'id': i, 'titulo_autor': f'{frase(aleatorio, 3).title()} {i} - Autor {i % 97}',
+         'sugerido_por': 'Lector1', 'user_id': 1, 'fecha': fecha, 'votos': 3,
+         'fecha_inicio': fecha, 'fecha_fin': '2024-04-01T19:00:00', 'paginas_totales': None, 'progreso': {}}
+        for i in range(1, max(1, registros // 100) + 1)
+    ]
+    data['siguiente_id'] = len(data['libros_leidos']) + 1
+    for seccion, campo in bot.TEXTOS_BUSCABLES.items():
+        for posicion, elemento in enumerate(data[seccion]):
+            data['terminos'][f"{seccion}:{posicion}"] = terminos(elemento[campo])
+    bot.clubes.almacen.guardar_todo(str(CHAT), data)
+    bot.clubes.almacen.cerrar()
+    return {'siembra_s': round(time.perf_counter() - inicio, 3)}
+
+
+async def arrancar_bot(bot):
+    """Aplicación con los handlers del bot y el transporte falso, ya iniciada"""
+    from telegram.ext import Application
+    logging.getLogger().setLevel(logging.WARNING)
+    application = (
+        Application.builder()
+        .token('1:benchmark')
+        .request(TransporteFalso())
+        .get_updates_request(TransporteFalso())
+        .build()
+    )
+    bot.registrar_handlers(application)
+    await application.initialize()
+    await bot.iniciar_persistencia(application)
+    return application
+
+
+async def anotar_cita(semilla):
+    """
+    Carga el club recién sembrado (solo instantánea) y deja una /cita en el diario,
+    como un bot que se reinicia poco después de un cambio
+    """
+    import club_lectura_bot as bot
+    application = await arrancar_bot(bot)
+    inicio = time.perf_counter()
+    await bot.clubes.obtener(CHAT)
+    arranque_ms = (time.perf_counter() - inicio) * 1000
+    cita = Actualizaciones(application.bot).comando(f'/cita {frase(random.Random(semilla), 12)}', 1)
+    await application.process_update(cita)
+    await bot.cerrar_persistencia(application)
+    await application.shutdown()
+    return {'arranque_ms': round(arranque_ms, 3)}
+
+
+async def medir(registros, semilla, operaciones):
+    """Arranca el bot sobre el club sembrado (con la /cita en el diario) y reproduce el tráfico"""
+    import club_lectura_bot as bot
+    aleatorio = random.Random(semilla + 1)
+    miembros = min(registros, MAX_MIEMBROS)
+
+    application = await arrancar_bot(bot)
+    errores = []
+
+    async def anotar_error(update, context):
+        errores.append(repr(context.error))
+
+    application.add_error_handler(anotar_error)
+    actualizaciones = Actualizaciones(application.bot)
+
+    inicio = time.perf_counter()
+    club = await bot.clubes.obtener(CHAT)
+    arranque_ms = (time.perf_counter() - inicio) * 1000
+
+    latencias = {}
+    guardados = []
+
+    async def enviar(nombre, update):
+        inicio = time.perf_counter()
+        await application.process_update(update)
+        latencias.setdefault(nombre, []).append((time.perf_counter() - inicio) * 1000)
+
+    async def comando(texto, user_id=None):
+        user_id = user_id or aleatorio.randint(1, miembros)
+        await enviar(texto.split()[0][1:], actualizaciones.comando(texto, user_id))
+
+    async def guardar(escenario):
+        estadisticas = bot.clubes.estadisticas
+        bytes_antes, registros_antes = estadisticas['bytes_escritos'], estadisticas['registros_escritos']
+        inicio = time.perf_counter()
+        await bot.clubes.volcar_async()
+        guardados.append({
+            'escenario': escenario,
+            'ms': round((time.perf_counter() - inicio) * 1000, 3),
+            'bytes': estadisticas['bytes_escritos'] - bytes_antes,
+            'registros': estadisticas['registros_escritos'] - registros_antes
+        })
+
+    # Sugerencias y tormenta de votos con botones
+    for i in range(20):
+        await comando(f'/sugerir Propuesta {i} {frase(aleatorio, 2)} - Autor {i}')
+    await guardar('sugerir')
+    await comando('/iniciar_votacion botones', 1)
+    votacion_id = club.votacion_abierta()
+    sugerencias = [libro.id for libro in club.data['libros_sugeridos']]
+    for _ in range(operaciones):
+        datos = f'vote_{votacion_id}_{aleatorio.choice(sugerencias)}'
+        await enviar('votar_callback', actualizaciones.boton(datos, aleatorio.randint(1, miembros)))
+    await guardar('votos')
+
+    # Tráfico mezclado
+    await comando('/programar_reunion 01/01/2030 19:00', 1)
+    nombres, pesos = list(MEZCLA), list(MEZCLA.values())
+    for nombre in aleatorio.choices(nombres, pesos, k=operaciones):
+        if nombre == 'buscar':
+            await comando(f'/buscar {frase(aleatorio, 2)}')
+        elif nombre == 'ranking':
+            await comando(f"/ranking {aleatorio.choice(['libros', 'participaciones', 'citas'])}")
+        elif nombre == 'cita':
+            await comando(f'/cita {frase(aleatorio, 12)}')
+        elif nombre == 'pregunta':
+            await comando(f'/pregunta ¿{frase(aleatorio, 8)}?')
+        else:
+            await comando(f'/{nombre}')
+    await guardar('mezcla')
+
+    # Ciclos de libro: votación cerrada, libro elegido y terminado
+    for ciclo in range(5):
+        for i in range(3):
+            await comando(f'/sugerir Ciclo {ciclo} libro {i} - Autor')
+        await comando('/finalizar_votacion', 1)
+        await comando('/seleccionar_libro', 1)
+        await comando('/paginas 400', 1)
+        for _ in range(20):
+            await comando(f'/progreso {aleatorio.randint(1, 400)}')
+        await comando('/terminar_libro', 1)
+    await guardar('terminar_libro')
+
+    await bot.cerrar_persistencia(application)
+    await application.shutdown()
+
+    comandos = {
+        nombre: {
+            'n': len(valores),
+            'p50_ms': round(percentil(valores, 50), 3),
+            'p99_ms': round(percentil(valores, 99), 3),
+            'max_ms': round(max(valores), 3)
+        }
+        for nombre, valores in sorted(latencias.items())
+    }
+    return {
+        'arranque_diario_ms': round(arranque_ms, 3),
+        'rss_max_mb': round(rss_max_mb(), 1),
+        'comandos': comandos,
+        'guardado': guardados,
+        # Excepciones de los handlers; una ejecución válida no tiene ninguna
+        'errores': errores[:10],
+        'textos_cacheados': {
+            'aciertos': bot.clubes.estadisticas['render_aciertos'],
+            'fallos': bot.clubes.estadisticas['render_fallos']
+        }
+    }
+
+
+async def trabajar():
+    """Un trabajador del modo particiones, con el transporte falso"""
+    import club_lectura_bot as bot
+    from telegram.ext import Application
+    logging.getLogger().setLevel(logging.WARNING)
+    application = (
+        Application.builder()
+        .token('1:benchmark')
+        .request(TransporteFalso())
+        .get_updates_request(TransporteFalso())
+        .concurrent_updates(bot.ACTUALIZACIONES_CONCURRENTES)
+        .post_init(bot.iniciar_persistencia)
+        .post_shutdown(bot.cerrar_persistencia)
+        .build()
+    )
+    bot.registrar_handlers(application)
+    await bot.ejecutar_trabajador(application)
+
+
+async def repartir(trabajadores, operaciones, semilla):
+    """
+    Envía al Distribuidor el tráfico mezclado de CHATS_PARTICIONES chats y devuelve las
+    actualizaciones por segundo hasta que los trabajadores las confirman todas
+    """
+    from http import HTTPStatus
+    from particiones import Distribuidor
+    aleatorio = random.Random(semilla)
+    actualizaciones = Actualizaciones(None)
+    chats = [CHAT - i for i in range(CHATS_PARTICIONES)]
+
+    def cuerpo(texto, chat):
+        datos = actualizaciones.datos_comando(texto, aleatorio.randint(1, 50), chat)
+        return json.dumps(datos).encode()
+
+    async def enviar(cuerpos):
+        for c in cuerpos:
+            while (await recibir({}, c))[0] != HTTPStatus.OK:
+                await asyncio.sleep(0.01)
+        while any(distribuidor.pendientes().values()):
+            await asyncio.sleep(0.005)
+
+    comando = [sys.executable, os.path.abspath(__file__), '--fase', 'trabajador']
+    distribuidor = Distribuidor(comando, trabajadores, lambda encuesta: None)
+    recibir = distribuidor.ruta_http()
+    await distribuidor.iniciar()
+    # Calentamiento: arrancan los procesos y se crea cada club
+    await enviar([cuerpo('/libro_actual', chat) for chat in chats])
+    nombres, pesos = list(MEZCLA), list(MEZCLA.values())
+    cuerpos = []
+    for nombre in aleatorio.choices(nombres, pesos, k=operaciones):
+        if nombre in ('cita', 'buscar'):
+            texto = f'/{nombre} {frase(aleatorio, 8)}'
+        elif nombre == 'pregunta':
+            texto = f'/pregunta ¿{frase(aleatorio, 8)}?'
+        else:
+            texto = f'/{nombre}'
+        cuerpos.append(cuerpo(texto, aleatorio.choice(chats)))
+    inicio = time.perf_counter()
+    await enviar(cuerpos)
+    segundos = time.perf_counter() - inicio
+    await distribuidor.cerrar()
+    return operaciones / segundos
+
+
+# ==================== EJECUCIÓN Y COMPARACIÓN ====================
+
+def fase(nombre, registros, directorio, argumentos):
+    """Ejecuta una fase en un proceso nuevo dentro del directorio de datos y devuelve su JSON"""
+    orden = [
+        sys.executable, os.path.abspath(__file__), '--fase', nombre,
+        '--tamanos', str(registros), '--operaciones', str(argumentos.operaciones),
+        '--semilla', str(argumentos.semilla)
+    ]
+    entorno = dict(os.environ, ALMACENAMIENTO=argumentos.almacenamiento,
+                   PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    salida = subprocess.run(orden, cwd=directorio, env=entorno, capture_output=True, text=True)
+    if salida.returncode != 0:
+        sys.stderr.write(salida.stderr)
+        raise SystemExit(f"La fase {nombre} con {registros} registros ha fallado")
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def ejecutar(argumentos):
+    resultados = []
+    for registros in argumentos.tamanos:
+        with tempfile.TemporaryDirectory() as directorio:
+            resultado = {'registros': registros}
+            resultado.update(fase('sembrar', registros, directorio, argumentos))
+            resultado.update(fase('cita', registros, directorio, argumentos))
+            resultado.update(fase('medir', registros, directorio, argumentos))
+        resultados.append(resultado)
+        print(f"{registros} registros: arranque {resultado['arranque_ms']:.1f} ms "
+              f"({resultado['arranque_diario_ms']:.1f} ms con diario), "
+              f"RSS máx. {resultado['rss_max_mb']:.0f} MB", file=sys.stderr)
+        for error in resultado['errores']:
+            print(f"  error en un handler: {error}", file=sys.stderr)
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                  text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = ''
+    return {
+        'revision': revision,
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'almacenamiento': argumentos.almacenamiento,
+        'operaciones': argumentos.operaciones,
+        'resultados': resultados
+    }
+
+
+def escalado(argumentos):
+    """Actualizaciones por segundo del modo particiones con cada nº de trabajadores"""
+    resultados = []
+    directorio_inicial = os.getcwd()
+    os.environ['ALMACENAMIENTO'] = argumentos.almacenamiento
+    for trabajadores in argumentos.trabajadores:
+        with tempfile.TemporaryDirectory() as directorio:
+            # Los trabajadores heredan el directorio de datos
+            os.chdir(directorio)
+            try:
+                por_segundo = asyncio.run(repartir(trabajadores, argumentos.operaciones, argumentos.semilla))
+            finally:
+                os.chdir(directorio_inicial)
+        resultados.append({
+            'trabajadores': trabajadores,
+            'por_segundo': round(por_segundo, 1),
+            'aceleracion': round(por_segundo / resultados[0]['por_segundo'], 2) if resultados else 1.0
+        })
+        print(f"{trabajadores} trabajadores: {por_segundo:.0f} actualizaciones/s", file=sys.stderr)
+    return {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'nucleos': os.cpu_count(),
+        'almacenamiento': argumentos.almacenamiento,
+        'operaciones': argumentos.operaciones,
+        'chats': CHATS_PARTICIONES,
+        'resultados': resultados
+    }
+
+
+def comparar(ruta_base, ruta_nueva):
+    """Muestra la variación de cada métrica entre dos ejecuciones. Devuelve el nº de regresiones."""
+    with open(ruta_base, encoding='utf-8') as f:
+        base = {r['registros']: r for r in json.load(f)['resultados']}
+    with open(ruta_nueva, encoding='utf-8') as f:
+        nueva = {r['registros']: r for r in json.load(f)['resultados']}
+    regresiones = 0
+
+    def linea(nombre, antes, ahora):
+        nonlocal regresiones
+        cambio = (ahora - antes) / antes * 100 if antes else 0.0
+        minimo = MINIMO_REGRESION[nombre.rsplit('_', 1)[-1]]
+        marca = ''
+        if cambio > UMBRAL_REGRESION and ahora - antes > minimo:
+            marca = '  <-- regresión'
+            regresiones += 1
+        print(f"  {nombre:<32} {antes:>10.2f} {ahora:>10.2f} {cambio:>+8.1f}%{marca}")
+
+    for registros in sorted(base.keys() & nueva.keys()):
+        antes, ahora = base[registros], nueva[registros]
+        print(f"{registros} registros{'':<22} {'antes':>10} {'ahora':>10} {'cambio':>9}")
+        linea('arranque_ms', antes['arranque_ms'], ahora['arranque_ms'])
+        if 'arranque_diario_ms' in antes and 'arranque_diario_ms' in ahora:
+            linea('arranque_diario_ms', antes['arranque_diario_ms'], ahora['arranque_diario_ms'])
+        linea('rss_max_mb', antes['rss_max_mb'], ahora['rss_max_mb'])
+        for nombre in sorted(antes['comandos'].keys() & ahora['comandos'].keys()):
+            for metrica in ('p50_ms', 'p99_ms'):
+                linea(f'{nombre} {metrica}', antes['comandos'][nombre][metrica], ahora['comandos'][nombre][metrica])
+        guardado = {g['escenario']: g['ms'] for g in antes['guardado']}
+        for g in ahora['guardado']:
+            if g['escenario'] in guardado:
+                linea(f"guardar {g['escenario']}_ms", guardado[g['escenario']], g['ms'])
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--tamanos', default='10,1000,100000',
+                        help='registros de cada club sembrado, separados por comas (hasta 1000000)')
+    parser.add_argument('--operaciones', type=int, default=2000,
+                        help='votos de la tormenta y comandos del tráfico mezclado')
+    parser.add_argument('--almacenamiento', default=os.getenv('ALMACENAMIENTO', 'json'),
+                        help='backend a medir: json, binario o sqlite')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--salida', help='archivo donde guardar el resultado (por defecto, la salida estándar)')
+    parser.add_argument('--comparar', nargs=2, metavar=('ANTES', 'AHORA'),
+                        help='compara dos resultados; sale con código 1 si hay regresiones')
+    parser.add_argument('--trabajadores',
+                        help='mide el modo particiones con estos nº de trabajadores, separados por comas')
+    parser.add_argument('--fase', choices=('sembrar', 'cita', 'medir', 'trabajador'), help=argparse.SUPPRESS)
+    argumentos = parser.parse_args()
+    argumentos.tamanos = [int(t) for t in argumentos.tamanos.split(',')]
+
+    if argumentos.comparar:
+        return 1 if comparar(*argumentos.comparar) else 0
+    if argumentos.fase == 'sembrar':
+        print(json.dumps(sembrar(argumentos.tamanos[0], argumentos.semilla)))
+        return 0
+    if argumentos.fase == 'cita':
+        print(json.dumps(asyncio.run(anotar_cita(argumentos.semilla))))
+        return 0
+    if argumentos.fase == 'medir':
+        resultado = asyncio.run(medir(argumentos.tamanos[0], argumentos.semilla, argumentos.operaciones))
+        print(json.dumps(resultado))
+        return 0
+    if argumentos.fase == 'trabajador':
+        asyncio.run(trabajar())
+        return 0
+
+    if argumentos.trabajadores:
+        argumentos.trabajadores = [int(t) for t in argumentos.trabajadores.split(',')]
+        resultado = escalado(argumentos)
+    else:
+        resultado = ejecutar(argumentos)
+    informe = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if argumentos.salida:
+        with open(argumentos.salida, 'w', encoding='utf-8') as f:
+            f.write(informe + '\n')
+    else:
+        print(informe)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,7 +5,9 @@ Funcionalidades: sugerencias de libros, votaciones, recordatorios, discusiones,
 
 import logging
 from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Poll
+from telegram import ChatMember, Update, InlineKeyboardButton, InlineKeyboardMarkup, Poll
+from telegram.error import BadRequest, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -15,9 +17,28 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-import json
+import asyncio
+import functools
+import hashlib
 import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping, MutableSequence
+from itertools import islice
 from dotenv import load_dotenv
+from almacenamiento import crear_almacenamiento, serializar_cambio
+from analitica import COLUMNAS, Columnas, calcular, mes, reunion_actual, tendencia
+from difusion import MENSAJES_POR_SEGUNDO, CuboTokens, MotorDifusion
+from indices import IndiceRanking, IndiceTexto, IndiceTrigramas, Recuento, terminos
+from instantanea import DiccionarioArchivado
+from metricas import Metricas, PeticionesMedidas
+import migracion
+from modelo import Cita, Libro, Miembro, Pregunta, Sugerencia, a_epoca, a_fecha, ahora, cargar_registros, dias_desde
+from particiones import Distribuidor, atender_particion, particion, senales_de_parada
+from recordatorios import PlanificadorRecordatorios
+from webhook import Receptor, ServidorHTTP
 
 # Cargar variables de entorno
 load_dotenv()
@@ -29,56 +50,1142 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Archivo para persistencia de datos
+# Directorio con un archivo por club (backend JSON)
+DATA_DIR = 'clubes'
+# Archivo único de versiones anteriores, con los datos de un solo club
 DATA_FILE = 'club_data.json'
+# Tiempo máximo que un cambio espera en memoria antes de escribirse
+INTERVALO_VOLCADO_MS = int(os.getenv('INTERVALO_VOLCADO_MS', '250'))
+# Nº de clubes que se mantienen en memoria; los menos usados se descargan
+MAX_CLUBES_EN_MEMORIA = int(os.getenv('MAX_CLUBES_EN_MEMORIA', '256'))
+# Textos cacheados por club; las páginas de /buscar hacen que las claves no tengan fin
+MAX_TEXTOS_CACHEADOS = 64
+# Criterios de /ranking: nombre en el comando -> campo del miembro
+CRITERIOS_RANKING = {
+    'libros': 'libros_leidos',
+    'participaciones': 'participaciones',
+    'citas': 'citas'
+}
+# Secciones que busca /buscar: sección -> atributo con el texto
+TEXTOS_BUSCABLES = {
+    'citas': 'cita',
+    'discusiones': 'pregunta',
+    'libros_leidos': 'titulo_autor'
+}
+# Cómo llegan las actualizaciones: 'polling', 'webhook' (servidor HTTP en $PORT) o
+# 'particiones' (webhook repartido entre varios procesos por chat, ver particiones.py)
+MODO_CONEXION = os.getenv('MODO_CONEXION', 'polling')
+# Procesos trabajadores del modo particiones; por defecto, uno por núcleo
+TRABAJADORES = int(os.getenv('TRABAJADORES', str(os.cpu_count() or 1)))
+PUERTO = int(os.getenv('PORT', '8080'))
+# URL pública del servicio; en Render se toma la que asigna la plataforma
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL')
+WEBHOOK_RUTA = os.getenv('WEBHOOK_RUTA', '/webhook')
+# Secreto que Telegram envía en cada petición; por defecto se deriva del token
+WEBHOOK_SECRETO = os.getenv('WEBHOOK_SECRETO')
+# Actualizaciones que se procesan a la vez (1 = una detrás de otra). Los comandos que
+# esperan el cerrojo de su club ocupan plaza, así que conviene un margen amplio
+ACTUALIZACIONES_CONCURRENTES = int(os.getenv('ACTUALIZACIONES_CONCURRENTES', '256'))
+# Parecido mínimo (0-1) entre títulos para avisar de que un libro ya se sugirió o leyó
+UMBRAL_TITULO_REPETIDO = float(os.getenv('UMBRAL_TITULO_REPETIDO', '0.75'))
+# Votación por defecto de /iniciar_votacion: 'botones' o 'encuesta' (encuestas nativas)
+MODO_VOTACION = os.getenv('MODO_VOTACION', 'botones')
+# Cronometrar comandos, volcados y llamadas a Telegram (ver metricas.py). Con el
+# modo webhook las métricas se sirven en el mismo puerto; con polling, en $PORT
+METRICAS = os.getenv('METRICAS', '0').lower() in ('1', 'true', 'si', 'sí')
+METRICAS_RUTA = os.getenv('METRICAS_RUTA', '/metrics')
+# Si se indica, GET /metrics exige la cabecera "Authorization: Bearer <token>"
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN')
+# IDs de usuario que pueden usar /metrics_club; si no hay, los administradores del chat
+ADMINISTRADORES = {int(x) for x in os.getenv('ADMINISTRADORES', '').replace(',', ' ').split()}
+
+def titulo(titulo_autor):
+    """Parte del título de un "Título - Autor", que es la que se compara entre libros"""
+    return titulo_autor.split(' - ')[0]
+
+def datos_iniciales():
+    """Estado de un club recién creado"""
+    return {
+        'libros_sugeridos': [],
+        'libro_actual': None,
+        'libros_leidos': [],
+        'proxima_reunion': None,
+        'miembros': {},
+        'discusiones': [],
+        'votaciones_activas': {},
+        'citas': [],
+        # Votos emitidos: "votacion:usuario" -> id de la sugerencia votada
+        'votos': {},
+        # Encuestas nativas: id de la encuesta -> votación y sugerencias de cada opción
+        'encuestas': {},
+        # Asistentes confirmados a la próxima reunión: user_id -> nombre
+        'asistentes': {},
+        # Recordatorios ya enviados de la próxima reunión ('24h', '1h')
+        'recordatorios_enviados': [],
+        # Palabras de cada texto buscable ya tokenizado: "seccion:posicion" -> {palabra: veces}
+        'terminos': {},
+        # Avisos privados a los miembros: id -> texto y destinatarios; el progreso va
+        # aparte para no reescribir la lista de destinatarios tras cada lote
+        'difusiones': {},
+        'progreso_difusiones': {},
+        # Libros terminados por todo el club; ver ClubLecturaBot.libros_leidos
+        'libros_terminados': 0,
+        # Página por la que va cada miembro en el libro actual: user_id -> página. Al
+        # terminar el libro se copia a su campo 'progreso'
+        'progreso': {},
+        # Reuniones ya celebradas: fecha y user_ids de quienes confirmaron asistencia
+        'reuniones': [],
+        'siguiente_id': 1
+    }
 
 class ClubLecturaBot:
-    def __init__(self):
-        self.data = self.cargar_datos()
-    
-    def cargar_datos(self):
-        """Carga los datos desde archivo JSON"""
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+    """
+    Estado de un club (un chat de Telegram) y sus cambios pendientes de guardar.
+    Las secciones de modelo.SECCIONES se convierten en registros al cargar.
+    """
+    
+    def __init__(self, club_id, data, gestor=None):
+        self.club_id = club_id
+        self.data = cargar_registros(data)
+        self.gestor = gestor
+        # Elementos modificados desde el último volcado, en orden de modificación
+        self.pendientes = {}
+        self.mutaciones = 0
+        # Lo toman los comandos que cambian el club; ver cambia_club
+        self.cerrojo = asyncio.Lock()
+        # Nº de cambios de cada sección, para saber si un texto cacheado sigue valiendo
+        self.versiones = {}
+        # Textos de los comandos de consulta: comando -> (versiones, texto), en un LRU
+        self.renders = OrderedDict()
+        self.indexar_sugerencias()
+        self.indexar_miembros()
+        self.indexar_progreso()
+        # Los índices del historial, las citas y las preguntas se crean al usarlos por
+        # primera vez, para no leer esas secciones al cargar el club
+        self.indice_texto = None
+        self.titulos_leidos = None
+        # Vistas por columnas para /estadisticas_club; ver analitica.py
+        self.vistas = {}
+    
+    def registrar(self, seccion, clave=None):
+        """Marca como modificada una sección o uno de sus elementos para el próximo volcado"""
+        if clave is None:
+            # El valor completo de la sección sustituye a los cambios sueltos pendientes
+            for pendiente in [p for p in self.pendientes if p[0] == seccion]:
+                del self.pendientes[pendiente]
+        self.pendientes[(seccion, clave)] = None
+        self.mutaciones += 1
+        self.versiones[seccion] = self.versiones.get(seccion, 0) + 1
+        if self.gestor is not None:
+            self.gestor.marcar_sucio(self)
+    
+    def agregar(self, seccion, valor):
+        """Añade un elemento al final de una sección de tipo lista y lo registra"""
+        self.data[seccion].append(valor)
+        self.registrar(seccion, len(self.data[seccion]) - 1)
+        if seccion in TEXTOS_BUSCABLES:
+            self.indexar_texto(seccion, len(self.data[seccion]) - 1)
+        if seccion == 'libros_leidos' and self.titulos_leidos is not None:
+            self.titulos_leidos.agregar(len(self.data[seccion]) - 1, titulo(valor.titulo_autor))
+    
+    def preparar_volcado(self):
+        """
+        Serializa los elementos pendientes con su valor actual y vacía la lista.
+        Se ejecuta en el bucle de eventos para no leer los datos mientras cambian.
+        """
+        cambios = [serializar_cambio(self.data, seccion, clave) for seccion, clave in self.pendientes]
+        mutaciones = self.mutaciones
+        self.pendientes = {}
+        self.mutaciones = 0
+        return cambios, mutaciones
+    
+    def render(self, comando, secciones, generar):
+        """
+        Devuelve el texto de un comando de consulta. Solo se vuelve a generar si
+        alguna de las secciones de las que depende ha cambiado desde la última vez.
+        """
+        version = tuple(self.versiones.get(seccion, 0) for seccion in secciones)
+        cacheado = self.renders.get(comando)
+        acierto = cacheado is not None and cacheado[0] == version
+        if self.gestor is not None:
+            self.gestor.estadisticas['render_aciertos' if acierto else 'render_fallos'] += 1
+        if acierto:
+            self.renders.move_to_end(comando)
+            return cacheado[1]
+        inicio = time.perf_counter()
+        texto = generar()
+        metricas.observar(
+            'club_render_segundos', time.perf_counter() - inicio,
+            comando=comando if isinstance(comando, str) else comando[0]
+        )
+        self.renders[comando] = (version, texto)
+        self.renders.move_to_end(comando)
+        if len(self.renders) > MAX_TEXTOS_CACHEADOS:
+            self.renders.popitem(last=False)
+        return texto
+    
+    def vistas_columnares(self):
+        """Vistas por columnas de las secciones de analitica.COLUMNAS, al día con los datos"""
+        for seccion, (numericos, textos) in COLUMNAS.items():
+            vista = self.vistas.get(seccion)
+            if vista is None:
+                vista = self.vistas[seccion] = Columnas(numericos, textos)
+            vista.actualizar(self.data[seccion])
+        return self.vistas
+    
+    def tamanos(self):
+        """Nº de elementos de cada sección; las archivadas sin leer no se decodifican para contarlas"""
         return {
-            'libros_sugeridos': [],
-            'libro_actual': None,
-            'libros_leidos': [],
-            'proxima_reunion': None,
-            'miembros': {},
-            'discusiones': [],
-            'votaciones_activas': {},
-            'citas': []
+            seccion: len(valor) for seccion, valor in self.data.items()
+            if isinstance(valor, (list, dict, MutableSequence, MutableMapping))
+            and not (isinstance(valor, DiccionarioArchivado) and valor.posiciones is None)
         }
     
-    def guardar_datos(self):
-        """Guarda los datos en archivo JSON"""
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+    def nuevo_id(self):
+        """Devuelve un id estable para una sugerencia o votación del club"""
+        nuevo = self.data['siguiente_id']
+        self.data['siguiente_id'] = nuevo + 1
+        self.registrar('siguiente_id')
+        return nuevo
+    
+    # ---------- Miembros ----------
+    
+    def indexar_miembros(self):
+        """Reconstruye un índice de ranking por cada criterio de CRITERIOS_RANKING"""
+        self.rankings = {campo: IndiceRanking() for campo in CRITERIOS_RANKING.values()}
+        for user_id, miembro in self.data['miembros'].items():
+            for campo, indice in self.rankings.items():
+                indice.fijar(user_id, self.valor_ranking(miembro, campo))
+    
+    def valor_ranking(self, miembro, campo):
+        """
+        Valor que se indexa para un criterio. Para libros leídos es la parte propia
+        del miembro (sin los terminados por todo el club), que ordena igual.
+        """
+        if campo == 'libros_leidos':
+            return miembro.libros_leidos - miembro.epoca
+        return getattr(miembro, campo)
+    
+    def libros_leidos(self, user_id):
+        """
+        Libros leídos por un miembro. Terminar un libro para todos solo incrementa
+        'libros_terminados'; cada miembro guarda su valor propio y el contador del
+        club cuando se unió ('epoca'), y el total se calcula al leerlo.
+        """
+        miembro = self.data['miembros'][user_id]
+        return miembro.libros_leidos + self.data['libros_terminados'] - miembro.epoca
+    
+    def top_ranking(self, campo, k):
+        """Los k primeros de un criterio como lista de (user_id, valor)"""
+        extra = self.data['libros_terminados'] if campo == 'libros_leidos' else 0
+        return [(user_id, valor + extra) for user_id, valor in self.rankings[campo].top(k)]
+    
+    def agregar_miembro(self, user):
+        """Registra a un usuario como miembro si aún no lo es"""
+        user_id = str(user.id)
+        if user_id in self.data['miembros']:
+            return
+        self.data['miembros'][user_id] = Miembro(
+            nombre=user.first_name,
+            fecha_union=ahora(),
+            epoca=self.data['libros_terminados']
+        )
+        self.registrar('miembros', user_id)
+        for campo, indice in self.rankings.items():
+            indice.fijar(user_id, self.valor_ranking(self.data['miembros'][user_id], campo))
+    
+    def sumar_a_miembro(self, user_id, campo, cantidad=1):
+        """Suma a un contador del miembro y actualiza su ranking. No hace nada si no es miembro."""
+        miembro = self.data['miembros'].get(user_id)
+        if miembro is None:
+            return
+        setattr(miembro, campo, getattr(miembro, campo) + cantidad)
+        self.registrar('miembros', user_id)
+        if campo in self.rankings:
+            self.rankings[campo].fijar(user_id, self.valor_ranking(miembro, campo))
+    
+    def terminar_libro_para_todos(self):
+        """Suma un libro leído a todos los miembros actuales en O(1)"""
+        self.data['libros_terminados'] += 1
+        self.registrar('libros_terminados')
+    
+    def terminar_libro_para(self, user_ids):
+        """Suma un libro leído solo a los miembros indicados"""
+        for user_id in user_ids:
+            self.sumar_a_miembro(user_id, 'libros_leidos')
+    
+    # ---------- Progreso de lectura ----------
+    
+    def indexar_progreso(self):
+        """Reconstruye el índice de páginas del libro actual, del que salen mediana y percentiles"""
+        self.indice_progreso = IndiceRanking()
+        for user_id, pagina in self.data['progreso'].items():
+            self.indice_progreso.fijar(user_id, pagina)
+    
+    def fijar_progreso(self, user_id, pagina):
+        """Anota la página por la que va un miembro en el libro actual"""
+        self.data['progreso'][user_id] = pagina
+        self.registrar('progreso', user_id)
+        self.indice_progreso.fijar(user_id, pagina)
+    
+    def fijar_paginas(self, paginas):
+        """Fija las páginas del libro actual; el progreso anotado por encima se recorta"""
+        self.data['libro_actual'].paginas_totales = paginas
+        self.registrar('libro_actual')
+        indice = self.indice_progreso
+        while indice.distintos and indice.distintos[-1] > paginas:
+            for user_id in list(indice.cubos[indice.distintos[-1]]):
+                self.fijar_progreso(user_id, paginas)
+    
+    def vaciar_progreso(self):
+        """Empieza de cero el progreso (al elegir o terminar un libro)"""
+        self.data['progreso'] = {}
+        self.registrar('progreso')
+        self.indice_progreso = IndiceRanking()
+    
+    def resumen_progreso(self):
+        """
+        Agregados del progreso del club sin recorrer a los miembros: percentiles,
+        cuántos han terminado y cuántos van por detrás del ritmo necesario para
+        acabar antes de la próxima reunión. Todo sale del índice en O(log páginas).
+        """
+        libro = self.data['libro_actual']
+        indice = self.indice_progreso
+        resumen = {
+            'lectores': len(indice),
+            'p25': indice.percentil(0.25),
+            'mediana': indice.percentil(0.5),
+            'p75': indice.percentil(0.75),
+            'total': libro.paginas_totales,
+            'terminados': None,
+            'fin_estimado': None,
+            'pagina_objetivo': None,
+            'atrasados': None
+        }
+        total = libro.paginas_totales
+        if total is None or not len(indice):
+            return resumen
+        resumen['terminados'] = len(indice) - indice.menores_que(total)
+        
+        # Al ritmo de la mediana desde que se eligió el libro
+        transcurrido = ahora() - libro.fecha_inicio
+        if resumen['mediana'] > 0 and transcurrido > 0:
+            ritmo = resumen['mediana'] / transcurrido
+            resumen['fin_estimado'] = ahora() + round((total - resumen['mediana']) / ritmo)
+        
+        # Página por la que habría que ir hoy para terminar justo antes de la reunión
+        if self.data['proxima_reunion']:
+            reunion = a_epoca(self.data['proxima_reunion'])
+            if reunion > libro.fecha_inicio:
+                fraccion = min(1.0, transcurrido / (reunion - libro.fecha_inicio))
+                objetivo = int(total * fraccion)
+                resumen['pagina_objetivo'] = objetivo
+                resumen['atrasados'] = indice.menores_que(objetivo)
+        return resumen
+    
+    # ---------- Reuniones ----------
+    
+    def programar_reunion(self, fecha):
+        """
+        Fija la próxima reunión (fecha ISO) y borra las confirmaciones y recordatorios.
+        Si la anterior ya se celebró, pasa al historial de reuniones con sus asistentes.
+        """
+        anterior = self.data['proxima_reunion']
+        if anterior and datetime.fromisoformat(anterior) <= datetime.now():
+            self.agregar('reuniones', {'fecha': anterior, 'asistentes': list(self.data['asistentes'])})
+        self.data['proxima_reunion'] = fecha
+        self.data['confirmaciones'] = []
+        self.data['asistentes'] = {}
+        self.data['recordatorios_enviados'] = []
+        for seccion in ('proxima_reunion', 'confirmaciones', 'asistentes', 'recordatorios_enviados'):
+            self.registrar(seccion)
+    
+    def recordatorio_enviado(self, tipo):
+        self.agregar('recordatorios_enviados', tipo)
+    
+    # ---------- Difusiones ----------
+    
+    def crear_difusion(self, texto, destinatarios):
+        """Guarda un aviso pendiente de enviar a cada destinatario; ver MotorDifusion"""
+        difusion_id = str(self.nuevo_id())
+        self.data['difusiones'][difusion_id] = {
+            'texto': texto,
+            'destinatarios': destinatarios,
+            'fecha': datetime.now().isoformat()
+        }
+        self.data['progreso_difusiones'][difusion_id] = {'posicion': 0, 'entregados': 0, 'fallidos': 0}
+        self.registrar('difusiones', difusion_id)
+        self.registrar('progreso_difusiones', difusion_id)
+        return difusion_id
+    
+    def avanzar_difusion(self, difusion_id, enviados, entregados):
+        """Anota un lote enviado de una difusión y devuelve su progreso"""
+        progreso = self.data['progreso_difusiones'][difusion_id]
+        progreso['posicion'] += enviados
+        progreso['entregados'] += entregados
+        progreso['fallidos'] += enviados - entregados
+        self.registrar('progreso_difusiones', difusion_id)
+        return progreso
+    
+    def terminar_difusion(self, difusion_id):
+        del self.data['difusiones'][difusion_id]
+        del self.data['progreso_difusiones'][difusion_id]
+        self.registrar('difusiones', difusion_id)
+        self.registrar('progreso_difusiones', difusion_id)
+    
+    # ---------- Búsqueda ----------
+    
+    def indexar_textos(self):
+        """
+        Rellena el índice de /buscar con los términos guardados. Solo se tokenizan
+        los textos que aún no los tienen (datos de versiones anteriores).
+        """
+        self.indice_texto = IndiceTexto()
+        for documento, cuenta in self.data['terminos'].items():
+            self.indice_texto.agregar(documento, cuenta)
+        for seccion in TEXTOS_BUSCABLES:
+            for posicion in range(len(self.data[seccion])):
+                if f"{seccion}:{posicion}" not in self.data['terminos']:
+                    self.indexar_texto(seccion, posicion)
+    
+    def indexar_texto(self, seccion, posicion):
+        """Añade al índice un elemento de una sección buscable y guarda sus términos"""
+        documento = f"{seccion}:{posicion}"
+        cuenta = terminos(getattr(self.data[seccion][posicion], TEXTOS_BUSCABLES[seccion]))
+        self.data['terminos'][documento] = cuenta
+        self.registrar('terminos', documento)
+        if self.indice_texto is not None:
+            self.indice_texto.agregar(documento, cuenta)
+    
+    def buscar(self, consulta, limite=None):
+        """Genera (seccion, elemento) que coinciden con la consulta, del más relevante al menos"""
+        if self.indice_texto is None:
+            self.indexar_textos()
+        for documento in self.indice_texto.buscar(consulta, limite):
+            seccion, posicion = documento.split(':')
+            yield seccion, self.data[seccion][int(posicion)]
+    
+    # ---------- Sugerencias y votos ----------
+    
+    def indexar_sugerencias(self):
+        """Reconstruye la posición de cada sugerencia por id y el recuento de votos"""
+        self.sugerencias = {}
+        self.recuento = Recuento()
+        self.titulos_sugeridos = IndiceTrigramas()
+        for idx, libro in enumerate(self.data['libros_sugeridos']):
+            if libro.id is None:
+                # Sugerencias guardadas antes de tener id
+                libro.id = self.nuevo_id()
+                self.registrar('libros_sugeridos', idx)
+            self.sugerencias[libro.id] = idx
+            self.recuento.agregar_opcion(libro.id, libro.votos)
+            self.titulos_sugeridos.agregar(libro.id, titulo(libro.titulo_autor))
+    
+    def indexar_leidos(self):
+        """Reconstruye el índice de títulos del historial por posición"""
+        self.titulos_leidos = IndiceTrigramas()
+        for idx, libro in enumerate(self.data['libros_leidos']):
+            self.titulos_leidos.agregar(idx, titulo(libro.titulo_autor))
+    
+    def libro_parecido(self, titulo_autor):
+        """
+        Busca una sugerencia actual o un libro leído con un título parecido.
+        Devuelve (seccion, libro), mirando antes las sugerencias, o None.
+        """
+        buscado = titulo(titulo_autor)
+        encontrado = self.titulos_sugeridos.parecido(buscado, UMBRAL_TITULO_REPETIDO)
+        if encontrado is not None:
+            return 'libros_sugeridos', self.sugerencia(encontrado[0])
+        if self.titulos_leidos is None:
+            self.indexar_leidos()
+        encontrado = self.titulos_leidos.parecido(buscado, UMBRAL_TITULO_REPETIDO)
+        if encontrado is not None:
+            return 'libros_leidos', self.data['libros_leidos'][encontrado[0]]
+        return None
+    
+    def sugerencia(self, sugerencia_id):
+        """Devuelve la sugerencia con ese id, o None"""
+        idx = self.sugerencias.get(sugerencia_id)
+        return None if idx is None else self.data['libros_sugeridos'][idx]
+    
+    def agregar_sugerencia(self, libro):
+        """Añade una sugerencia con un id nuevo"""
+        libro.id = self.nuevo_id()
+        self.agregar('libros_sugeridos', libro)
+        self.sugerencias[libro.id] = len(self.data['libros_sugeridos']) - 1
+        self.recuento.agregar_opcion(libro.id, libro.votos)
+        self.titulos_sugeridos.agregar(libro.id, titulo(libro.titulo_autor))
+    
+    def vaciar_sugerencias(self):
+        """
+        Borra las sugerencias, los votos, las votaciones y sus encuestas. Antes suma
+        una votación a cada persona que votó, aunque la votación se reabriera.
+        """
+        for user_id in dict.fromkeys(clave.split(':', 1)[1] for clave in self.data['votos']):
+            self.sumar_a_miembro(user_id, 'votaciones')
+            self.sumar_a_miembro(user_id, 'participaciones')
+        self.data['libros_sugeridos'] = []
+        self.data['votos'] = {}
+        self.data['votaciones_activas'] = {}
+        self.data['encuestas'] = {}
+        for seccion in ('libros_sugeridos', 'votos', 'votaciones_activas', 'encuestas'):
+            self.registrar(seccion)
+        self.indexar_sugerencias()
+    
+    def votacion_abierta(self):
+        """Id de la votación abierta, o None"""
+        for votacion_id, votacion in self.data['votaciones_activas'].items():
+            if votacion.get('abierta'):
+                return votacion_id
+        return None
+    
+    def abrir_votacion(self):
+        """Devuelve la votación abierta, creando una si no la hay"""
+        votacion_id = self.votacion_abierta()
+        if votacion_id is None:
+            if self.data['votaciones_activas']:
+                # Reabierta tras /finalizar_votacion: los votos empiezan de cero
+                self.reiniciar_votos()
+            votacion_id = str(self.nuevo_id())
+            self.data['votaciones_activas'][votacion_id] = {
+                'abierta': True,
+                'fecha_inicio': datetime.now().isoformat()
+            }
+            self.registrar('votaciones_activas', votacion_id)
+        return votacion_id
+    
+    def reiniciar_votos(self):
+        """Deja a cero los votos de todas las sugerencias"""
+        self.recuento = Recuento()
+        for idx, libro in enumerate(self.data['libros_sugeridos']):
+            if libro.votos:
+                libro.votos = 0
+                self.registrar('libros_sugeridos', idx)
+            self.recuento.agregar_opcion(libro.id)
+    
+    def cerrar_votacion(self, votacion_id):
+        """Cierra una votación: ya no acepta votos"""
+        self.data['votaciones_activas'][votacion_id]['abierta'] = False
+        self.registrar('votaciones_activas', votacion_id)
+    
+    def ajustar_votos(self, sugerencia_id, delta):
+        """Suma o resta votos a una sugerencia en el recuento y en sus datos"""
+        idx = self.sugerencias[sugerencia_id]
+        self.data['libros_sugeridos'][idx].votos = self.recuento.sumar(sugerencia_id, delta)
+        self.registrar('libros_sugeridos', idx)
+    
+    def fijar_voto(self, votacion_id, user_id, sugerencia_id):
+        """Deja el voto de un usuario en una sugerencia (None lo retira). Un voto por persona."""
+        clave = f"{votacion_id}:{user_id}"
+        anterior = self.data['votos'].get(clave)
+        if anterior == sugerencia_id:
+            return
+        if anterior in self.sugerencias:
+            self.ajustar_votos(anterior, -1)
+        if sugerencia_id is None:
+            del self.data['votos'][clave]
+        else:
+            self.data['votos'][clave] = sugerencia_id
+            self.ajustar_votos(sugerencia_id, 1)
+        self.registrar('votos', clave)
+    
+    def votar(self, votacion_id, user_id, sugerencia_id):
+        """
+        Voto con botones: votar otra opción cambia el voto y repetir la misma lo retira.
+        Devuelve 'registrado', 'cambiado' o 'retirado'.
+        """
+        anterior = self.data['votos'].get(f"{votacion_id}:{user_id}")
+        if anterior == sugerencia_id:
+            self.fijar_voto(votacion_id, user_id, None)
+            return 'retirado'
+        self.fijar_voto(votacion_id, user_id, sugerencia_id)
+        return 'cambiado' if anterior is not None else 'registrado'
+    
+    def agregar_encuesta(self, encuesta_id, votacion_id, opciones, chat_id, message_id):
+        """Anota una encuesta nativa publicada para una votación"""
+        self.data['encuestas'][encuesta_id] = {
+            'votacion': votacion_id,
+            'opciones': opciones,
+            'chat_id': chat_id,
+            'message_id': message_id
+        }
+        self.registrar('encuestas', encuesta_id)
+    
+    def responder_encuesta(self, encuesta_id, user_id, opciones_elegidas):
+        """
+        Aplica una respuesta a una encuesta nativa. Con varias encuestas por votación
+        cuenta la última respuesta; retirarla solo quita el voto si era de esa encuesta.
+        """
+        encuesta = self.data['encuestas'].get(encuesta_id)
+        if encuesta is None or encuesta['votacion'] != self.votacion_abierta():
+            return
+        votacion_id = encuesta['votacion']
+        if opciones_elegidas:
+            sugerencia_id = encuesta['opciones'][opciones_elegidas[0]]
+            if sugerencia_id in self.sugerencias:
+                self.fijar_voto(votacion_id, user_id, sugerencia_id)
+        elif self.data['votos'].get(f"{votacion_id}:{user_id}") in encuesta['opciones']:
+            self.fijar_voto(votacion_id, user_id, None)
+    
+    def ganador(self):
+        """Sugerencia con más votos, o None si no hay sugerencias"""
+        sugerencia_id = self.recuento.ganador()
+        return None if sugerencia_id is None else self.sugerencia(sugerencia_id)
 
-# Instancia global del bot
-bot_data = ClubLecturaBot()
+class GestorClubes:
+    """
+    Clubes en memoria, cargados bajo demanda desde el almacenamiento y guardados
+    en un LRU: al superar max_clubes se descarga el club usado hace más tiempo.
+    Solo se escriben los clubes con cambios pendientes.
+    """
+    
+    def __init__(self, almacen, max_clubes=MAX_CLUBES_EN_MEMORIA):
+        self.almacen = almacen
+        self.max_clubes = max_clubes
+        self.clubes = OrderedDict()
+        # Clubes sacados del LRU cuyos cambios aún no se han escrito
+        self.expulsados = {}
+        self.sucios = {}
+        self.cargas = {}
+        # Caché de id de encuesta nativa -> club
+        self.encuestas = {}
+        # (nº, total) del trabajador en el modo particiones; None si este proceso lleva todos los clubes
+        self.particion = None
+        # Cerrojos de clubes que aún no están en memoria (ver cerrojo())
+        self.cerrojos = {}
+        # Volcados empezados y terminados, para saber cuándo está escrito un cambio
+        self.volcados_empezados = 0
+        self.volcados_terminados = 0
+        self.volcado_terminado = None
+        self.hay_cambios = None
+        self.tarea_volcado = None
+        # Serializa las escrituras entre el hilo de volcado y el de cierre
+        self.cerrojo_escritura = threading.Lock()
+        self.estadisticas = {
+            'volcados': 0,
+            'registros_escritos': 0,
+            'mutaciones_agrupadas': 0,
+            'ultima_latencia_ms': 0.0,
+            'latencia_max_ms': 0.0,
+            'bytes_escritos': 0,
+            'clubes_cargados': 0,
+            'clubes_expulsados': 0,
+            'render_aciertos': 0,
+            'render_fallos': 0
+        }
+    
+    async def obtener(self, club_id):
+        """Devuelve el club de un chat, cargándolo del almacenamiento si no está en memoria"""
+        club_id = str(club_id)
+        club = self.clubes.get(club_id)
+        if club is not None:
+            self.clubes.move_to_end(club_id)
+            return club
+        club = self.expulsados.pop(club_id, None)
+        if club is None:
+            carga = self.cargas.get(club_id)
+            if carga is None:
+                carga = self.cargas[club_id] = asyncio.ensure_future(
+                    asyncio.to_thread(self.almacen.cargar, club_id)
+                )
+            try:
+                guardado = await carga
+            finally:
+                self.cargas.pop(club_id, None)
+            # Otra petición pudo terminar la misma carga antes
+            club = self.clubes.get(club_id)
+            if club is not None:
+                return club
+            data = datos_iniciales()
+            data.update(guardado)
+            club = ClubLecturaBot(club_id, data, self)
+            club.cerrojo = self.cerrojos.pop(club_id, club.cerrojo)
+            self.estadisticas['clubes_cargados'] += 1
+        self.clubes[club_id] = club
+        self.expulsar_sobrantes()
+        return club
+    
+    async def registrar_encuesta(self, encuesta_id, club_id):
+        """Anota de qué club es una encuesta nativa (las respuestas no traen el chat)"""
+        self.encuestas[encuesta_id] = club_id
+        await asyncio.to_thread(self.almacen.registrar_encuesta, encuesta_id, club_id)
+    
+    async def club_de_encuesta(self, encuesta_id):
+        """Devuelve el id del club de una encuesta nativa, sin cargarlo, o None si no es nuestra"""
+        club_id = self.encuestas.get(encuesta_id)
+        if club_id is None:
+            club_id = await asyncio.to_thread(self.almacen.buscar_encuesta, encuesta_id)
+            if club_id is not None:
+                self.encuestas[encuesta_id] = club_id
+        return club_id
+    
+    def cerrojo(self, club_id):
+        """
+        Cerrojo de escritura de un club. Se da sin esperar a que el club se cargue:
+        así los comandos de un chat toman turno en el orden en que llegan, y no en el
+        que terminan de esperar la carga.
+        """
+        club_id = str(club_id)
+        club = self.clubes.get(club_id)
+        if club is None:
+            club = self.expulsados.get(club_id)
+        if club is not None:
+            return club.cerrojo
+        return self.cerrojos.setdefault(club_id, asyncio.Lock())
+    
+    def es_propio(self, club_id):
+        """Si el club es de este proceso (en el modo particiones, cada trabajador lleva los suyos)"""
+        return self.particion is None or particion(club_id, self.particion[1]) == self.particion[0]
+    
+    def expulsar_sobrantes(self):
+        """
+        Saca del LRU los clubes menos usados; el volcado los guarda y los descarga.
+        Un club con un comando en curso no se saca, para que nadie cargue otra copia.
+        """
+        sobrantes = len(self.clubes) - self.max_clubes
+        for club_id, club in list(self.clubes.items()):
+            if sobrantes <= 0:
+                break
+            if club.cerrojo.locked():
+                continue
+            del self.clubes[club_id]
+            self.expulsados[club_id] = club
+            self.estadisticas['clubes_expulsados'] += 1
+            sobrantes -= 1
+        if self.expulsados and self.hay_cambios is not None:
+            self.hay_cambios.set()
+    
+    def marcar_sucio(self, club):
+        """Anota que un club tiene cambios pendientes de escribir"""
+        self.sucios[club.club_id] = club
+        if self.hay_cambios is not None:
+            self.hay_cambios.set()
+    
+    def preparar_volcado(self):
+        """Serializa los cambios de todos los clubes sucios"""
+        lotes = []
+        mutaciones = 0
+        for club in self.sucios.values():
+            cambios, n = club.preparar_volcado()
+            if cambios:
+                lotes.append((club.club_id, cambios))
+            mutaciones += n
+        self.sucios = {}
+        return lotes, mutaciones
+    
+    def escribir_cambios(self, lotes, descargas=()):
+        """Persiste cambios ya serializados y libera clubes expulsados (pensado para un hilo de trabajo)"""
+        with self.cerrojo_escritura:
+            for club_id, cambios in lotes:
+                self.estadisticas['bytes_escritos'] += self.almacen.escribir(club_id, cambios)
+            for club_id in descargas:
+                self.almacen.descargar(club_id)
+    
+    def anotar_volcado(self, registros, mutaciones, segundos):
+        """Actualiza las estadísticas de persistencia tras un volcado"""
+        latencia_ms = segundos * 1000
+        self.estadisticas['volcados'] += 1
+        self.estadisticas['registros_escritos'] += registros
+        self.estadisticas['mutaciones_agrupadas'] += mutaciones
+        self.estadisticas['ultima_latencia_ms'] = latencia_ms
+        self.estadisticas['latencia_max_ms'] = max(self.estadisticas['latencia_max_ms'], latencia_ms)
+        metricas.observar('club_volcado_segundos', segundos)
+        logger.debug(f"Volcado: {mutaciones} cambios agrupados en {registros} registros, {latencia_ms:.1f} ms")
+    
+    async def volcar_async(self):
+        """Escribe los cambios pendientes en un hilo de trabajo, sin bloquear el bucle de eventos"""
+        if not self.sucios and not self.expulsados:
+            return
+        inicio = time.perf_counter()
+        self.volcados_empezados += 1
+        numero = self.volcados_empezados
+        lotes, mutaciones = self.preparar_volcado()
+        descargas = list(self.expulsados)
+        await asyncio.to_thread(self.escribir_cambios, lotes, descargas)
+        self.volcados_terminados = numero
+        if self.volcado_terminado is not None:
+            async with self.volcado_terminado:
+                self.volcado_terminado.notify_all()
+        for club_id in descargas:
+            # Si se volvió a pedir durante la escritura ya no está en expulsados
+            club = self.expulsados.get(club_id)
+            if club is not None and not club.pendientes:
+                del self.expulsados[club_id]
+        if lotes:
+            registros = sum(len(cambios) for _, cambios in lotes)
+            self.anotar_volcado(registros, mutaciones, time.perf_counter() - inicio)
+    
+    async def guardado(self):
+        """Espera a que esté escrito todo lo cambiado hasta ahora"""
+        if self.sucios:
+            objetivo = self.volcados_empezados + 1
+        elif self.volcados_empezados > self.volcados_terminados:
+            objetivo = self.volcados_empezados
+        else:
+            return
+        async with self.volcado_terminado:
+            await self.volcado_terminado.wait_for(lambda: self.volcados_terminados >= objetivo)
+    
+    async def ciclo_volcado(self):
+        """Tarea de fondo: agrupa los cambios y vuelca como mucho una vez cada INTERVALO_VOLCADO_MS"""
+        while True:
+            await self.hay_cambios.wait()
+            await asyncio.sleep(INTERVALO_VOLCADO_MS / 1000)
+            self.hay_cambios.clear()
+            try:
+                await self.volcar_async()
+            except Exception:
+                logger.exception("Error al volcar los datos de los clubes")
+    
+    async def iniciar(self):
+        """Arranca la tarea de volcado en el bucle de eventos actual"""
+        self.hay_cambios = asyncio.Event()
+        self.volcado_terminado = asyncio.Condition()
+        if self.sucios or self.expulsados:
+            self.hay_cambios.set()
+        self.tarea_volcado = asyncio.create_task(self.ciclo_volcado())
+    
+    async def cerrar(self):
+        """Detiene la tarea de volcado y escribe lo pendiente (al apagar o recibir SIGTERM)"""
+        if self.tarea_volcado:
+            self.tarea_volcado.cancel()
+            try:
+                await self.tarea_volcado
+            except asyncio.CancelledError:
+                pass
+            self.tarea_volcado = None
+        await self.volcar_async()
+        self.almacen.cerrar()
+        logger.info(
+            f"Persistencia: {self.estadisticas['volcados']} volcados, "
+            f"{self.estadisticas['mutaciones_agrupadas']} cambios, "
+            f"latencia máxima {self.estadisticas['latencia_max_ms']:.1f} ms; "
+            f"textos cacheados: {self.estadisticas['render_aciertos']} aciertos, "
+            f"{self.estadisticas['render_fallos']} fallos"
+        )
 
-# ==================== COMANDOS BÁSICOS ====================
+class AgregadorEncuestas:
+    """
+    Acumula en memoria las respuestas a encuestas nativas y las aplica por lotes,
+    como mucho una vez cada INTERVALO_VOLCADO_MS, club por club con el cerrojo de
+    cada uno. Si un usuario cambia varias veces de respuesta dentro del mismo lote
+    solo se aplica la última.
+    """
+    
+    def __init__(self, gestor):
+        self.gestor = gestor
+        # (encuesta, usuario) -> opciones elegidas
+        self.respuestas = {}
+        # Respuestas anotadas y aplicadas hasta ahora, para esperar a que se apliquen
+        self.anotadas = 0
+        self.aplicadas = 0
+        self.aplicado = None
+        self.hay_respuestas = None
+        self.tarea = None
+        self.estadisticas = {'respuestas': 0, 'aplicadas': 0, 'lotes': 0}
+    
+    def anotar(self, encuesta_id, user_id, opciones):
+        self.respuestas[(encuesta_id, user_id)] = list(opciones)
+        self.anotadas += 1
+        self.estadisticas['respuestas'] += 1
+        if self.hay_respuestas is not None:
+            self.hay_respuestas.set()
+    
+    async def aplicar(self):
+        """Aplica las respuestas acumuladas a los votos de cada club"""
+        hasta = self.anotadas
+        lote, self.respuestas = self.respuestas, {}
+        por_club = {}
+        try:
+            for encuesta_id, user_id in list(lote):
+                club_id = await self.gestor.club_de_encuesta(encuesta_id)
+                if club_id is None:
+                    del lote[(encuesta_id, user_id)]
+                else:
+                    por_club.setdefault(club_id, []).append((encuesta_id, user_id))
+            for club_id, claves in por_club.items():
+                async with self.gestor.cerrojo(club_id):
+                    club = await self.gestor.obtener(club_id)
+                    for clave in claves:
+                        club.responder_encuesta(*clave, lote.pop(clave))
+                        self.estadisticas['aplicadas'] += 1
+        except asyncio.CancelledError:
+            # Cortado a medias al cerrar: lo que falta vuelve a la cola sin pisar respuestas nuevas
+            lote.update(self.respuestas)
+            self.respuestas = lote
+            hasta = None
+            raise
+        finally:
+            # Con un error el lote se descarta igualmente: no se deja esperando a nadie
+            if hasta is not None:
+                self.aplicadas = hasta
+                if self.aplicado is not None:
+                    async with self.aplicado:
+                        self.aplicado.notify_all()
+        if por_club:
+            self.estadisticas['lotes'] += 1
+    
+    def aplicar_club(self, club):
+        """
+        Aplica ya las respuestas acumuladas de las encuestas de un club. Quien llama
+        tiene el cerrojo del club (p. ej. para cerrar la votación con todos los votos).
+        """
+        for clave in [c for c in self.respuestas if c[0] in club.data['encuestas']]:
+            club.responder_encuesta(*clave, self.respuestas.pop(clave))
+            self.estadisticas['aplicadas'] += 1
+    
+    async def aplicadas_todas(self):
+        """Espera a que se apliquen las respuestas anotadas hasta ahora"""
+        objetivo = self.anotadas
+        async with self.aplicado:
+            await self.aplicado.wait_for(lambda: self.aplicadas >= objetivo)
+    
+    async def ciclo(self):
+        while True:
+            await self.hay_respuestas.wait()
+            await asyncio.sleep(INTERVALO_VOLCADO_MS / 1000)
+            self.hay_respuestas.clear()
+            try:
+                await self.aplicar()
+            except Exception:
+                logger.exception("Error al aplicar respuestas de encuestas")
+    
+    async def iniciar(self):
+        self.hay_respuestas = asyncio.Event()
+        self.aplicado = asyncio.Condition()
+        self.tarea = asyncio.create_task(self.ciclo())
+    
+    async def cerrar(self):
+        if self.tarea:
+            self.tarea.cancel()
+            try:
+                await self.tarea
+            except asyncio.CancelledError:
+                pass
+            self.tarea = None
+        await self.aplicar()
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Mensaje de bienvenida"""
-    user = update.effective_user
+# Latencias y contadores del bot; ver metricas.py
+metricas = Metricas(METRICAS)
+# Clubes gestionados por el bot, uno por chat
+clubes = GestorClubes(crear_almacenamiento(os.getenv('ALMACENAMIENTO'), DATA_DIR, DATA_FILE))
+# Respuestas a encuestas nativas pendientes de aplicar
+respuestas_encuestas = AgregadorEncuestas(clubes)
+# Avisos privados a los miembros de cada club
+difusiones = MotorDifusion(clubes)
+# Recordatorios de reunión en el chat de cada club, con los mismos límites de envío
+recordatorios = PlanificadorRecordatorios(clubes, difusiones.enviar)
+
+def tamanos_secciones():
+    """Elementos de cada sección sumando todos los clubes en memoria"""
+    total = Counter()
+    for club in list(clubes.clubes.values()) + list(clubes.expulsados.values()):
+        for seccion, n in club.tamanos().items():
+            total[seccion] += n
+    return total
+
+metricas.agregar_fuente('persistencia', clubes.estadisticas)
+metricas.agregar_fuente('encuestas', respuestas_encuestas.estadisticas)
+metricas.agregar_fuente('difusion', difusiones.estadisticas)
+metricas.agregar_fuente('recordatorios', recordatorios.estadisticas)
+metricas.agregar_fuente('clubes', lambda: {'en_memoria': len(clubes.clubes), 'expulsados': len(clubes.expulsados)})
+metricas.agregar_fuente('seccion_elementos', tamanos_secciones, 'seccion')
+
+async def club_de(update: Update):
+    """Devuelve el club del chat de donde viene la actualización"""
+    return await clubes.obtener(update.effective_chat.id)
+
+def nombre_club(update: Update):
+    """Cómo se nombra al club en los avisos privados"""
+    titulo = update.effective_chat.title
+    return f"«{titulo}»" if titulo else "de lectura"
+
+def cambia_club(handler):
+    """
+    Los comandos que cambian un club se ejecutan de uno en uno dentro de ese club,
+    aunque esperen a Telegram a mitad de cambio. Las consultas no toman el cerrojo
+    y los demás chats no esperan, así que con actualizaciones concurrentes solo se
+    ordenan entre sí las escrituras de un mismo chat, en el orden en que llegan.
+    """
+    @functools.wraps(handler)
+    async def con_cerrojo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        async with clubes.cerrojo(update.effective_chat.id):
+            await handler(update, context)
+    return con_cerrojo
+
+async def iniciar_persistencia(application: Application):
+    """Arranca el volcado en segundo plano al iniciar la aplicación"""
+    await clubes.iniciar()
+    await respuestas_encuestas.iniciar()
+    await difusiones.iniciar(application.bot)
+    await recordatorios.iniciar()
+
+async def cerrar_persistencia(application: Application):
+    """Vuelca los cambios pendientes al detener la aplicación"""
+    await recordatorios.cerrar()
+    await difusiones.cerrar()
+    await respuestas_encuestas.cerrar()
+    await clubes.cerrar()
+
+async def iniciar_con_metricas(application: Application):
+    """Con polling no hay servidor HTTP: se abre uno solo para servir las métricas"""
+    await iniciar_persistencia(application)
+    servidor = ServidorHTTP([('GET', METRICAS_RUTA, metricas.ruta_http(METRICAS_TOKEN))])
+    await servidor.iniciar('0.0.0.0', PUERTO)
+    application.bot_data['servidor_metricas'] = servidor
+
+async def cerrar_con_metricas(application: Application):
+    await application.bot_data['servidor_metricas'].cerrar()
+    await cerrar_persistencia(application)
+
+# ==================== LISTADOS PAGINADOS ====================
+
+# Los textos largos se recortan para que una página quepa en un mensaje (4096 caracteres)
+LARGO_MAXIMO_ELEMENTO = 300
+
+def recortar(texto):
+    """Acorta un texto de usuario a LARGO_MAXIMO_ELEMENTO caracteres"""
+    if len(texto) <= LARGO_MAXIMO_ELEMENTO:
+        return texto
+    return texto[:LARGO_MAXIMO_ELEMENTO - 1] + '…'
+
+def recorrer(lista, desde, paso, filtro=None):
+    """
+    Genera (posición, elemento) de una lista empezando en una posición y avanzando
+    hacia delante (paso=1) o hacia atrás (paso=-1), sin copiarla.
+    """
+    i = desde
+    while 0 <= i < len(lista):
+        if filtro is None or filtro(lista[i]):
+            yield i, lista[i]
+        i += paso
+
+def linea_libro_leido(numero, libro):
+    return (
+        f"{numero}. {recortar(libro.titulo_autor)}\n"
+        f"   📅 {a_fecha(libro.fecha_fin).strftime('%B %Y')}\n"
+        f"   👤 {libro.sugerido_por}\n\n"
+    )
+
+def linea_pregunta(numero, p):
+    return f"{numero}. {recortar(p.pregunta)}\n   👤 {p.autor}\n\n"
+
+def linea_cita(numero, cita):
+    return f'"{recortar(cita.cita)}"\n— {cita.compartida_por}\n\n'
+
+# Listados con botones de anterior/siguiente. orden=-1 muestra primero lo más reciente.
+VISTAS = {
+    'historial': {
+        'seccion': 'libros_leidos',
+        'orden': -1,
+        'por_pagina': 10,
+        'filtro': None,
+        'cabecera': "📚 **Historial del Club de Lectura**\n\n",
+        'linea': linea_libro_leido,
+        'pie': "Total: {total} libros leídos 🎉",
+        'vacio': "📚 Aún no habéis terminado ningún libro juntos."
+    },
+    'preguntas': {
+        'seccion': 'discusiones',
+        'orden': 1,
+        'por_pagina': 10,
+        'filtro': lambda p: not p.respondida,
+        'cabecera': "💭 **Preguntas para Discutir**\n\n",
+        'linea': linea_pregunta,
+        'pie': "",
+        'vacio': "💬 No hay preguntas pendientes."
+    },
+    'citas': {
+        'seccion': 'citas',
+        'orden': -1,
+        'por_pagina': 5,
+        'filtro': None,
+        'cabecera': "📚 **Citas Compartidas**\n\n",
+        'linea': linea_cita,
+        'pie': "Total de citas: {total}",
+        'vacio': "📝 No hay citas compartidas aún."
+    }
+}
+
+def pagina(club, nombre, cursor=None):
+    """
+    Texto y botones de una página de un listado, o (None, None) si está vacío.
+    El cursor es la posición en la sección del primer elemento de la página; solo
+    se recorren los elementos de esa página y los justos para saber si hay más.
+    """
+    vista = VISTAS[nombre]
+    lista = club.data[vista['seccion']]
+    orden, por_pagina, filtro = vista['orden'], vista['por_pagina'], vista['filtro']
+    if cursor is None:
+        cursor = 0 if orden > 0 else len(lista) - 1
+    # Un botón antiguo puede apuntar fuera de una lista que ha cambiado
+    cursor = min(max(cursor, 0), len(lista) - 1)
+    
+    def generar():
+        elementos = list(islice(recorrer(lista, cursor, orden, filtro), por_pagina + 1))
+        if not elementos:
+            return None, None
+        
+        mensaje = vista['cabecera']
+        for posicion, elemento in elementos[:por_pagina]:
+            numero = posicion + 1 if orden > 0 else len(lista) - posicion
+            mensaje += vista['linea'](numero, elemento)
+        mensaje += vista['pie'].format(total=len(lista))
+        
+        botones = []
+        anteriores = list(islice(recorrer(lista, elementos[0][0] - orden, -orden, filtro), por_pagina))
+        if anteriores:
+            botones.append(InlineKeyboardButton(
+                "⬅️ Anterior", callback_data=f"pag_{nombre}_{anteriores[-1][0]}"
+            ))
+        if len(elementos) > por_pagina:
+            botones.append(InlineKeyboardButton(
+                "Siguiente ➡️", callback_data=f"pag_{nombre}_{elementos[por_pagina][0]}"
+            ))
+        return mensaje, InlineKeyboardMarkup([botones]) if botones else None
+    
+    return club.render((nombre, cursor), (vista['seccion'],), generar)
+
+async def enviar_listado(update: Update, nombre):
+    """Envía la primera página de un listado"""
+    club = await club_de(update)
+    mensaje, botones = pagina(club, nombre)
+    if mensaje is None:
+        await update.message.reply_text(VISTAS[nombre]['vacio'])
+        return
+    await update.message.reply_text(mensaje, reply_markup=botones, parse_mode='Markdown')
+
+async def paginar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cambiar de página en un listado"""
+    club = await club_de(update)
+    query = update.callback_query
     
-    # Registrar miembro si no existe
-    user_id = str(user.id)
-    if user_id not in bot_data.data['miembros']:
-        bot_data.data['miembros'][user_id] = {
-            'nombre': user.first_name,
-            'libros_leidos': 0,
-            'participaciones': 0,
-            'fecha_union': datetime.now().isoformat()
-        }
-        bot_data.guardar_datos()
+    # callback_data: pag_{listado}_{cursor}
+    partes = query.data.split('_')
+    try:
+        if len(partes) != 3 or partes[1] not in VISTAS:
+            raise ValueError(query.data)
+        nombre, cursor = partes[1], int(partes[2])
+    except ValueError:
+        await query.answer("⌛ Botón caducado. Vuelve a pedir el listado.")
+        return
     
-    mensaje = f"""
-📚 ¡Bienvenido al Club de Lectura, {user.first_name}!
+    mensaje, botones = pagina(club, nombre, cursor)
+    await query.answer()
+    try:
+        if mensaje is None:
+            await query.edit_message_text(VISTAS[nombre]['vacio'])
+        else:
+            await query.edit_message_text(mensaje, reply_markup=botones, parse_mode='Markdown')
+    except BadRequest as e:
+        # Pulsar dos veces el mismo botón deja el mensaje igual
+        logger.debug(f"Página sin cambios: {e}")
+
+# ==================== COMANDOS BÁSICOS ====================
+
+# Texto de /start y /ayuda; solo cambia el nombre del usuario
+MENSAJE_AYUDA = """
+📚 ¡Bienvenido al Club de Lectura, {nombre}!
 
 **Comandos disponibles:**
 
@@ -86,6 +1193,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /sugerir - Sugerir un libro para leer
 /votacion - Ver votación actual
 /libro_actual - Ver información del libro actual
+/progreso - Anotar por qué página vas y ver cómo va el club
+/paginas - Indicar cuántas páginas tiene el libro actual
 /historial - Ver libros leídos
 
 📅 **Reuniones:**
@@ -98,10 +1207,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /preguntas - Ver preguntas pendientes
 /cita - Compartir una cita del libro
 /citas - Ver citas compartidas
+/buscar - Buscar en citas, preguntas y libros leídos
 
 📊 **Estadísticas:**
 /mis_stats - Ver tus estadísticas
 /ranking - Ver ranking del club
+/estadisticas_club - Ver estadísticas del club
 
 ⚙️ **Admin:**
 /iniciar_votacion - Crear votación de libros
@@ -111,7 +1222,19 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 ℹ️ /ayuda - Ver esta ayuda
 """
-    await update.message.reply_text(mensaje, parse_mode='Markdown')
+
+@cambia_club
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mensaje de bienvenida"""
+    club = await club_de(update)
+    user = update.effective_user
+    
+    # Registrar miembro si no existe
+    club.agregar_miembro(user)
+    
+    await update.message.reply_text(
+        MENSAJE_AYUDA.format(nombre=user.first_name), parse_mode='Markdown'
+    )
 
 async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mostrar ayuda detallada"""
@@ -119,8 +1242,10 @@ async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ==================== SUGERENCIAS DE LIBROS ====================
 
+@cambia_club
 async def sugerir(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sugerir un libro para el club"""
+    club = await club_de(update)
     if not context.args:
         await update.message.reply_text(
             "📚 Para sugerir un libro, usa:\n"
@@ -132,39 +1257,62 @@ async def sugerir(update: Update, context: ContextTypes.DEFAULT_TYPE):
     sugerencia = ' '.join(context.args)
     user = update.effective_user
     
-    libro = {
-        'titulo_autor': sugerencia,
-        'sugerido_por': user.first_name,
-        'user_id': user.id,
-        'fecha': datetime.now().isoformat(),
-        'votos': 0
-    }
+    # Un mismo libro escrito de otra forma partiría los votos
+    parecido = club.libro_parecido(sugerencia)
+    if parecido is not None and parecido[0] == 'libros_sugeridos':
+        await update.message.reply_text(
+            f"⚠️ Ese libro ya está sugerido:\n\n"
+            f"📖 {parecido[1].titulo_autor}\n"
+            f"👤 Sugerido por: {parecido[1].sugerido_por}"
+        )
+        return
+    
+    libro = Sugerencia(
+        titulo_autor=sugerencia,
+        sugerido_por=user.first_name,
+        user_id=user.id,
+        fecha=ahora()
+    )
     
-    bot_data.data['libros_sugeridos'].append(libro)
-    bot_data.guardar_datos()
+    club.agregar_sugerencia(libro)
+    club.sumar_a_miembro(str(user.id), 'sugerencias')
+    
+    aviso = ""
+    if parecido is not None:
+        aviso = f"\n\n⚠️ Ojo: el club ya leyó «{parecido[1].titulo_autor}»."
     
     await update.message.reply_text(
         f"✅ ¡Libro sugerido!\n\n"
         f"📖 {sugerencia}\n"
         f"👤 Sugerido por: {user.first_name}\n\n"
-        f"Total de sugerencias: {len(bot_data.data['libros_sugeridos'])}"
+        f"Total de sugerencias: {len(club.data['libros_sugeridos'])}"
+        f"{aviso}"
     )
 
 # ==================== VOTACIONES ====================
 
+@cambia_club
 async def iniciar_votacion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Iniciar votación para elegir próximo libro"""
-    if not bot_data.data['libros_sugeridos']:
+    club = await club_de(update)
+    if not club.data['libros_sugeridos']:
         await update.message.reply_text("❌ No hay libros sugeridos para votar.")
         return
     
+    votacion_id = club.abrir_votacion()
+    
+    modo = context.args[0].lower() if context.args else MODO_VOTACION
+    if modo == 'encuesta' and len(club.data['libros_sugeridos']) >= 2:
+        await publicar_encuestas(update, context, club, votacion_id)
+        return
+    
     # Crear botones para cada libro
     keyboard = []
-    for idx, libro in enumerate(bot_data.data['libros_sugeridos']):
+    for libro in club.data['libros_sugeridos']:
         keyboard.append([
             InlineKeyboardButton(
-                f"📚 {libro['titulo_autor'][:50]}",
-                callback_data=f"vote_{idx}"
+                f"📚 {libro.titulo_autor[:50]}",
+                callback_data=f"vote_{votacion_id}_{libro.id}"
             )
         ])
     
@@ -173,175 +1321,345 @@ async def iniciar_votacion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     mensaje = "🗳️ **VOTACIÓN ABIERTA**\n\n"
     mensaje += "Elige el próximo libro del club:\n\n"
     
-    for idx, libro in enumerate(bot_data.data['libros_sugeridos'], 1):
-        mensaje += f"{idx}. {libro['titulo_autor']}\n"
-        mensaje += f"   Sugerido por: {libro['sugerido_por']}\n"
-        mensaje += f"   Votos: {libro.get('votos', 0)}\n\n"
+    for idx, libro in enumerate(club.data['libros_sugeridos'], 1):
+        mensaje += f"{idx}. {libro.titulo_autor}\n"
+        mensaje += f"   Sugerido por: {libro.sugerido_por}\n"
+        mensaje += f"   Votos: {libro.votos}\n\n"
+    
+    mensaje += "Pulsa otra vez tu opción para retirar el voto."
     
     await update.message.reply_text(mensaje, reply_markup=reply_markup, parse_mode='Markdown')
 
+async def publicar_encuestas(update: Update, context: ContextTypes.DEFAULT_TYPE, club, votacion_id):
+    """Publica las sugerencias como encuestas nativas de hasta 10 opciones cada una"""
+    sugeridos = club.data['libros_sugeridos']
+    # Trozos de tamaño parecido para que ninguno se quede con una sola opción
+    num_encuestas = -(-len(sugeridos) // Poll.MAX_OPTION_NUMBER)
+    base, resto = divmod(len(sugeridos), num_encuestas)
+    
+    inicio = 0
+    for n in range(num_encuestas):
+        fin = inicio + base + (1 if n < resto else 0)
+        trozo = sugeridos[inicio:fin]
+        inicio = fin
+        
+        pregunta = "🗳️ Elige el próximo libro del club"
+        if num_encuestas > 1:
+            pregunta += f" ({n + 1}/{num_encuestas})"
+        enviado = await context.bot.send_poll(
+            update.effective_chat.id,
+            pregunta,
+            [libro.titulo_autor[:Poll.MAX_OPTION_LENGTH] for libro in trozo],
+            is_anonymous=False
+        )
+        club.agregar_encuesta(
+            enviado.poll.id, votacion_id, [libro.id for libro in trozo],
+            enviado.chat_id, enviado.message_id
+        )
+        await clubes.registrar_encuesta(enviado.poll.id, club.club_id)
+    
+    if num_encuestas > 1:
+        await update.message.reply_text(
+            "ℹ️ Hay varias encuestas: solo cuenta tu última respuesta."
+        )
+
+async def respuesta_encuesta(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Acumular respuestas a encuestas nativas; se aplican por lotes"""
+    respuesta = update.poll_answer
+    respuestas_encuestas.anotar(respuesta.poll_id, respuesta.user.id, respuesta.option_ids)
+
+@cambia_club
 async def votar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manejar votos en la votación"""
+    club = await club_de(update)
     query = update.callback_query
-    await query.answer()
     
-    # Extraer índice del libro
-    idx = int(query.data.split('_')[1])
+    # callback_data: vote_{votacion}_{sugerencia}
+    partes = query.data.split('_')
+    if len(partes) != 3:
+        await query.answer("Esta votación es de una versión anterior. Usa /iniciar_votacion.")
+        return
+    try:
+        votacion_id, sugerencia_id = partes[1], int(partes[2])
+    except ValueError:
+        await query.answer("⌛ Botón caducado. Usa /votacion para ver la votación abierta.")
+        return
     user = query.from_user
     
-    # Incrementar voto
-    if idx < len(bot_data.data['libros_sugeridos']):
-        bot_data.data['libros_sugeridos'][idx]['votos'] = \
-            bot_data.data['libros_sugeridos'][idx].get('votos', 0) + 1
-        bot_data.guardar_datos()
-        
-        libro = bot_data.data['libros_sugeridos'][idx]
-        await query.edit_message_text(
-            f"✅ ¡Voto registrado!\n\n"
-            f"📚 {libro['titulo_autor']}\n"
-            f"Votos totales: {libro['votos']}"
-        )
+    if votacion_id != club.votacion_abierta():
+        await query.answer("❌ Esta votación ya está cerrada.")
+        return
+    libro = club.sugerencia(sugerencia_id)
+    if libro is None:
+        await query.answer("❌ Ese libro ya no está en la votación.")
+        return
+    
+    resultado = club.votar(votacion_id, user.id, sugerencia_id)
+    avisos = {
+        'registrado': "✅ ¡Voto registrado!",
+        'cambiado': "🔄 Voto cambiado",
+        'retirado': "↩️ Voto retirado"
+    }
+    await query.answer(avisos[resultado])
+    
+    await query.edit_message_text(
+        f"{avisos[resultado]}\n\n"
+        f"📚 {libro.titulo_autor}\n"
+        f"Votos totales: {libro.votos}",
+        reply_markup=query.message.reply_markup
+    )
 
 async def votacion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ver estado actual de la votación"""
-    if not bot_data.data['libros_sugeridos']:
+    club = await club_de(update)
+    if not club.data['libros_sugeridos']:
         await update.message.reply_text("📚 No hay libros sugeridos actualmente.")
         return
     
-    # Ordenar por votos
-    libros_ordenados = sorted(
-        bot_data.data['libros_sugeridos'],
-        key=lambda x: x.get('votos', 0),
-        reverse=True
-    )
-    
-    mensaje = "🗳️ **Estado de la Votación**\n\n"
-    for idx, libro in enumerate(libros_ordenados, 1):
-        votos = libro.get('votos', 0)
-        barra = '█' * votos + '░' * (10 - min(votos, 10))
-        mensaje += f"{idx}. {libro['titulo_autor']}\n"
-        mensaje += f"   👤 {libro['sugerido_por']}\n"
-        mensaje += f"   🗳️ {barra} {votos} votos\n\n"
-    
+    # Las respuestas a encuestas nativas aparecen al aplicarse su lote (INTERVALO_VOLCADO_MS)
+    def generar():
+        # El recuento ya está ordenado por votos
+        mensaje = "🗳️ **Estado de la Votación**\n\n"
+        for idx, (sugerencia_id, votos) in enumerate(club.recuento.clasificacion(), 1):
+            libro = club.sugerencia(sugerencia_id)
+            barra = '█' * min(votos, 10) + '░' * (10 - min(votos, 10))
+            mensaje += f"{idx}. {libro.titulo_autor}\n"
+            mensaje += f"   👤 {libro.sugerido_por}\n"
+            mensaje += f"   🗳️ {barra} {votos} votos\n\n"
+        return mensaje
+    
+    mensaje = club.render('votacion', ('libros_sugeridos',), generar)
     await update.message.reply_text(mensaje, parse_mode='Markdown')
 
+@cambia_club
 async def finalizar_votacion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Finalizar votación y anunciar ganador"""
-    if not bot_data.data['libros_sugeridos']:
+    club = await club_de(update)
+    if not club.data['libros_sugeridos']:
         await update.message.reply_text("❌ No hay votación activa.")
         return
     
-    # Encontrar libro con más votos
-    ganador = max(bot_data.data['libros_sugeridos'], key=lambda x: x.get('votos', 0))
+    respuestas_encuestas.aplicar_club(club)
+    votacion_id = club.votacion_abierta()
+    if votacion_id is not None:
+        club.cerrar_votacion(votacion_id)
+        for encuesta in club.data['encuestas'].values():
+            if encuesta['votacion'] == votacion_id:
+                try:
+                    await context.bot.stop_poll(encuesta['chat_id'], encuesta['message_id'])
+                except TelegramError as e:
+                    logger.warning(f"No se pudo cerrar la encuesta: {e}")
+    
+    # Libro con más votos
+    ganador = club.ganador()
     
     mensaje = f"🏆 **VOTACIÓN FINALIZADA**\n\n"
     mensaje += f"El libro ganador es:\n\n"
-    mensaje += f"📚 **{ganador['titulo_autor']}**\n"
-    mensaje += f"👤 Sugerido por: {ganador['sugerido_por']}\n"
-    mensaje += f"🗳️ Votos: {ganador.get('votos', 0)}\n\n"
+    mensaje += f"📚 **{ganador.titulo_autor}**\n"
+    mensaje += f"👤 Sugerido por: {ganador.sugerido_por}\n"
+    mensaje += f"🗳️ Votos: {ganador.votos}\n\n"
     mensaje += f"Usa /seleccionar_libro para marcarlo como libro actual."
     
     await update.message.reply_text(mensaje, parse_mode='Markdown')
 
 # ==================== GESTIÓN DE LIBRO ACTUAL ====================
 
+@cambia_club
 async def seleccionar_libro(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Seleccionar el libro actual del club"""
-    if not bot_data.data['libros_sugeridos']:
+    club = await club_de(update)
+    if not club.data['libros_sugeridos']:
         await update.message.reply_text("❌ No hay libros sugeridos.")
         return
     
     # Tomar el libro con más votos
-    ganador = max(bot_data.data['libros_sugeridos'], key=lambda x: x.get('votos', 0))
+    ganador = club.ganador()
     
-    bot_data.data['libro_actual'] = {
-        **ganador,
-        'fecha_inicio': datetime.now().isoformat(),
-        'paginas_totales': None,
-        'progreso': {}
-    }
+    club.data['libro_actual'] = Libro.elegido(ganador, ahora())
+    club.registrar('libro_actual')
+    club.vaciar_progreso()
     
-    # Limpiar sugerencias
-    bot_data.data['libros_sugeridos'] = []
-    bot_data.guardar_datos()
+    # Limpiar sugerencias y votaciones
+    club.vaciar_sugerencias()
     
     await update.message.reply_text(
         f"📖 **Nuevo libro del club:**\n\n"
-        f"📚 {ganador['titulo_autor']}\n"
-        f"👤 Sugerido por: {ganador['sugerido_por']}\n\n"
+        f"📚 {ganador.titulo_autor}\n"
+        f"👤 Sugerido por: {ganador.sugerido_por}\n\n"
         f"¡Feliz lectura a todos! 📚✨"
     )
 
 async def libro_actual(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mostrar información del libro actual"""
-    if not bot_data.data['libro_actual']:
+    club = await club_de(update)
+    if not club.data['libro_actual']:
         await update.message.reply_text("📚 No hay un libro actual seleccionado.")
         return
     
-    libro = bot_data.data['libro_actual']
-    fecha_inicio = datetime.fromisoformat(libro['fecha_inicio'])
-    dias_leyendo = (datetime.now() - fecha_inicio).days
-    
+    libro = club.data['libro_actual']
     mensaje = f"📖 **Libro Actual del Club**\n\n"
-    mensaje += f"📚 {libro['titulo_autor']}\n"
-    mensaje += f"👤 Sugerido por: {libro['sugerido_por']}\n"
-    mensaje += f"📅 Inicio: {fecha_inicio.strftime('%d/%m/%Y')}\n"
-    mensaje += f"⏳ Días leyendo: {dias_leyendo}\n"
+    mensaje += f"📚 {libro.titulo_autor}\n"
+    mensaje += f"👤 Sugerido por: {libro.sugerido_por}\n"
+    mensaje += f"📅 Inicio: {a_fecha(libro.fecha_inicio).strftime('%d/%m/%Y')}\n"
+    mensaje += f"⏳ Días leyendo: {dias_desde(libro.fecha_inicio)}\n"
     
-    if bot_data.data['proxima_reunion']:
-        reunion = datetime.fromisoformat(bot_data.data['proxima_reunion'])
+    if club.data['proxima_reunion']:
+        reunion = datetime.fromisoformat(club.data['proxima_reunion'])
         mensaje += f"\n📅 Próxima reunión: {reunion.strftime('%d/%m/%Y a las %H:%M')}\n"
     
     await update.message.reply_text(mensaje, parse_mode='Markdown')
 
+@cambia_club
+async def paginas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Indicar cuántas páginas tiene el libro actual"""
+    club = await club_de(update)
+    libro = club.data['libro_actual']
+    if not libro:
+        await update.message.reply_text("❌ No hay libro actual.")
+        return
+    if not context.args or not context.args[0].isdigit() or int(context.args[0]) == 0:
+        await update.message.reply_text(
+            "📄 Para indicar cuántas páginas tiene el libro actual, usa:\n"
+            "/paginas [total]\n\n"
+            "Ejemplo: /paginas 432"
+        )
+        return
+    
+    total = int(context.args[0])
+    club.fijar_paginas(total)
+    await update.message.reply_text(
+        f"📄 «{libro.titulo_autor}» tiene {total} páginas.\n"
+        f"Anotad por dónde vais con /progreso [página]."
+    )
+
+def texto_progreso(club):
+    """Resumen del progreso del club en el libro actual"""
+    libro = club.data['libro_actual']
+    resumen = club.resumen_progreso()
+    total = resumen['total']
+    texto = f"📖 Progreso del club en «{libro.titulo_autor}»\n\n"
+    if not resumen['lectores']:
+        return texto + "Nadie ha anotado aún su progreso. Usa /progreso [página]."
+    
+    def pagina(numero):
+        return f"página {numero} ({numero * 100 // total}%)" if total else f"página {numero}"
+    
+    texto += f"👥 Lectores con progreso: {resumen['lectores']}\n"
+    texto += f"📍 Mediana: {pagina(resumen['mediana'])}\n"
+    texto += f"📊 La mitad del club va entre la página {resumen['p25']} y la {resumen['p75']}\n"
+    if total is None:
+        return texto + "\nℹ️ Indica las páginas del libro con /paginas [total] para ver cuándo terminaréis."
+    texto += f"🏁 Lo han terminado: {resumen['terminados']}\n"
+    
+    if resumen['fin_estimado'] is not None:
+        texto += f"📅 Al ritmo de la mediana terminaréis hacia el {a_fecha(resumen['fin_estimado']).strftime('%d/%m/%Y')}"
+        if club.data['proxima_reunion']:
+            antes = resumen['fin_estimado'] <= a_epoca(club.data['proxima_reunion'])
+            texto += ", antes de la reunión ✅" if antes else ", después de la reunión ⚠️"
+        texto += "\n"
+    
+    if resumen['atrasados']:
+        objetivo = resumen['pagina_objetivo']
+        atrasados = [
+            club.data['miembros'][user_id].nombre
+            for user_id, numero in club.indice_progreso.ultimos(3)
+            if numero < objetivo and user_id in club.data['miembros']
+        ]
+        texto += (
+            f"🐢 {resumen['atrasados']} van por detrás de la página {objetivo}, la que toca hoy "
+            f"para llegar a la reunión: {', '.join(atrasados)}"
+            f"{'...' if resumen['atrasados'] > len(atrasados) else ''}\n"
+        )
+    return texto
+
+@cambia_club
+async def progreso(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Anotar por qué página vas del libro actual y ver cómo va el club"""
+    club = await club_de(update)
+    libro = club.data['libro_actual']
+    if not libro:
+        await update.message.reply_text("📚 No hay un libro actual seleccionado.")
+        return
+    
+    mensaje = ""
+    if context.args:
+        if not context.args[0].isdigit():
+            await update.message.reply_text(
+                "📖 Para anotar por dónde vas, usa:\n"
+                "/progreso [página]\n\n"
+                "Ejemplo: /progreso 120\n"
+                "Sin página muestra el progreso del club."
+            )
+            return
+        user = update.effective_user
+        user_id = str(user.id)
+        pagina = int(context.args[0])
+        if libro.paginas_totales is not None:
+            pagina = min(pagina, libro.paginas_totales)
+        club.agregar_miembro(user)
+        club.fijar_progreso(user_id, pagina)
+        
+        mensaje = f"✅ {user.first_name}, vas por la página {pagina}"
+        if libro.paginas_totales:
+            mensaje += f" de {libro.paginas_totales} ({pagina * 100 // libro.paginas_totales}%)"
+        indice = club.indice_progreso
+        mensaje += f"\n📍 Puesto #{indice.posicion(user_id)} de {len(indice)} lectores\n\n"
+    
+    mensaje += texto_progreso(club)
+    # Sin Markdown: los títulos y nombres pueden llevar asteriscos o guiones bajos
+    await update.message.reply_text(mensaje)
+
+@cambia_club
 async def terminar_libro(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Marcar libro actual como terminado"""
-    if not bot_data.data['libro_actual']:
+    club = await club_de(update)
+    if not club.data['libro_actual']:
         await update.message.reply_text("❌ No hay libro actual.")
         return
     
-    libro = bot_data.data['libro_actual']
-    libro['fecha_fin'] = datetime.now().isoformat()
+    libro = club.data['libro_actual']
+    libro.fecha_fin = ahora()
+    # El progreso de cada miembro se queda en el libro del historial
+    libro.progreso = dict(club.data['progreso'])
     
     # Mover a historial
-    bot_data.data['libros_leidos'].append(libro)
-    bot_data.data['libro_actual'] = None
+    club.agregar('libros_leidos', libro)
+    club.data['libro_actual'] = None
+    club.registrar('libro_actual')
+    club.vaciar_progreso()
     
     # Actualizar estadísticas de miembros
-    for user_id in bot_data.data['miembros']:
-        bot_data.data['miembros'][user_id]['libros_leidos'] += 1
-    
-    bot_data.guardar_datos()
+    if context.args and context.args[0].lower() == 'confirmados':
+        # Solo quienes confirmaron asistencia o anotaron su progreso
+        lectores = set(club.data['asistentes']) | set(libro.progreso or {})
+        club.terminar_libro_para(lectores & set(club.data['miembros']))
+        felicitacion = f"¡Felicitaciones a los {len(lectores)} lectores! 🎉"
+    else:
+        club.terminar_libro_para_todos()
+        felicitacion = "¡Felicitaciones a todos! 🎉"
     
     await update.message.reply_text(
         f"✅ **Libro terminado y añadido al historial**\n\n"
-        f"📚 {libro['titulo_autor']}\n\n"
-        f"¡Felicitaciones a todos! 🎉\n"
-        f"Total de libros leídos: {len(bot_data.data['libros_leidos'])}"
+        f"📚 {libro.titulo_autor}\n\n"
+        f"{felicitacion}\n"
+        f"Total de libros leídos: {len(club.data['libros_leidos'])}"
+    )
+    await difusiones.anunciar(
+        club,
+        f"📚 El club {nombre_club(update)} ha terminado «{libro.titulo_autor}». "
+        f"¡Enhorabuena! Mira el historial con /historial en el grupo."
     )
 
 async def historial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mostrar historial de libros leídos"""
-    if not bot_data.data['libros_leidos']:
-        await update.message.reply_text("📚 Aún no habéis terminado ningún libro juntos.")
-        return
-    
-    mensaje = "📚 **Historial del Club de Lectura**\n\n"
-    
-    for idx, libro in enumerate(reversed(bot_data.data['libros_leidos']), 1):
-        fecha_fin = datetime.fromisoformat(libro['fecha_fin'])
-        mensaje += f"{idx}. {libro['titulo_autor']}\n"
-        mensaje += f"   📅 {fecha_fin.strftime('%B %Y')}\n"
-        mensaje += f"   👤 {libro['sugerido_por']}\n\n"
-    
-    mensaje += f"Total: {len(bot_data.data['libros_leidos'])} libros leídos 🎉"
-    
-    await update.message.reply_text(mensaje, parse_mode='Markdown')
+    await enviar_listado(update, 'historial')
 
 # ==================== REUNIONES ====================
 
+@cambia_club
 async def programar_reunion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Programar próxima reunión"""
+    club = await club_de(update)
     if len(context.args) < 2:
         await update.message.reply_text(
             "📅 Para programar una reunión, usa:\n"
@@ -355,9 +1673,8 @@ async def programar_reunion(update: Update, context: ContextTypes.DEFAULT_TYPE):
         hora_str = context.args[1]
         
         fecha_reunion = datetime.strptime(f"{fecha_str} {hora_str}", "%d/%m/%Y %H:%M")
-        bot_data.data['proxima_reunion'] = fecha_reunion.isoformat()
-        bot_data.data['confirmaciones'] = []
-        bot_data.guardar_datos()
+        club.programar_reunion(fecha_reunion.isoformat())
+        await recordatorios.programar(club.club_id, fecha_reunion.isoformat())
         
         await update.message.reply_text(
             f"✅ **Reunión programada**\n\n"
@@ -365,57 +1682,78 @@ async def programar_reunion(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"🕐 {fecha_reunion.strftime('%H:%M')}\n\n"
             f"Usa /confirmar para confirmar tu asistencia."
         )
+        await difusiones.anunciar(
+            club,
+            f"📅 Nueva reunión del club {nombre_club(update)}: "
+            f"{fecha_reunion.strftime('%d/%m/%Y a las %H:%M')}.\n"
+            f"Confirma tu asistencia con /confirmar en el grupo."
+        )
         
     except ValueError:
         await update.message.reply_text("❌ Formato de fecha incorrecto. Usa DD/MM/YYYY HH:MM")
 
 async def proxima_reunion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ver información de la próxima reunión"""
-    if not bot_data.data.get('proxima_reunion'):
+    club = await club_de(update)
+    if not club.data.get('proxima_reunion'):
         await update.message.reply_text("📅 No hay reunión programada actualmente.")
         return
     
-    reunion = datetime.fromisoformat(bot_data.data['proxima_reunion'])
+    def generar():
+        # Lo único que cambia con la hora es la cuenta de días, que se calcula aparte
+        reunion = datetime.fromisoformat(club.data['proxima_reunion'])
+        cabecera = f"📅 **Próxima Reunión**\n\n"
+        cabecera += f"🗓️ {reunion.strftime('%d de %B de %Y')}\n"
+        cabecera += f"🕐 {reunion.strftime('%H:%M')}\n"
+        
+        confirmados = ""
+        confirmaciones = club.data.get('confirmaciones', [])
+        if confirmaciones:
+            confirmados += f"✅ Confirmados ({len(confirmaciones)}):\n"
+            for conf in confirmaciones:
+                confirmados += f"   • {conf}\n"
+        return reunion, cabecera, confirmados
+    
+    reunion, cabecera, confirmados = club.render(
+        'proxima_reunion', ('proxima_reunion', 'confirmaciones'), generar
+    )
     dias_faltantes = (reunion - datetime.now()).days
-    
-    mensaje = f"📅 **Próxima Reunión**\n\n"
-    mensaje += f"🗓️ {reunion.strftime('%d de %B de %Y')}\n"
-    mensaje += f"🕐 {reunion.strftime('%H:%M')}\n"
-    mensaje += f"⏳ Faltan {dias_faltantes} días\n\n"
-    
-    confirmaciones = bot_data.data.get('confirmaciones', [])
-    if confirmaciones:
-        mensaje += f"✅ Confirmados ({len(confirmaciones)}):\n"
-        for conf in confirmaciones:
-            mensaje += f"   • {conf}\n"
+    mensaje = cabecera + f"⏳ Faltan {dias_faltantes} días\n\n" + confirmados
     
     await update.message.reply_text(mensaje, parse_mode='Markdown')
 
+@cambia_club
 async def confirmar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Confirmar asistencia a la reunión"""
-    if not bot_data.data.get('proxima_reunion'):
+    club = await club_de(update)
+    if not club.data.get('proxima_reunion'):
         await update.message.reply_text("❌ No hay reunión programada.")
         return
     
     user = update.effective_user
-    if 'confirmaciones' not in bot_data.data:
-        bot_data.data['confirmaciones'] = []
-    
-    if user.first_name not in bot_data.data['confirmaciones']:
-        bot_data.data['confirmaciones'].append(user.first_name)
-        bot_data.guardar_datos()
+    user_id = str(user.id)
+    if 'confirmaciones' not in club.data:
+        club.data['confirmaciones'] = []
+    
+    if user_id not in club.data['asistentes']:
+        club.data['asistentes'][user_id] = user.first_name
+        club.registrar('asistentes', user_id)
+        club.agregar('confirmaciones', user.first_name)
+        club.sumar_a_miembro(user_id, 'participaciones')
         
         await update.message.reply_text(
             f"✅ ¡Asistencia confirmada, {user.first_name}!\n"
-            f"Total confirmados: {len(bot_data.data['confirmaciones'])}"
+            f"Total confirmados: {len(club.data['confirmaciones'])}"
         )
     else:
         await update.message.reply_text("Ya habías confirmado tu asistencia. 😊")
 
 # ==================== DISCUSIÓN ====================
 
+@cambia_club
 async def pregunta(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Agregar pregunta para discutir"""
+    club = await club_de(update)
     if not context.args:
         await update.message.reply_text(
             "💬 Para agregar una pregunta, usa:\n"
@@ -427,15 +1765,16 @@ async def pregunta(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pregunta_texto = ' '.join(context.args)
     user = update.effective_user
     
-    pregunta_obj = {
-        'pregunta': pregunta_texto,
-        'autor': user.first_name,
-        'fecha': datetime.now().isoformat(),
-        'respondida': False
-    }
+    pregunta_obj = Pregunta(
+        pregunta=pregunta_texto,
+        autor=user.first_name,
+        user_id=user.id,
+        fecha=ahora(),
+        respondida=False
+    )
     
-    bot_data.data['discusiones'].append(pregunta_obj)
-    bot_data.guardar_datos()
+    club.agregar('discusiones', pregunta_obj)
+    club.sumar_a_miembro(str(user.id), 'participaciones')
     
     await update.message.reply_text(
         f"✅ Pregunta añadida:\n\n"
@@ -445,22 +1784,12 @@ async def pregunta(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def preguntas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ver preguntas pendientes"""
-    preguntas_pendientes = [p for p in bot_data.data['discusiones'] if not p['respondida']]
-    
-    if not preguntas_pendientes:
-        await update.message.reply_text("💬 No hay preguntas pendientes.")
-        return
-    
-    mensaje = "💭 **Preguntas para Discutir**\n\n"
-    
-    for idx, p in enumerate(preguntas_pendientes, 1):
-        mensaje += f"{idx}. {p['pregunta']}\n"
-        mensaje += f"   👤 {p['autor']}\n\n"
-    
-    await update.message.reply_text(mensaje, parse_mode='Markdown')
+    await enviar_listado(update, 'preguntas')
 
+@cambia_club
 async def cita(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Compartir una cita del libro"""
+    club = await club_de(update)
     if not context.args:
         await update.message.reply_text(
             "📝 Para compartir una cita, usa:\n"
@@ -472,14 +1801,15 @@ async def cita(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cita_texto = ' '.join(context.args)
     user = update.effective_user
     
-    cita_obj = {
-        'cita': cita_texto,
-        'compartida_por': user.first_name,
-        'fecha': datetime.now().isoformat()
-    }
+    cita_obj = Cita(
+        cita=cita_texto,
+        compartida_por=user.first_name,
+        user_id=user.id,
+        fecha=ahora()
+    )
     
-    bot_data.data['citas'].append(cita_obj)
-    bot_data.guardar_datos()
+    club.agregar('citas', cita_obj)
+    club.sumar_a_miembro(str(user.id), 'citas')
     
     await update.message.reply_text(
         f"📖 **Cita compartida**\n\n"
@@ -489,86 +1819,411 @@ async def cita(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def citas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ver citas compartidas"""
-    if not bot_data.data['citas']:
-        await update.message.reply_text("📝 No hay citas compartidas aún.")
+    await enviar_listado(update, 'citas')
+
+# Resultados por página de /buscar
+RESULTADOS_POR_PAGINA = 10
+# Cómo se muestra un resultado de cada sección
+ICONOS_BUSQUEDA = {'citas': '📝', 'discusiones': '💭', 'libros_leidos': '📚'}
+
+def pagina_busqueda(club, consulta, numero=0):
+    """
+    Texto y botones de una página de resultados de /buscar, o (None, None) si no
+    hay resultados. La consulta viaja normalizada en los botones.
+    """
+    consulta = ' '.join(terminos(consulta))
+    
+    def generar():
+        desde = numero * RESULTADOS_POR_PAGINA
+        hasta = desde + RESULTADOS_POR_PAGINA + 1
+        resultados = list(islice(club.buscar(consulta, hasta), desde, hasta))
+        if not resultados:
+            return None, None
+        
+        mensaje = f"🔎 **Resultados para «{consulta}»**\n\n"
+        for seccion, elemento in resultados[:RESULTADOS_POR_PAGINA]:
+            texto = recortar(getattr(elemento, TEXTOS_BUSCABLES[seccion]))
+            mensaje += f"{ICONOS_BUSQUEDA[seccion]} {texto}\n\n"
+        
+        botones = []
+        if numero > 0:
+            botones.append(InlineKeyboardButton(
+                "⬅️ Anterior", callback_data=f"bus_{numero - 1}_{consulta}"
+            ))
+        if len(resultados) > RESULTADOS_POR_PAGINA:
+            botones.append(InlineKeyboardButton(
+                "Siguiente ➡️", callback_data=f"bus_{numero + 1}_{consulta}"
+            ))
+        # Telegram limita callback_data a 64 bytes; una consulta más larga se queda en una página
+        if any(len(b.callback_data.encode()) > 64 for b in botones):
+            botones = []
+            mensaje += "Hay más resultados: concreta más la búsqueda."
+        return mensaje, InlineKeyboardMarkup([botones]) if botones else None
+    
+    return club.render(('buscar', consulta, numero), ('terminos',), generar)
+
+async def buscar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Buscar en citas, preguntas e historial"""
+    club = await club_de(update)
+    if not context.args:
+        await update.message.reply_text(
+            "🔎 Para buscar en citas, preguntas y libros leídos, usa:\n"
+            "/buscar [palabras]\n\n"
+            "Ejemplo: /buscar garcia marquez"
+        )
         return
     
-    # Mostrar últimas 5 citas
-    ultimas_citas = bot_data.data['citas'][-5:]
-    
-    mensaje = "📚 **Citas Compartidas**\n\n"
-    
-    for cita in reversed(ultimas_citas):
-        mensaje += f'"{cita["cita"]}"\n'
-        mensaje += f"— {cita['compartida_por']}\n\n"
-    
-    mensaje += f"Total de citas: {len(bot_data.data['citas'])}"
+    mensaje, botones = pagina_busqueda(club, ' '.join(context.args))
+    if mensaje is None:
+        await update.message.reply_text("🔎 No hay resultados para esa búsqueda.")
+        return
+    await update.message.reply_text(mensaje, reply_markup=botones, parse_mode='Markdown')
+
+async def buscar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cambiar de página en los resultados de /buscar"""
+    club = await club_de(update)
+    query = update.callback_query
     
-    await update.message.reply_text(mensaje, parse_mode='Markdown')
+    # callback_data: bus_{pagina}_{consulta}
+    partes = query.data.split('_', 2)
+    try:
+        if len(partes) != 3:
+            raise ValueError(query.data)
+        numero, consulta = int(partes[1]), partes[2]
+        if numero < 0:
+            raise ValueError(query.data)
+    except ValueError:
+        await query.answer("⌛ Botón caducado. Vuelve a usar /buscar.")
+        return
+    mensaje, botones = pagina_busqueda(club, consulta, numero)
+    await query.answer()
+    try:
+        if mensaje is None:
+            await query.edit_message_text("🔎 No hay resultados para esa búsqueda.")
+        else:
+            await query.edit_message_text(mensaje, reply_markup=botones, parse_mode='Markdown')
+    except BadRequest as e:
+        logger.debug(f"Página sin cambios: {e}")
 
 # ==================== ESTADÍSTICAS ====================
 
 async def mis_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ver estadísticas personales"""
+    club = await club_de(update)
     user = update.effective_user
     user_id = str(user.id)
     
-    if user_id not in bot_data.data['miembros']:
+    if user_id not in club.data['miembros']:
         await update.message.reply_text("❌ No estás registrado en el club.")
         return
     
-    stats = bot_data.data['miembros'][user_id]
-    fecha_union = datetime.fromisoformat(stats['fecha_union'])
-    dias_miembro = (datetime.now() - fecha_union).days
-    
+    stats = club.data['miembros'][user_id]
     mensaje = f"📊 **Tus Estadísticas**\n\n"
     mensaje += f"👤 {user.first_name}\n"
-    mensaje += f"📅 Miembro desde: {fecha_union.strftime('%d/%m/%Y')}\n"
-    mensaje += f"⏳ Días en el club: {dias_miembro}\n"
-    mensaje += f"📚 Libros leídos: {stats['libros_leidos']}\n"
-    mensaje += f"💬 Participaciones: {stats.get('participaciones', 0)}\n"
+    mensaje += f"📅 Miembro desde: {a_fecha(stats.fecha_union).strftime('%d/%m/%Y')}\n"
+    mensaje += f"⏳ Días en el club: {dias_desde(stats.fecha_union)}\n"
+    mensaje += f"📚 Libros leídos: {club.libros_leidos(user_id)}\n"
+    mensaje += f"💬 Participaciones: {stats.participaciones}\n"
+    mensaje += f"📝 Citas compartidas: {stats.citas}\n"
+    
+    ranking_libros = club.rankings['libros_leidos']
+    mensaje += f"🏆 Tu posición: #{ranking_libros.posicion(user_id)} de {len(ranking_libros)}\n"
     
     await update.message.reply_text(mensaje, parse_mode='Markdown')
 
 async def ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ver ranking del club"""
-    if not bot_data.data['miembros']:
+    club = await club_de(update)
+    if not club.data['miembros']:
         await update.message.reply_text("📊 No hay miembros registrados.")
         return
     
-    # Ordenar por libros leídos
-    miembros_ordenados = sorted(
-        bot_data.data['miembros'].items(),
-        key=lambda x: x[1]['libros_leidos'],
-        reverse=True
-    )
-    
-    mensaje = "🏆 **Ranking del Club**\n\n"
+    # Criterio: /ranking [libros|participaciones|citas]
+    criterio = context.args[0].lower() if context.args else 'libros'
+    if criterio not in CRITERIOS_RANKING:
+        await update.message.reply_text(
+            f"❌ Criterio desconocido. Usa: /ranking [{'|'.join(CRITERIOS_RANKING)}]"
+        )
+        return
+    campo = CRITERIOS_RANKING[criterio]
+    indice = club.rankings[campo]
     
-    emojis = ['🥇', '🥈', '🥉']
-    for idx, (user_id, stats) in enumerate(miembros_ordenados[:10], 1):
-        emoji = emojis[idx-1] if idx <= 3 else f"{idx}."
-        mensaje += f"{emoji} {stats['nombre']}\n"
-        mensaje += f"   📚 {stats['libros_leidos']} libros\n\n"
+    def generar():
+        mensaje = "🏆 **Ranking del Club**\n\n"
+        
+        emojis = ['🥇', '🥈', '🥉']
+        for idx, (user_id, valor) in enumerate(club.top_ranking(campo, 10), 1):
+            emoji = emojis[idx-1] if idx <= 3 else f"{idx}."
+            mensaje += f"{emoji} {club.data['miembros'][user_id].nombre}\n"
+            mensaje += f"   📚 {valor} {criterio}\n\n"
+        return mensaje
+    
+    # El top es igual para todos; la posición propia se añade en cada consulta
+    mensaje = club.render(('ranking', criterio), ('miembros', 'libros_terminados'), generar)
+    user_id = str(update.effective_user.id)
+    if user_id in indice.valores:
+        mensaje += f"Tu posición: #{indice.posicion(user_id)} de {len(indice)}"
     
     await update.message.reply_text(mensaje, parse_mode='Markdown')
 
-# ==================== FUNCIÓN PRINCIPAL ====================
+# Abreviatura de cada mes para /estadisticas_club
+MESES = ['ene', 'feb', 'mar', 'abr', 'may', 'jun', 'jul', 'ago', 'sep', 'oct', 'nov', 'dic']
+# Secciones de las que sale /estadisticas_club; el informe se rehace si cambia alguna
+SECCIONES_ESTADISTICAS = (
+    'libros_leidos', 'citas', 'discusiones', 'reuniones', 'miembros', 'asistentes', 'proxima_reunion'
+)
 
-def main():
-    """Iniciar el bot"""
-    # Obtener token desde variable de entorno
-    TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    
-    if not TOKEN:
-        print("❌ ERROR: No se encontró el token de Telegram")
-        print("Por favor configura la variable de entorno TELEGRAM_BOT_TOKEN")
-        print("En Render: Settings > Environment > Add Environment Variable")
+async def estadisticas_club(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Informe del club: libros por mes, duración, proponentes, asistencia y participación"""
+    club = await club_de(update)
+    hoy = ahora()
+    reunion = reunion_actual(club.data)
+    
+    def generar():
+        datos = calcular(
+            club.vistas_columnares(), club.data['miembros'], club.data['reuniones'], reunion, hoy
+        )
+        mensaje = "📊 Estadísticas del club\n\n"
+        mensaje += f"📚 Libros leídos: {datos['libros']} ({datos['libros_ultimo_anio']} en los últimos 12 meses)\n"
+        if datos['libros_ultimo_anio']:
+            mensaje += "   " + " · ".join(
+                f"{MESES[numero - 1]} {n}" for (anio, numero), n in datos['libros_por_mes']
+            ) + "\n"
+        if datos['duracion_media_dias'] is not None:
+            mensaje += (
+                f"⏱️ Duración media: {datos['duracion_media_dias']:.1f} días "
+                f"(entre {datos['duracion_min_dias']} y {datos['duracion_max_dias']})\n"
+            )
+        if datos['votos_medios'] is not None:
+            mensaje += f"🗳️ Votos del libro elegido: {datos['votos_medios']:.1f} de media\n"
+        
+        if datos['proponentes']:
+            mensaje += "\n🏆 Proponentes (libros elegidos de los sugeridos):\n"
+            for idx, (nombre, ganadas, sugeridas) in enumerate(datos['proponentes'][:5], 1):
+                mensaje += f"   {idx}. {nombre}: {ganadas} de {sugeridas} ({ganadas * 100 // sugeridas}%)\n"
+        
+        asistencia = datos['asistencia']
+        if asistencia:
+            recientes = asistencia[-6:]
+            mensaje += (
+                f"\n🗓️ Asistencia a las últimas {len(recientes)} reuniones: "
+                f"{' → '.join(map(str, recientes))} (media {sum(asistencia) / len(asistencia):.1f})"
+            )
+            cambio = tendencia(asistencia)
+            if cambio is not None:
+                mensaje += " ↗️" if cambio >= 0.5 else " ↘️" if cambio <= -0.5 else " ➡️"
+            mensaje += "\n"
+        
+        mensaje += f"\n💬 {datos['citas']} citas y {datos['preguntas']} preguntas compartidas\n"
+        if datos['participacion']:
+            mensaje += "👥 Más participativos (citas · preguntas · reuniones · votaciones):\n"
+            for nombre, *cifras in datos['participacion'][:10]:
+                mensaje += f"   {nombre}: {' · '.join(map(str, cifras))}\n"
+        return mensaje
+    
+    # El informe depende también de la fecha: los 12 meses que abarca y si la próxima
+    # reunión ya se celebró
+    periodo = (mes(hoy), reunion is not None and reunion[0] <= hoy)
+    mensaje = club.render(('estadisticas_club', periodo), SECCIONES_ESTADISTICAS, generar)
+    # Sin Markdown: los nombres pueden llevar asteriscos o guiones bajos
+    await update.message.reply_text(mensaje)
+
+async def es_administrador(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Si el usuario está en ADMINISTRADORES o, si no se configuró ninguno, administra el chat"""
+    user_id = update.effective_user.id
+    if ADMINISTRADORES:
+        return user_id in ADMINISTRADORES
+    try:
+        miembro = await context.bot.get_chat_member(update.effective_chat.id, user_id)
+    except TelegramError:
+        return False
+    return miembro.status in (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+
+def milisegundos(segundos):
+    """Límite de una cubeta de metricas.LIMITES, para mostrarlo"""
+    if segundos == float('inf'):
+        return "> 10 s"
+    return f"≤ {segundos * 1000:g} ms"
+
+async def metrics_club(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Métricas de rendimiento del bot (solo administradores)"""
+    if not await es_administrador(update, context):
+        await update.message.reply_text("❌ Solo los administradores pueden ver las métricas.")
         return
+    club = await club_de(update)
+    
+    mensaje = "📈 Métricas del bot\n\n"
+    if metricas.activas:
+        comandos = sorted(metricas.por_etiqueta('club_comando_segundos').items(), key=lambda par: -par[1].n)
+        if comandos:
+            mensaje += "⏱️ Comandos (p50 / p99, veces):\n"
+        for comando, histograma in comandos:
+            errores = metricas.contador('club_comando_errores_total', comando=comando)
+            mensaje += (
+                f"   /{comando}: {milisegundos(histograma.percentil(0.5))} / "
+                f"{milisegundos(histograma.percentil(0.99))}, {histograma.n}"
+            )
+            mensaje += f", {errores} errores\n" if errores else "\n"
+        
+        llamadas = metricas.por_etiqueta('club_telegram_segundos')
+        mensaje += (
+            f"\n📡 Telegram: {sum(h.n for h in llamadas.values())} llamadas, "
+            f"{metricas.contador('club_telegram_retry_after_total')} RetryAfter\n"
+        )
+        for metodo, histograma in sorted(llamadas.items(), key=lambda par: -par[1].n)[:5]:
+            mensaje += f"   {metodo}: p99 {milisegundos(histograma.percentil(0.99))}, {histograma.n}\n"
+        
+        volcado = metricas.por_etiqueta('club_volcado_segundos').get('')
+        if volcado is not None:
+            mensaje += f"\n💾 Volcados: p50 {milisegundos(volcado.percentil(0.5))}, p99 {milisegundos(volcado.percentil(0.99))}\n"
+    else:
+        mensaje += "ℹ️ Activa METRICAS=1 para ver la latencia de los comandos y de Telegram.\n"
+    
+    persistencia = clubes.estadisticas
+    mensaje += (
+        f"\n💾 Guardado: {persistencia['volcados']} volcados, "
+        f"{persistencia['bytes_escritos'] / 1024:.0f} KB escritos, "
+        f"máximo {persistencia['latencia_max_ms']:.1f} ms\n"
+        f"🗂️ Clubes en memoria: {len(clubes.clubes)}; textos cacheados: "
+        f"{persistencia['render_aciertos']} aciertos, {persistencia['render_fallos']} fallos\n"
+        f"📨 Avisos: {difusiones.estadisticas['enviados']} enviados, "
+        f"{difusiones.estadisticas['esperas_telegram']} esperas pedidas por Telegram\n"
+    )
     
-    # Crear aplicación
-    application = Application.builder().token(TOKEN).build()
+    mensaje += "\n📚 Este club:\n"
+    for seccion, n in sorted(club.tamanos().items()):
+        mensaje += f"   {seccion}: {n}\n"
     
+    # Sin Markdown: los nombres de comandos y secciones llevan guiones bajos
+    await update.message.reply_text(mensaje)
+
+# ==================== FUNCIÓN PRINCIPAL ====================
+
+def tipos_de_actualizacion(application):
+    """Tipos de Update que atienden los handlers registrados; Telegram no envía el resto"""
+    tipos = {
+        CommandHandler: Update.MESSAGE,
+        MessageHandler: Update.MESSAGE,
+        CallbackQueryHandler: Update.CALLBACK_QUERY,
+        PollAnswerHandler: Update.POLL_ANSWER
+    }
+    usados = []
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            tipo = tipos.get(type(handler))
+            if tipo is None:
+                return Update.ALL_TYPES
+            if tipo not in usados:
+                usados.append(tipo)
+    return usados
+
+async def ejecutar_webhook(application, token):
+    """
+    Atiende las actualizaciones por webhook hasta recibir SIGINT o SIGTERM. Sin
+    WEBHOOK_URL no se registra en Telegram, para probarlo en local con Updates grabados.
+    """
+    secreto = WEBHOOK_SECRETO or hashlib.sha256(token.encode()).hexdigest()
+    receptor = Receptor(application, secreto)
+    servidor = ServidorHTTP([('POST', WEBHOOK_RUTA, receptor.recibir)])
+    if metricas.activas:
+        servidor.agregar_ruta('GET', METRICAS_RUTA, metricas.ruta_http(METRICAS_TOKEN))
+        metricas.agregar_fuente('webhook', receptor.estadisticas)
+    parar = asyncio.Event()
+    senales_de_parada(parar)
+    
+    # post_init y post_shutdown solo los llama run_polling/run_webhook
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await servidor.iniciar('0.0.0.0', PUERTO)
+    try:
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + WEBHOOK_RUTA,
+                allowed_updates=tipos_de_actualizacion(application),
+                secret_token=secreto,
+                max_connections=min(max(ACTUALIZACIONES_CONCURRENTES, 1), 100)
+            )
+        else:
+            logger.warning("Sin WEBHOOK_URL: no se registra el webhook en Telegram (solo pruebas locales)")
+        await parar.wait()
+    finally:
+        await servidor.cerrar()
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+async def ejecutar_distribuidor(application, token):
+    """
+    Proceso frontal del modo particiones: recibe el webhook y reparte las
+    actualizaciones por chat entre TRABAJADORES procesos, que son este mismo bot
+    """
+    secreto = WEBHOOK_SECRETO or hashlib.sha256(token.encode()).hexdigest()
+    distribuidor = Distribuidor([sys.executable, os.path.abspath(__file__)], TRABAJADORES, clubes.almacen.buscar_encuesta)
+    servidor = ServidorHTTP([('POST', WEBHOOK_RUTA, distribuidor.ruta_http(secreto))])
+    if metricas.activas:
+        # Solo las del frontal: los comandos se miden en cada trabajador (/metrics_club)
+        metricas.fuentes.clear()
+        metricas.agregar_fuente('particiones', distribuidor.estadisticas)
+        metricas.agregar_fuente('particiones_pendientes', distribuidor.pendientes, 'trabajador')
+        servidor.agregar_ruta('GET', METRICAS_RUTA, metricas.ruta_http(METRICAS_TOKEN))
+    parar = asyncio.Event()
+    senales_de_parada(parar, distribuidor.reiniciar)
+    
+    await distribuidor.iniciar()
+    await servidor.iniciar('0.0.0.0', PUERTO)
+    logger.info(f"Repartiendo las actualizaciones entre {TRABAJADORES} trabajadores")
+    try:
+        if WEBHOOK_URL:
+            async with application.bot:
+                await application.bot.set_webhook(
+                    WEBHOOK_URL.rstrip('/') + WEBHOOK_RUTA,
+                    allowed_updates=tipos_de_actualizacion(application),
+                    secret_token=secreto,
+                    max_connections=100
+                )
+        else:
+            logger.warning("Sin WEBHOOK_URL: no se registra el webhook en Telegram (solo pruebas locales)")
+        await parar.wait()
+    finally:
+        await servidor.cerrar()
+        await distribuidor.cerrar()
+        clubes.almacen.cerrar()
+
+async def ejecutar_trabajador(application):
+    """
+    Trabajador del modo particiones: atiende los chats de su partición, que le pasa
+    el proceso frontal, hasta que este cierra la conexión o llega SIGTERM
+    """
+    numero, total = int(os.environ['TRABAJADOR']), int(os.environ['TRABAJADORES'])
+    clubes.particion = (numero, total)
+    # El límite de mensajes de Telegram es del bot entero: se reparte entre los trabajadores
+    difusiones.cubo = CuboTokens(MENSAJES_POR_SEGUNDO / total)
+    parar = asyncio.Event()
+    senales_de_parada(parar)
+    
+    async def guardado():
+        # Las respuestas a encuestas se aplican por lotes: primero su lote y luego el volcado
+        await respuestas_encuestas.aplicadas_todas()
+        await clubes.guardado()
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    logger.info(f"Trabajador {numero} de {total} (pid {os.getpid()}) listo")
+    try:
+        await atender_particion(application, int(os.environ['TRABAJADOR_FD']), parar, guardado)
+    finally:
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+def registrar_handlers(application):
+    """Registra los comandos y botones del bot en la aplicación"""
     # Comandos básicos
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("ayuda", ayuda))
@@ -579,12 +2234,16 @@ def main():
     application.add_handler(CommandHandler("votacion", votacion))
     application.add_handler(CommandHandler("finalizar_votacion", finalizar_votacion))
     application.add_handler(CallbackQueryHandler(votar_callback, pattern='^vote_'))
+    application.add_handler(PollAnswerHandler(respuesta_encuesta))
     
     # Gestión de libros
     application.add_handler(CommandHandler("seleccionar_libro", seleccionar_libro))
     application.add_handler(CommandHandler("libro_actual", libro_actual))
+    application.add_handler(CommandHandler("progreso", progreso))
+    application.add_handler(CommandHandler("paginas", paginas))
     application.add_handler(CommandHandler("terminar_libro", terminar_libro))
     application.add_handler(CommandHandler("historial", historial))
+    application.add_handler(CallbackQueryHandler(paginar_callback, pattern='^pag_'))
     
     # Reuniones
     application.add_handler(CommandHandler("programar_reunion", programar_reunion))
@@ -596,15 +2255,64 @@ def main():
     application.add_handler(CommandHandler("preguntas", preguntas))
     application.add_handler(CommandHandler("cita", cita))
     application.add_handler(CommandHandler("citas", citas))
+    application.add_handler(CommandHandler("buscar", buscar))
+    application.add_handler(CallbackQueryHandler(buscar_callback, pattern='^bus_'))
     
     # Estadísticas
     application.add_handler(CommandHandler("mis_stats", mis_stats))
     application.add_handler(CommandHandler("ranking", ranking))
+    application.add_handler(CommandHandler("estadisticas_club", estadisticas_club))
+    application.add_handler(CommandHandler("metrics_club", metrics_club))
+    
+    # Con METRICAS=1 se cronometra cada handler, con el nombre de su comando
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            nombre = min(handler.commands) if isinstance(handler, CommandHandler) else handler.callback.__name__
+            handler.callback = metricas.medir(nombre, handler.callback)
+
+def main():
+    """Iniciar el bot"""
+    # Obtener token desde variable de entorno
+    TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+    
+    if not TOKEN:
+        print("❌ ERROR: No se encontró el token de Telegram")
+        print("Por favor configura la variable de entorno TELEGRAM_BOT_TOKEN")
+        print("En Render: Settings > Environment > Add Environment Variable")
+        return
+    
+    # Crear aplicación
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(ACTUALIZACIONES_CONCURRENTES)
+        .post_init(iniciar_persistencia)
+        .post_shutdown(cerrar_persistencia)
+    )
+    if metricas.activas:
+        # La misma conexión que crearía el builder, cronometrando cada llamada
+        builder.request(PeticionesMedidas(metricas, HTTPXRequest(connection_pool_size=256)))
+        if MODO_CONEXION == 'polling':
+            builder.post_init(iniciar_con_metricas).post_shutdown(cerrar_con_metricas)
+    application = builder.build()
+    
+    registrar_handlers(application)
     
     # Iniciar bot
     print("🤖 Bot iniciado correctamente!")
     print("📚 Club de Lectura Bot funcionando...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if MODO_CONEXION == 'particiones':
+        if 'TRABAJADOR' in os.environ:
+            asyncio.run(ejecutar_trabajador(application))
+        else:
+            asyncio.run(ejecutar_distribuidor(application, TOKEN))
+    elif MODO_CONEXION == 'webhook':
+        asyncio.run(ejecutar_webhook(application, TOKEN))
+    else:
+        application.run_polling(allowed_updates=tipos_de_actualizacion(application))
 
 if __name__ == '__main__':
+    if sys.argv[1:2] in (['exportar'], ['importar'], ['verificar']):
+        # Copias y migraciones de los datos (ver migracion.py)
+        sys.exit(migracion.main(sys.argv[1:]))
     main()
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""
+Envío de avisos privados a todos los miembros de un club
+
+Un anuncio (reunión programada, libro terminado...) se guarda en el club como una
+difusión con su lista de destinatarios y su progreso. El motor la envía por lotes
+respetando los límites de Telegram y guarda el progreso tras cada lote, así que
+tras un reinicio sigue por donde iba en lugar de empezar de nuevo.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Telegram admite unos 30 mensajes por segundo en total; se deja margen
+MENSAJES_POR_SEGUNDO = float(os.getenv('DIFUSION_MENSAJES_POR_SEGUNDO', '25'))
+# Y como mucho un mensaje por segundo a un mismo chat
+INTERVALO_POR_CHAT = 1.0
+# Mensajes que se envían a la vez; el progreso se guarda al terminar cada lote
+TAMANO_LOTE = 25
+# Intentos de un mensaje ante errores de red
+REINTENTOS = 4
+
+
+class CuboTokens:
+    """
+    Limitador de ritmo: admite ráfagas de hasta `capacidad` mensajes y después
+    `ritmo` mensajes por segundo. pausar() lo detiene del todo (RetryAfter).
+    """
+
+    def __init__(self, ritmo, capacidad=None):
+        self.ritmo = ritmo
+        self.capacidad = capacidad or ritmo
+        self.tokens = self.capacidad
+        self.ultimo = time.monotonic()
+        self.pausa_hasta = 0.0
+        self.cerrojo = asyncio.Lock()
+
+    def pausar(self, segundos):
+        self.pausa_hasta = max(self.pausa_hasta, time.monotonic() + segundos)
+
+    async def tomar(self):
+        """Espera hasta que se pueda enviar un mensaje y lo descuenta"""
+        async with self.cerrojo:
+            while True:
+                ahora = time.monotonic()
+                if ahora < self.pausa_hasta:
+                    await asyncio.sleep(self.pausa_hasta - ahora)
+                    continue
+                self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.ritmo)
+                self.ultimo = ahora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.ritmo)
+
+
+class MotorDifusion:
+    """
+    Cola de difusiones pendientes de todos los clubes. Una sola tarea las envía
+    lote a lote y por turnos, para que un club de miles de miembros no retrase
+    los avisos de los demás.
+    """
+
+    def __init__(self, gestor):
+        self.gestor = gestor
+        self.bot = None
+        self.cola = None
+        self.tarea = None
+        self.cubo = CuboTokens(MENSAJES_POR_SEGUNDO)
+        # chat -> momento a partir del cual se le puede volver a escribir
+        self.siguiente_por_chat = {}
+        # (club, difusion) -> momento en que empezó a enviarse
+        self.inicios = {}
+        self.estadisticas = {
+            'difusiones': 0,
+            'enviados': 0,
+            'fallidos': 0,
+            'reintentos': 0,
+            'esperas_telegram': 0,
+            'mensajes_por_segundo': 0.0
+        }
+
+    async def iniciar(self, bot):
+        """Arranca el envío y retoma las difusiones que quedaron a medias"""
+        self.bot = bot
+        self.cola = asyncio.Queue()
+        for club_id in await asyncio.to_thread(self.gestor.almacen.clubes_con_difusiones):
+            if not self.gestor.es_propio(club_id):
+                continue
+            async with self.gestor.cerrojo(club_id):
+                club = await self.gestor.obtener(club_id)
+                if not club.data['difusiones']:
+                    await asyncio.to_thread(self.gestor.almacen.anotar_difusion, club_id, False)
+            for difusion_id in club.data['difusiones']:
+                logger.info(f"Retomando la difusión {difusion_id} del club {club_id}")
+                self.cola.put_nowait((club_id, difusion_id))
+        self.tarea = asyncio.create_task(self.ciclo())
+
+    async def cerrar(self):
+        # El progreso ya está guardado por lotes; lo que falte se envía al volver
+        if self.tarea:
+            self.tarea.cancel()
+            try:
+                await self.tarea
+            except asyncio.CancelledError:
+                pass
+            self.tarea = None
+
+    async def anunciar(self, club, texto):
+        """Envía un mensaje privado a todos los miembros actuales del club"""
+        destinatarios = list(club.data['miembros'])
+        if not destinatarios:
+            return None
+        difusion_id = club.crear_difusion(texto, destinatarios)
+        await asyncio.to_thread(self.gestor.almacen.anotar_difusion, club.club_id, True)
+        if self.cola is not None:
+            self.cola.put_nowait((club.club_id, difusion_id))
+        return difusion_id
+
+    async def ciclo(self):
+        while True:
+            club_id, difusion_id = await self.cola.get()
+            try:
+                terminada = await self.enviar_lote(club_id, difusion_id)
+            except Exception:
+                # Se deja como está: se retomará en el próximo arranque
+                logger.exception(f"Error en la difusión {difusion_id} del club {club_id}")
+                continue
+            if not terminada:
+                self.cola.put_nowait((club_id, difusion_id))
+
+    async def enviar_lote(self, club_id, difusion_id):
+        """Envía el siguiente lote de una difusión. Devuelve True si ya ha terminado."""
+        club = await self.gestor.obtener(club_id)
+        difusion = club.data['difusiones'].get(difusion_id)
+        if difusion is None:
+            return True
+        self.inicios.setdefault((club_id, difusion_id), time.monotonic())
+        posicion = club.data['progreso_difusiones'][difusion_id]['posicion']
+        lote = difusion['destinatarios'][posicion:posicion + TAMANO_LOTE]
+        resultados = await asyncio.gather(*(self.enviar(int(chat), difusion['texto']) for chat in lote))
+        entregados = sum(resultados)
+
+        # El club pudo descargarse mientras se enviaba: se anota con su cerrojo, en el
+        # que esté en memoria
+        async with self.gestor.cerrojo(club_id):
+            club = await self.gestor.obtener(club_id)
+            progreso = club.avanzar_difusion(difusion_id, len(lote), entregados)
+            self.estadisticas['enviados'] += entregados
+            self.estadisticas['fallidos'] += len(lote) - entregados
+            if progreso['posicion'] < len(difusion['destinatarios']):
+                return False
+            club.terminar_difusion(difusion_id)
+            if not club.data['difusiones']:
+                await asyncio.to_thread(self.gestor.almacen.anotar_difusion, club_id, False)
+
+        segundos = time.monotonic() - self.inicios.pop((club_id, difusion_id))
+        ritmo = progreso['posicion'] / segundos if segundos > 0 else 0.0
+        self.estadisticas['difusiones'] += 1
+        self.estadisticas['mensajes_por_segundo'] = ritmo
+        logger.info(
+            f"Difusión {difusion_id} del club {club_id}: {progreso['entregados']} entregados, "
+            f"{progreso['fallidos']} fallidos en {segundos:.1f} s ({ritmo:.1f} mensajes/s)"
+        )
+        return True
+
+    async def esperar_chat(self, chat_id):
+        """Respeta el intervalo mínimo entre dos mensajes al mismo chat"""
+        ahora = time.monotonic()
+        espera = self.siguiente_por_chat.get(chat_id, 0.0) - ahora
+        self.siguiente_por_chat[chat_id] = max(ahora, ahora + espera) + INTERVALO_POR_CHAT
+        if len(self.siguiente_por_chat) > 10000:
+            self.siguiente_por_chat = {
+                chat: momento for chat, momento in self.siguiente_por_chat.items() if momento > ahora
+            }
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    async def enviar(self, chat_id, texto):
+        """Envía un mensaje respetando los límites. Devuelve True si se entregó."""
+        intento = 0
+        while True:
+            await self.esperar_chat(chat_id)
+            await self.cubo.tomar()
+            try:
+                await self.bot.send_message(chat_id, texto)
+                return True
+            except RetryAfter as e:
+                # Telegram pide parar: se frena todo el motor, no solo este mensaje, y
+                # no cuenta como intento (el mensaje sale cuando pase la espera)
+                self.estadisticas['esperas_telegram'] += 1
+                self.cubo.pausar(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                # El usuario no ha abierto chat con el bot o lo ha bloqueado
+                logger.debug(f"No se pudo avisar a {chat_id}: {e}")
+                return False
+            except TelegramError as e:
+                intento += 1
+                if intento >= REINTENTOS:
+                    logger.warning(f"No se pudo avisar a {chat_id} tras {REINTENTOS} intentos: {e}")
+                    return False
+                self.estadisticas['reintentos'] += 1
+                logger.warning(f"Error de red avisando a {chat_id}: {e}")
+                await asyncio.sleep(2 ** (intento - 1))
@@ -0,0 +1,326 @@
+"""
+Índices en memoria del Club de Lectura
+
+Estructuras derivadas de los datos de un club que se mantienen al día con cada
+cambio, para que los comandos no tengan que recorrer ni reordenar las secciones.
+No se guardan: se reconstruyen al cargar el club.
+"""
+
+import bisect
+import heapq
+import math
+import re
+import unicodedata
+
+
+class Recuento:
+    """
+    Votos por opción, con las opciones agrupadas en cubos por nº de votos.
+    Sumar o restar un voto y consultar la opción ganadora son O(1).
+    A igualdad de votos gana la opción que alcanzó antes esa cifra.
+    """
+
+    def __init__(self):
+        self.votos = {}
+        # nº de votos -> opciones con ese nº (dict usado como conjunto ordenado)
+        self.cubos = {}
+        self.maximo = 0
+
+    def __len__(self):
+        return len(self.votos)
+
+    def agregar_opcion(self, opcion, votos=0):
+        self.votos[opcion] = votos
+        self.cubos.setdefault(votos, {})[opcion] = None
+        self.maximo = max(self.maximo, votos)
+
+    def sacar_de_cubo(self, opcion, votos):
+        cubo = self.cubos[votos]
+        del cubo[opcion]
+        if not cubo:
+            del self.cubos[votos]
+
+    def sumar(self, opcion, delta=1):
+        """Suma (o resta, con delta=-1) un voto a una opción. Devuelve sus votos."""
+        anteriores = self.votos[opcion]
+        votos = max(anteriores + delta, 0)
+        if votos == anteriores:
+            return votos
+        self.sacar_de_cubo(opcion, anteriores)
+        self.votos[opcion] = votos
+        self.cubos.setdefault(votos, {})[opcion] = None
+        if votos > self.maximo:
+            self.maximo = votos
+        elif anteriores == self.maximo and anteriores not in self.cubos:
+            # Con cambios de un voto el nuevo máximo es el cubo de al lado
+            while self.maximo > votos and self.maximo not in self.cubos:
+                self.maximo -= 1
+        return votos
+
+    def ganador(self):
+        """Opción con más votos, o None si no hay opciones"""
+        if not self.votos:
+            return None
+        return next(iter(self.cubos[self.maximo]))
+
+    def clasificacion(self):
+        """Genera (opcion, votos) de más a menos votada"""
+        for votos in range(self.maximo, -1, -1):
+            for opcion in self.cubos.get(votos, ()):
+                yield opcion, votos
+
+
+class IndiceRanking:
+    """
+    Posición de cada miembro según un valor entero (libros leídos, citas...).
+    Un árbol de Fenwick cuenta cuántos miembros tienen cada valor, así que cambiar
+    un valor y preguntar "qué puesto ocupa" o "qué valor tiene la mediana" son
+    O(log V). El top-K solo recorre los valores ocupados, de mayor a menor.
+    Admite valores negativos.
+    """
+
+    def __init__(self):
+        self.valores = {}
+        # valor -> miembros con ese valor (dict usado como conjunto ordenado)
+        self.cubos = {}
+        # Valores ocupados, ordenados de menor a mayor
+        self.distintos = []
+        # El árbol cubre los valores [origen, origen + tamaño)
+        self.origen = 0
+        self.arbol = [0] * 17
+
+    def __len__(self):
+        return len(self.valores)
+
+    def _sumar_arbol(self, valor, delta):
+        i = valor - self.origen + 1
+        while i < len(self.arbol):
+            self.arbol[i] += delta
+            i += i & -i
+
+    def _ampliar(self, valor):
+        """Duplica el árbol hasta que quepa el valor y lo reconstruye desde los cubos"""
+        tam = len(self.arbol) - 1
+        origen = self.origen
+        while not origen <= valor < origen + tam:
+            if valor < origen:
+                origen -= tam
+            tam *= 2
+        self.origen = origen
+        self.arbol = [0] * (tam + 1)
+        for v, cubo in self.cubos.items():
+            i = v - origen + 1
+            while i <= tam:
+                self.arbol[i] += len(cubo)
+                i += i & -i
+
+    def _hasta(self, valor):
+        """Nº de miembros con valor <= valor"""
+        i = min(valor - self.origen + 1, len(self.arbol) - 1)
+        total = 0
+        while i > 0:
+            total += self.arbol[i]
+            i -= i & -i
+        return total
+
+    def fijar(self, miembro, valor):
+        """Pone (o actualiza) el valor de un miembro"""
+        anterior = self.valores.get(miembro)
+        if anterior == valor:
+            return
+        if anterior is not None:
+            self._sacar(miembro, anterior)
+        if not self.origen <= valor < self.origen + len(self.arbol) - 1:
+            self._ampliar(valor)
+        self.valores[miembro] = valor
+        cubo = self.cubos.get(valor)
+        if cubo is None:
+            cubo = self.cubos[valor] = {}
+            bisect.insort(self.distintos, valor)
+        cubo[miembro] = None
+        self._sumar_arbol(valor, 1)
+
+    def quitar(self, miembro):
+        anterior = self.valores.pop(miembro, None)
+        if anterior is not None:
+            self._sacar(miembro, anterior)
+
+    def _sacar(self, miembro, valor):
+        cubo = self.cubos[valor]
+        del cubo[miembro]
+        if not cubo:
+            del self.cubos[valor]
+            del self.distintos[bisect.bisect_left(self.distintos, valor)]
+        self._sumar_arbol(valor, -1)
+
+    def posicion(self, miembro):
+        """Puesto del miembro (1 = primero; empatados comparten puesto), o None"""
+        valor = self.valores.get(miembro)
+        if valor is None:
+            return None
+        return len(self.valores) - self._hasta(valor) + 1
+
+    def top(self, k):
+        """Los k primeros como lista de (miembro, valor), de mayor a menor valor"""
+        resultado = []
+        for valor in reversed(self.distintos):
+            for miembro in self.cubos[valor]:
+                resultado.append((miembro, valor))
+                if len(resultado) == k:
+                    return resultado
+        return resultado
+
+    def ultimos(self, k):
+        """Los k últimos como lista de (miembro, valor), de menor a mayor valor"""
+        resultado = []
+        for valor in self.distintos:
+            for miembro in self.cubos[valor]:
+                resultado.append((miembro, valor))
+                if len(resultado) == k:
+                    return resultado
+        return resultado
+
+    def menores_que(self, valor):
+        """Nº de miembros con un valor menor que valor"""
+        if valor <= self.origen:
+            return 0
+        return self._hasta(valor - 1)
+
+    def kesimo(self, k):
+        """Valor del k-ésimo miembro de menor a mayor (1 = el menor), bajando por el árbol"""
+        i = 0
+        paso = 1 << ((len(self.arbol) - 1).bit_length() - 1)
+        while paso:
+            if i + paso < len(self.arbol) and self.arbol[i + paso] < k:
+                i += paso
+                k -= self.arbol[i]
+            paso >>= 1
+        return i + self.origen
+
+    def percentil(self, q):
+        """Valor por debajo del cual queda la fracción q (0-1) de los miembros, o None si no hay"""
+        if not self.valores:
+            return None
+        return self.kesimo(max(1, math.ceil(q * len(self.valores))))
+
+
+# Palabras demasiado frecuentes en español para servir en una búsqueda
+PALABRAS_VACIAS = frozenset(
+    'a al como con de del el en es la las le lo los me mi no o para pero por que '
+    'se su sus te un una uno unos unas y ya'.split()
+)
+
+
+def normalizar(texto):
+    """
+    Minúsculas y sin tildes, diéresis ni virgulilla, para comparar texto en español.
+    La ñ pasa a n porque muchos teclados no la tienen ("anos" encuentra "años").
+    """
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def terminos(texto):
+    """Cuenta las palabras buscables de un texto: palabra normalizada -> apariciones"""
+    cuenta = {}
+    for palabra in re.findall(r'\w+', normalizar(texto)):
+        if palabra not in PALABRAS_VACIAS:
+            cuenta[palabra] = cuenta.get(palabra, 0) + 1
+    return cuenta
+
+
+class IndiceTexto:
+    """
+    Índice invertido: palabra -> documentos que la contienen y cuántas veces.
+    Una búsqueda devuelve los documentos con todas las palabras, ordenados por
+    TF-IDF; solo se puntúan los de la lista más corta que aparecen en las demás.
+    """
+
+    def __init__(self):
+        self.listas = {}
+        self.documentos = 0
+
+    def __len__(self):
+        return self.documentos
+
+    def agregar(self, documento, cuenta):
+        """Añade un documento con sus términos (ver terminos())"""
+        for palabra, veces in cuenta.items():
+            self.listas.setdefault(palabra, {})[documento] = veces
+        self.documentos += 1
+
+    def buscar(self, consulta, limite=None):
+        """
+        Documentos que contienen todas las palabras de la consulta, del más al menos
+        relevante. Con limite solo se ordenan los primeros.
+        """
+        palabras = list(terminos(consulta))
+        if not palabras:
+            return []
+        listas = [self.listas.get(palabra) for palabra in palabras]
+        if not all(listas):
+            return []
+        listas.sort(key=len)
+        pesos = [math.log(1 + self.documentos / len(lista)) for lista in listas]
+        puntos = {}
+        for documento, veces in listas[0].items():
+            total = veces * pesos[0]
+            for lista, peso in zip(listas[1:], pesos[1:]):
+                otras = lista.get(documento)
+                if otras is None:
+                    break
+                total += otras * peso
+            else:
+                puntos[documento] = total
+        if limite is not None:
+            return heapq.nlargest(limite, puntos, key=puntos.get)
+        return sorted(puntos, key=puntos.get, reverse=True)
+
+
+def trigramas(texto):
+    """Trigramas de un texto normalizado, con las palabras separadas por un espacio"""
+    relleno = ' ' + ' '.join(re.findall(r'\w+', normalizar(texto))) + ' '
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+class IndiceTrigramas:
+    """
+    Búsqueda aproximada de textos cortos, como títulos. El parecido entre dos
+    textos es el coeficiente de Dice de sus trigramas, y solo se calcula para los
+    textos que comparten algún trigrama con la consulta. Los números tienen que
+    coincidir: "Libro 1" y "Libro 10" son tomos distintos.
+    """
+
+    def __init__(self):
+        self.listas = {}
+        # documento -> nº de trigramas de su texto
+        self.tamanos = {}
+        # documento -> números que aparecen en su texto
+        self.numeros = {}
+
+    def __len__(self):
+        return len(self.tamanos)
+
+    def agregar(self, documento, texto):
+        grupo = trigramas(texto)
+        self.tamanos[documento] = len(grupo)
+        self.numeros[documento] = set(re.findall(r'\d+', texto))
+        for trigrama in grupo:
+            self.listas.setdefault(trigrama, set()).add(documento)
+
+    def parecido(self, texto, umbral):
+        """(documento, parecido) del texto más parecido, si llega al umbral (0-1); si no, None"""
+        grupo = trigramas(texto)
+        numeros = set(re.findall(r'\d+', texto))
+        comunes = {}
+        for trigrama in grupo:
+            for documento in self.listas.get(trigrama, ()):
+                comunes[documento] = comunes.get(documento, 0) + 1
+        mejor = None
+        for documento, n in comunes.items():
+            parecido = 2 * n / (len(grupo) + self.tamanos[documento])
+            if self.numeros[documento] != numeros:
+                continue
+            if parecido >= umbral and (mejor is None or parecido > mejor[1]):
+                mejor = (documento, parecido)
+        return mejor
@@ -0,0 +1,353 @@
+"""
+Instantánea binaria de los datos de un club (ALMACENAMIENTO=binario)
+
+Alternativa a la instantánea JSON pensada para arrancar rápido aunque el club
+tenga años de historial. El archivo tiene esta forma:
+
+    MAGIA (8 bytes) | largo de la cabecera (uint32) | cabecera JSON | secciones archivadas
+
+La cabecera lleva las secciones calientes (libro actual, sugerencias, miembros,
+votos...) y dónde empieza cada sección archivada. Las archivadas (historial,
+citas, preguntas y sus términos de búsqueda) no se leen al cargar: el archivo se
+proyecta en memoria con mmap y cada elemento se decodifica la primera vez que un
+comando lo usa. Una lista archivada es una tabla de n+1 desplazamientos (uint64)
+seguida de sus n elementos en JSON; un dict archivado, lo mismo con sus valores y
+después la lista JSON de sus claves, en el mismo orden.
+
+Las instantáneas JSON se convierten solas la primera vez que se carga cada club.
+También se pueden convertir de antemano y comparar cuánto se tarda en cargarlas:
+
+    python instantanea.py convertir clubes/-1001234.json [...]
+    python instantanea.py convertir club_data.json clubes/-1001234.bin
+    python instantanea.py medir clubes/-1001234.json
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections.abc import MutableMapping, MutableSequence
+from itertools import accumulate
+
+from modelo import a_json
+
+MAGIA = b'CLUBBIN1'
+# Secciones que se leen bajo demanda: sección -> 'lista' o 'dict'
+ARCHIVADAS = {
+    'libros_leidos': 'lista',
+    'citas': 'lista',
+    'discusiones': 'lista',
+    'terminos': 'dict'
+}
+# Valores de un dict archivado que se decodifican juntos al recorrerlo entero
+LOTE_DECODIFICACION = 4096
+
+
+def codificar(valor):
+    return json.dumps(valor, ensure_ascii=False, separators=(',', ':'), default=a_json).encode('utf-8')
+
+
+class ListaArchivada(MutableSequence):
+    """
+    Lista cuyos elementos se decodifican de la instantánea al pedirlos. Los leídos,
+    cambiados o añadidos se quedan en memoria; el resto sigue en el archivo.
+    """
+
+    def __init__(self, mapa, desplazamientos, inicio):
+        self.mapa = mapa
+        # Posición de cada elemento respecto a inicio (n+1 valores)
+        self.desplazamientos = desplazamientos
+        self.inicio = inicio
+        # Los primeros `guardados` elementos están en el archivo; los añadidos, en nuevos
+        self.guardados = len(desplazamientos) - 1
+        self.leidos = {}
+        self.nuevos = []
+        # Función que se aplica a cada elemento decodificado (ver modelo.cargar_registros)
+        self.convertir = None
+
+    def __len__(self):
+        return self.guardados + len(self.nuevos)
+
+    def _posicion(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('índice fuera de la lista')
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = self._posicion(i)
+        if i >= self.guardados:
+            return self.nuevos[i - self.guardados]
+        if i not in self.leidos:
+            valor = json.loads(self.crudo(i))
+            self.leidos[i] = valor if self.convertir is None else self.convertir(valor)
+        return self.leidos[i]
+
+    def __setitem__(self, i, valor):
+        i = self._posicion(i)
+        if i >= self.guardados:
+            self.nuevos[i - self.guardados] = valor
+        else:
+            self.leidos[i] = valor
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            desde, hasta, paso = i.indices(len(self))
+            if paso == 1 and hasta == len(self):
+                self.truncar(desde)
+                return
+        self.materializar()
+        del self.nuevos[i]
+
+    def insert(self, i, valor):
+        if i < len(self):
+            self.materializar()
+            self.nuevos.insert(i, valor)
+        else:
+            self.nuevos.append(valor)
+
+    def truncar(self, largo):
+        """Deja solo los primeros `largo` elementos"""
+        if largo >= self.guardados:
+            del self.nuevos[largo - self.guardados:]
+            return
+        self.guardados = largo
+        self.nuevos = []
+        self.leidos = {i: v for i, v in self.leidos.items() if i < largo}
+
+    def materializar(self):
+        """Pasa todos los elementos a memoria (para cambios en mitad de la lista)"""
+        self.nuevos = list(self)
+        self.guardados = 0
+        self.leidos = {}
+
+    def crudo(self, i):
+        """JSON del elemento i; si no se ha leído se copia del archivo sin decodificarlo"""
+        if i < self.guardados and i not in self.leidos:
+            return self.mapa[self.inicio + self.desplazamientos[i]:self.inicio + self.desplazamientos[i + 1]]
+        return codificar(self[i])
+
+    def convertir_con(self, funcion):
+        self.convertir = funcion
+        self.leidos = {i: funcion(v) for i, v in self.leidos.items()}
+        self.nuevos = [funcion(v) for v in self.nuevos]
+
+    def a_json(self):
+        return list(self)
+
+
+class DiccionarioArchivado(MutableMapping):
+    """
+    Dict cuyos valores se decodifican de la instantánea al pedirlos, como los
+    elementos de ListaArchivada. Las claves se decodifican juntas la primera vez
+    que se busca una. Lo que se escribe o se borra se guarda aparte, así que
+    añadir no obliga a leer nada del archivo.
+
+    Los valores leídos no se guardan en memoria (con /buscar se leen todos una vez
+    para el índice y no se vuelven a usar): para cambiar uno hay que asignarlo.
+    """
+
+    def __init__(self, mapa, desplazamientos, inicio, claves):
+        self.mapa = mapa
+        self.desplazamientos = desplazamientos
+        self.inicio = inicio
+        # (desde, hasta) de la lista JSON de claves guardadas
+        self.claves = claves
+        # Clave guardada -> posición de su valor; None hasta que se decodifican
+        self.posiciones = None
+        self.cambios = {}
+        self.borrados = set()
+
+    def guardadas(self):
+        if self.posiciones is None:
+            desde, hasta = self.claves
+            self.posiciones = {clave: i for i, clave in enumerate(json.loads(self.mapa[desde:hasta]))}
+        return self.posiciones
+
+    def __getitem__(self, clave):
+        if clave in self.cambios:
+            return self.cambios[clave]
+        if clave in self.borrados:
+            raise KeyError(clave)
+        return json.loads(self.crudo(clave))
+
+    def __contains__(self, clave):
+        if clave in self.cambios:
+            return True
+        return clave not in self.borrados and clave in self.guardadas()
+
+    def __setitem__(self, clave, valor):
+        self.cambios[clave] = valor
+        self.borrados.discard(clave)
+
+    def __delitem__(self, clave):
+        if clave not in self:
+            raise KeyError(clave)
+        self.cambios.pop(clave, None)
+        if clave in self.guardadas():
+            self.borrados.add(clave)
+
+    def __iter__(self):
+        guardadas = self.guardadas()
+        for clave in guardadas:
+            if clave not in self.borrados:
+                yield clave
+        for clave in self.cambios:
+            if clave not in guardadas:
+                yield clave
+
+    def __len__(self):
+        guardadas = self.guardadas()
+        return len(guardadas) - len(self.borrados) + sum(1 for clave in self.cambios if clave not in guardadas)
+
+    def items(self):
+        """Genera (clave, valor) decodificando los valores por lotes: uno a uno es más lento"""
+        claves = list(self)
+        for desde in range(0, len(claves), LOTE_DECODIFICACION):
+            lote = claves[desde:desde + LOTE_DECODIFICACION]
+            crudos = b','.join(self.crudo(clave) for clave in lote)
+            yield from zip(lote, json.loads(b'[' + crudos + b']'))
+
+    def crudo(self, clave):
+        """JSON del valor de una clave; si no ha cambiado se copia del archivo sin decodificarlo"""
+        if clave in self.cambios:
+            return codificar(self.cambios[clave])
+        i = self.guardadas()[clave]
+        return self.mapa[self.inicio + self.desplazamientos[i]:self.inicio + self.desplazamientos[i + 1]]
+
+    def a_json(self):
+        return dict(self.items())
+
+
+def leer_tabla(mapa, tabla, n):
+    """Tabla de n+1 desplazamientos que empieza en la posición `tabla`"""
+    desplazamientos = array('Q')
+    desplazamientos.frombytes(mapa[tabla:tabla + 8 * (n + 1)])
+    if sys.byteorder == 'big':
+        desplazamientos.byteswap()
+    return desplazamientos
+
+
+def bloque_con_tabla(elementos):
+    """Partes de un bloque archivado: la tabla de desplazamientos y los elementos"""
+    desplazamientos = array('Q', accumulate((len(e) for e in elementos), initial=0))
+    if sys.byteorder == 'big':
+        desplazamientos.byteswap()
+    return [desplazamientos.tobytes()] + elementos
+
+
+def leer(ruta):
+    """Abre una instantánea binaria. Las secciones archivadas quedan sin decodificar."""
+    with open(ruta, 'rb') as f:
+        mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapa[:len(MAGIA)] != MAGIA:
+        raise ValueError(f"{ruta} no es una instantánea binaria")
+    largo, = struct.unpack_from('<I', mapa, len(MAGIA))
+    base = len(MAGIA) + 4 + largo
+    cabecera = json.loads(mapa[len(MAGIA) + 4:base])
+    data = cabecera['calientes']
+    for seccion, (tipo, desde, n, *resto) in cabecera['archivadas'].items():
+        tabla = base + desde
+        if tipo == 'lista':
+            data[seccion] = ListaArchivada(mapa, leer_tabla(mapa, tabla, n), tabla + 8 * (n + 1))
+        elif not resto:
+            # Formato anterior: el dict entero en un JSON de n bytes
+            data[seccion] = json.loads(mapa[tabla:tabla + n])
+        else:
+            desplazamientos = leer_tabla(mapa, tabla, n)
+            inicio = tabla + 8 * (n + 1)
+            claves = inicio + desplazamientos[n]
+            data[seccion] = DiccionarioArchivado(mapa, desplazamientos, inicio, (claves, claves + resto[0]))
+    return data
+
+
+def escribir(ruta, data):
+    """
+    Escribe una instantánea binaria de forma atómica (archivo temporal + rename).
+    Los elementos archivados que no se han leído se copian sin decodificar.
+    """
+    calientes = {}
+    bloques = []
+    archivadas = {}
+    posicion = 0
+    for seccion, valor in data.items():
+        tipo = ARCHIVADAS.get(seccion)
+        if tipo == 'lista' and isinstance(valor, MutableSequence):
+            if isinstance(valor, ListaArchivada):
+                elementos = [valor.crudo(i) for i in range(len(valor))]
+            else:
+                elementos = [codificar(elemento) for elemento in valor]
+            bloque = bloque_con_tabla(elementos)
+            archivadas[seccion] = ('lista', posicion, len(elementos))
+        elif tipo == 'dict' and isinstance(valor, MutableMapping):
+            claves = list(valor)
+            if isinstance(valor, DiccionarioArchivado):
+                elementos = [valor.crudo(clave) for clave in claves]
+            else:
+                elementos = [codificar(valor[clave]) for clave in claves]
+            crudo_claves = codificar(claves)
+            bloque = bloque_con_tabla(elementos) + [crudo_claves]
+            archivadas[seccion] = ('dict', posicion, len(elementos), len(crudo_claves))
+        else:
+            calientes[seccion] = valor
+            continue
+        bloques.append(bloque)
+        posicion += sum(len(parte) for parte in bloque)
+
+    cabecera = codificar({'calientes': calientes, 'archivadas': archivadas})
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(MAGIA + struct.pack('<I', len(cabecera)) + cabecera)
+        for bloque in bloques:
+            f.writelines(bloque)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def convertir(ruta_json, ruta_binaria):
+    """Escribe en formato binario una instantánea JSON con su diario, sin tocar el original"""
+    from almacenamiento import ArchivoJSON
+    escribir(ruta_binaria, ArchivoJSON(ruta_json).leer())
+
+
+def main(argumentos):
+    """
+    convertir ORIGEN.json [DESTINO.bin]: convierte una o varias instantáneas JSON
+    (por defecto junto al original, con extensión .bin). Para club_data.json indica
+    el destino, clubes/<chat>.bin, con el chat que lo hereda.
+    medir RUTA.json [...]: compara lo que tarda en cargarse cada formato.
+    """
+    from almacenamiento import ArchivoJSON
+    if len(argumentos) < 2 or argumentos[0] not in ('convertir', 'medir'):
+        print(__doc__)
+        return 1
+    rutas = argumentos[1:]
+    if len(rutas) == 2 and rutas[1].endswith('.bin'):
+        pares = [tuple(rutas)]
+    else:
+        pares = [(ruta, os.path.splitext(ruta)[0] + '.bin') for ruta in rutas]
+    for ruta_json, ruta_binaria in pares:
+        if argumentos[0] == 'convertir':
+            convertir(ruta_json, ruta_binaria)
+            print(f"{ruta_json} ({os.path.getsize(ruta_json)} bytes) -> "
+                  f"{ruta_binaria} ({os.path.getsize(ruta_binaria)} bytes)")
+            continue
+        inicio = time.perf_counter()
+        ArchivoJSON(ruta_json).leer_instantanea()
+        segundos_json = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        leer(ruta_binaria)
+        segundos_binario = time.perf_counter() - inicio
+        print(f"{ruta_json}: JSON {segundos_json * 1000:.1f} ms, binario {segundos_binario * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
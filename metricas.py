@@ -0,0 +1,206 @@
+"""
+Métricas del bot: latencia de cada comando, de las llamadas a Telegram y de los
+volcados, RetryAfter recibidos y tamaño de las secciones de los clubes
+
+Con METRICAS=1 cada handler y cada llamada a la API de Telegram se cronometran
+en histogramas de cubetas fijas (una búsqueda binaria y tres sumas por medida).
+Sin ella los handlers y la conexión con Telegram no se tocan y solo quedan los
+contadores que el bot ya llevaba.
+
+Se consultan con /metrics_club o, en formato Prometheus, en GET /metrics:
+
+    curl -H 'Authorization: Bearer <METRICAS_TOKEN>' http://localhost:8080/metrics
+"""
+
+import functools
+import time
+from bisect import bisect_left
+from http import HTTPStatus
+
+from telegram.error import RetryAfter
+from telegram.request import BaseRequest
+
+# Límites superiores de las cubetas de los histogramas, en segundos
+LIMITES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histograma:
+    """Nº de medidas por cubeta, su suma y su número, como un histograma de Prometheus"""
+
+    __slots__ = ('cubetas', 'suma', 'n')
+
+    def __init__(self):
+        # Una cubeta por límite y otra para lo que pasa del último
+        self.cubetas = [0] * (len(LIMITES) + 1)
+        self.suma = 0.0
+        self.n = 0
+
+    def observar(self, segundos):
+        self.cubetas[bisect_left(LIMITES, segundos)] += 1
+        self.suma += segundos
+        self.n += 1
+
+    def percentil(self, q):
+        """Límite de la cubeta en que cae el percentil q (0-1); inf si pasa del último"""
+        objetivo = q * self.n
+        acumulado = 0
+        for limite, n in zip(LIMITES + (float('inf'),), self.cubetas):
+            acumulado += n
+            if acumulado >= objetivo:
+                return limite
+        return float('inf')
+
+
+def etiquetas(pares):
+    """((etiqueta, valor), ...) -> {etiqueta="valor",...} escapando el valor"""
+    if not pares:
+        return ''
+    texto = ','.join(
+        f'{clave}="' + str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for clave, valor in pares
+    )
+    return '{' + texto + '}'
+
+
+class Metricas:
+    """
+    Histogramas y contadores con etiquetas, más fuentes que se leen al consultarlas
+    (los dicts de estadísticas del gestor, las difusiones, etc.).
+    """
+
+    def __init__(self, activas=False):
+        self.activas = activas
+        # (métrica, ((etiqueta, valor), ...)) -> Histograma o entero
+        self.histogramas = {}
+        self.contadores = {}
+        # prefijo -> (dict o función que lo devuelve, nombre de la etiqueta o None)
+        self.fuentes = {}
+
+    def observar(self, metrica, segundos, **pares):
+        if not self.activas:
+            return
+        clave = (metrica, tuple(pares.items()))
+        histograma = self.histogramas.get(clave)
+        if histograma is None:
+            histograma = self.histogramas[clave] = Histograma()
+        histograma.observar(segundos)
+
+    def contar(self, metrica, cantidad=1, **pares):
+        if not self.activas:
+            return
+        clave = (metrica, tuple(pares.items()))
+        self.contadores[clave] = self.contadores.get(clave, 0) + cantidad
+
+    def agregar_fuente(self, prefijo, fuente, etiqueta=None):
+        """
+        Publica los valores numéricos de un dict como club_<prefijo>_<clave>, o como
+        club_<prefijo>{<etiqueta>="<clave>"} si se indica etiqueta
+        """
+        self.fuentes[prefijo] = (fuente, etiqueta)
+
+    def medir(self, nombre, handler):
+        """Envuelve un handler para cronometrarlo y contar sus errores; sin métricas lo deja igual"""
+        if not self.activas:
+            return handler
+
+        @functools.wraps(handler)
+        async def medido(update, context):
+            inicio = time.perf_counter()
+            try:
+                return await handler(update, context)
+            except Exception:
+                self.contar('club_comando_errores_total', comando=nombre)
+                raise
+            finally:
+                self.observar('club_comando_segundos', time.perf_counter() - inicio, comando=nombre)
+        return medido
+
+    def por_etiqueta(self, metrica):
+        """Histogramas de una métrica: valor de su (única) etiqueta -> Histograma"""
+        return {
+            pares[0][1] if pares else '': histograma
+            for (nombre, pares), histograma in self.histogramas.items() if nombre == metrica
+        }
+
+    def contador(self, metrica, **pares):
+        if pares:
+            return self.contadores.get((metrica, tuple(pares.items())), 0)
+        return sum(n for (nombre, _), n in self.contadores.items() if nombre == metrica)
+
+    def valores_fuentes(self):
+        """Genera (métrica, pares, valor) de las fuentes registradas"""
+        for prefijo, (fuente, etiqueta) in self.fuentes.items():
+            valores = fuente() if callable(fuente) else fuente
+            for clave, valor in valores.items():
+                if not isinstance(valor, (int, float)):
+                    continue
+                if etiqueta is None:
+                    yield f'club_{prefijo}_{clave}', (), valor
+                else:
+                    yield f'club_{prefijo}', ((etiqueta, clave),), valor
+
+    def prometheus(self):
+        """Todas las métricas en el formato de texto de Prometheus"""
+        lineas = []
+        tipos = set()
+        for (metrica, pares), histograma in sorted(self.histogramas.items()):
+            if metrica not in tipos:
+                tipos.add(metrica)
+                lineas.append(f'# TYPE {metrica} histogram')
+            acumulado = 0
+            for limite, n in zip(LIMITES + ('+Inf',), histograma.cubetas):
+                acumulado += n
+                lineas.append(f'{metrica}_bucket{etiquetas(pares + (("le", limite),))} {acumulado}')
+            lineas.append(f'{metrica}_sum{etiquetas(pares)} {histograma.suma}')
+            lineas.append(f'{metrica}_count{etiquetas(pares)} {histograma.n}')
+        for (metrica, pares), n in sorted(self.contadores.items()):
+            if metrica not in tipos:
+                tipos.add(metrica)
+                lineas.append(f'# TYPE {metrica} counter')
+            lineas.append(f'{metrica}{etiquetas(pares)} {n}')
+        for metrica, pares, valor in self.valores_fuentes():
+            lineas.append(f'{metrica}{etiquetas(pares)} {float(valor)}')
+        return '\n'.join(lineas) + '\n'
+
+    def ruta_http(self, token=None):
+        """Ruta HTTP (ver webhook.py) que sirve las métricas en formato Prometheus"""
+        async def servir(cabeceras, cuerpo):
+            if token and cabeceras.get('authorization') != f'Bearer {token}':
+                return HTTPStatus.UNAUTHORIZED, 'text/plain', 'Token incorrecto'
+            return HTTPStatus.OK, 'text/plain; version=0.0.4', self.prometheus()
+        return servir
+
+
+class PeticionesMedidas(BaseRequest):
+    """
+    Conexión con la API de Telegram que cronometra cada llamada por método y cuenta
+    los RetryAfter. Delega el envío en otra conexión (la HTTPXRequest de siempre).
+    """
+
+    def __init__(self, metricas, interna):
+        self.metricas = metricas
+        self.interna = interna
+
+    @property
+    def read_timeout(self):
+        return self.interna.read_timeout
+
+    async def initialize(self):
+        await self.interna.initialize()
+
+    async def shutdown(self):
+        await self.interna.shutdown()
+
+    async def do_request(self, *args, **kwargs):
+        return await self.interna.do_request(*args, **kwargs)
+
+    async def post(self, url, *args, **kwargs):
+        metodo = url.rsplit('/', 1)[-1]
+        inicio = time.perf_counter()
+        try:
+            return await super().post(url, *args, **kwargs)
+        except RetryAfter:
+            self.metricas.contar('club_telegram_retry_after_total', metodo=metodo)
+            raise
+        finally:
+            self.metricas.observar('club_telegram_segundos', time.perf_counter() - inicio, metodo=metodo)
@@ -0,0 +1,366 @@
+"""
+Copias de seguridad y migraciones entre backends con un archivo NDJSON
+
+Cada club se exporta elemento a elemento, una línea por registro, con el mismo
+formato que el diario de los archivos JSON. Al exportar y al importar solo se
+tiene en memoria un lote de registros (más el club que se está leyendo con los
+backends de archivos), así que el tamaño de los datos no importa. El archivo:
+
+    {"formato":"club-lectura-ndjson","version":1}
+    {"club":"-1001234"}
+    {"s":"libro_actual","v":{...}}
+    {"s":"citas","v":[]}                  <- sección de tipo lista ({} si es un dict)
+    {"s":"citas","k":0,"v":{...}}
+    ...
+    {"fin":"-1001234","registros":5230,"suma":"9f0c..."}
+    {"total":3,"registros":20410,"suma":"41be..."}
+
+La suma es la de los sha256 de cada registro en forma canónica, módulo 2^256: no
+depende del orden en que cada backend devuelve las filas, así que al importar se
+compara también con lo que se relee del destino. Las secciones vacías ([] o {})
+no cuentan como registros, porque los backends SQL no las guardan.
+
+    python migracion.py exportar copia.ndjson
+    ALMACENAMIENTO=postgres python migracion.py importar copia.ndjson
+    python migracion.py verificar copia.ndjson
+
+(o python club_lectura_bot.py exportar|importar|verificar ...). Conviene parar el
+bot antes. Si se corta, la misma orden sigue donde se quedó: al exportar, tras el
+último club completo; al importar, tras el último lote escrito, que se anota en
+copia.ndjson.progreso.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from almacenamiento import crear_almacenamiento
+
+FORMATO = 'club-lectura-ndjson'
+VERSION = 1
+# Registros que se escriben de una vez (en el archivo al exportar, en el destino al importar)
+LOTE = 500
+MODULO = 2 ** 256
+
+
+def huella(seccion, clave, valor):
+    """sha256 del registro en forma canónica (claves ordenadas, sin espacios), como entero"""
+    canonico = json.dumps([seccion, clave, valor], sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return int.from_bytes(hashlib.sha256(canonico.encode('utf-8')).digest(), 'big')
+
+
+def es_seccion_vacia(clave, valor_json):
+    return clave is None and valor_json in ('[]', '{}')
+
+
+def linea(registro):
+    return json.dumps(registro, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def linea_cambio(seccion, clave, valor_json):
+    """Línea de un cambio (seccion, clave, valor_json), sin volver a serializar el valor"""
+    partes = ['{"s":', json.dumps(seccion, ensure_ascii=False)]
+    if clave is not None:
+        partes += [',"k":', json.dumps(clave, ensure_ascii=False)]
+    partes += [',"v":', valor_json, '}\n']
+    return ''.join(partes)
+
+
+def recorrer_archivo(ruta, desde=0):
+    """Genera (byte en que acaba la línea, registro) de una exportación a partir de un byte"""
+    with open(ruta, 'rb') as f:
+        f.seek(desde)
+        posicion = desde
+        for cruda in f:
+            if not cruda.endswith(b'\n'):
+                # Última línea a medio escribir por un corte: se descarta
+                return
+            posicion += len(cruda)
+            yield posicion, json.loads(cruda)
+
+
+def comprobar_cabecera(registro, ruta):
+    if registro.get('formato') != FORMATO or registro.get('version') != VERSION:
+        raise ValueError(f"{ruta} no es una exportación de {FORMATO} versión {VERSION}")
+
+
+def resumir(club, n, suma):
+    return f"{club}: {n} registros, suma {suma:064x}"
+
+
+# ==================== EXPORTAR ====================
+
+def retomar_exportacion(ruta):
+    """
+    Clubes completos de una exportación a medias, sus registros y su suma, y el byte
+    en que acaba el último. None si la exportación ya está terminada.
+    """
+    hechos, registros, suma, posicion = set(), 0, 0, None
+    for fin_linea, registro in recorrer_archivo(ruta):
+        if posicion is None:
+            comprobar_cabecera(registro, ruta)
+            posicion = fin_linea
+        elif 'total' in registro:
+            return None
+        elif 'fin' in registro:
+            hechos.add(registro['fin'])
+            registros += registro['registros']
+            suma = (suma + int(registro['suma'], 16)) % MODULO
+            posicion = fin_linea
+    return hechos, registros, suma, posicion or 0
+
+
+def exportar(almacen, ruta, lote=LOTE):
+    """Escribe todos los clubes del almacén en ruta, siguiendo una exportación a medias"""
+    hechos, registros, suma, posicion = set(), 0, 0, 0
+    if os.path.exists(ruta) and os.path.getsize(ruta):
+        retomada = retomar_exportacion(ruta)
+        if retomada is None:
+            print(f"{ruta} ya está completa")
+            return
+        hechos, registros, suma, posicion = retomada
+        if hechos:
+            print(f"Retomando {ruta}: {len(hechos)} clubes ya exportados")
+
+    with open(ruta, 'r+b' if posicion else 'wb') as f:
+        f.seek(posicion)
+        f.truncate()
+        if not posicion:
+            f.write(linea({'formato': FORMATO, 'version': VERSION}).encode('utf-8'))
+        for club in almacen.clubes():
+            if club in hechos:
+                continue
+            n, suma_club = 0, 0
+            lineas = [linea({'club': club})]
+            for seccion, clave, valor_json in almacen.recorrer(club):
+                lineas.append(linea_cambio(seccion, clave, valor_json))
+                if not es_seccion_vacia(clave, valor_json):
+                    n += 1
+                    suma_club += huella(seccion, clave, json.loads(valor_json))
+                if len(lineas) >= lote:
+                    f.write(''.join(lineas).encode('utf-8'))
+                    lineas = []
+            suma_club %= MODULO
+            lineas.append(linea({'fin': club, 'registros': n, 'suma': f'{suma_club:064x}'}))
+            f.write(''.join(lineas).encode('utf-8'))
+            # Un club completo ya no se repite aunque la exportación se corte después
+            f.flush()
+            os.fsync(f.fileno())
+            hechos.add(club)
+            registros += n
+            suma = (suma + suma_club) % MODULO
+            print(resumir(club, n, suma_club))
+        f.write(linea({'total': len(hechos), 'registros': registros, 'suma': f'{suma:064x}'}).encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+    print(f"{ruta}: {len(hechos)} clubes, {registros} registros")
+
+
+# ==================== IMPORTAR ====================
+
+class Importacion:
+    """
+    Importa una exportación en lotes de cambios. Tras cada lote anota en
+    <archivo>.progreso hasta qué byte se ha escrito y las cuentas hasta ahí.
+    """
+
+    def __init__(self, almacen, ruta, lote=LOTE, comprobar=True):
+        self.almacen = almacen
+        self.ruta = ruta
+        self.lote = lote
+        self.comprobar = comprobar
+        self.ruta_progreso = ruta + '.progreso'
+        self.posicion = 0
+        self.club = None
+        self.registros_club = 0
+        self.suma_club = 0
+        self.clubes = 0
+        self.registros = 0
+        self.suma = 0
+        self.cambios = []
+        if os.path.exists(self.ruta_progreso):
+            with open(self.ruta_progreso, 'r', encoding='utf-8') as f:
+                progreso = json.load(f)
+            self.posicion = progreso['posicion']
+            self.club = progreso['club']
+            self.registros_club = progreso['registros_club']
+            self.suma_club = int(progreso['suma_club'], 16)
+            self.clubes = progreso['clubes']
+            self.registros = progreso['registros']
+            self.suma = int(progreso['suma'], 16)
+            print(f"Retomando {ruta} desde el byte {self.posicion}")
+
+    def guardar_progreso(self, posicion):
+        self.posicion = posicion
+        progreso = {
+            'posicion': posicion,
+            'club': self.club,
+            'registros_club': self.registros_club,
+            'suma_club': f'{self.suma_club:x}',
+            'clubes': self.clubes,
+            'registros': self.registros,
+            'suma': f'{self.suma:x}'
+        }
+        temporal = self.ruta_progreso + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(progreso, f)
+        os.replace(temporal, self.ruta_progreso)
+
+    def escribir(self):
+        """
+        Escribe el lote pendiente en el destino. Si se corta antes de anotar el
+        progreso, al retomar se vuelve a escribir, y reescribir un cambio no altera nada.
+        """
+        if self.cambios:
+            self.almacen.escribir(self.club, self.cambios)
+            self.anotar_indices()
+            self.cambios = []
+
+    def anotar_indices(self):
+        """Lo que el bot guarda aparte de los datos del club: encuestas, difusiones y reunión"""
+        difusiones = False
+        for seccion, clave, valor_json in self.cambios:
+            if seccion == 'encuestas' and clave is not None:
+                self.almacen.registrar_encuesta(clave, self.club)
+            elif seccion == 'difusiones' and clave is not None:
+                difusiones = True
+            elif seccion == 'proxima_reunion':
+                self.almacen.anotar_reunion(self.club, json.loads(valor_json))
+        if difusiones:
+            self.almacen.anotar_difusion(self.club, True)
+
+    def empezar_club(self, club, posicion):
+        """Vacía el club en el destino: lo que no esté en la exportación no debe quedar"""
+        self.club = club
+        self.registros_club = 0
+        self.suma_club = 0
+        self.almacen.guardar_todo(club, {})
+        self.almacen.anotar_difusion(club, False)
+        self.almacen.anotar_reunion(club, None)
+        self.guardar_progreso(posicion)
+
+    def terminar_club(self, fin, posicion):
+        if fin['fin'] != self.club or fin['registros'] != self.registros_club or int(fin['suma'], 16) != self.suma_club:
+            raise ValueError(
+                f"El club {fin['fin']} no coincide con su cierre en {self.ruta}: "
+                f"{self.registros_club} registros leídos, {fin['registros']} anotados"
+            )
+        self.escribir()
+        self.almacen.descargar(self.club)
+        if self.comprobar:
+            n, suma = contar(self.almacen.recorrer(self.club))
+            if (n, suma) != (self.registros_club, self.suma_club):
+                raise ValueError(
+                    f"El club {self.club} no coincide al releerlo del destino: "
+                    f"{n} registros de {self.registros_club}"
+                )
+        print(resumir(self.club, self.registros_club, self.suma_club))
+        self.clubes += 1
+        self.registros += self.registros_club
+        self.suma = (self.suma + self.suma_club) % MODULO
+        self.club = None
+        self.guardar_progreso(posicion)
+
+    def ejecutar(self):
+        for posicion, registro in recorrer_archivo(self.ruta, self.posicion):
+            if 's' in registro:
+                seccion, clave, valor = registro['s'], registro.get('k'), registro['v']
+                valor_json = json.dumps(valor, ensure_ascii=False)
+                if not es_seccion_vacia(clave, valor_json):
+                    self.registros_club += 1
+                    self.suma_club = (self.suma_club + huella(seccion, clave, valor)) % MODULO
+                self.cambios.append((seccion, clave, valor_json))
+                if len(self.cambios) >= self.lote:
+                    self.escribir()
+                    self.guardar_progreso(posicion)
+            elif 'club' in registro:
+                self.empezar_club(registro['club'], posicion)
+            elif 'fin' in registro:
+                self.terminar_club(registro, posicion)
+            elif 'total' in registro:
+                if (registro['total'], registro['registros'], int(registro['suma'], 16)) != (
+                        self.clubes, self.registros, self.suma):
+                    raise ValueError(f"Los totales de {self.ruta} no coinciden con lo importado")
+                os.remove(self.ruta_progreso)
+                print(f"{self.ruta}: {self.clubes} clubes, {self.registros} registros importados")
+                return
+            else:
+                comprobar_cabecera(registro, self.ruta)
+                self.guardar_progreso(posicion)
+        raise ValueError(f"{self.ruta} está incompleta: falta la línea de totales")
+
+
+def contar(cambios):
+    """Nº de registros y suma de unos cambios (seccion, clave, valor_json)"""
+    n, suma = 0, 0
+    for seccion, clave, valor_json in cambios:
+        if not es_seccion_vacia(clave, valor_json):
+            n += 1
+            suma += huella(seccion, clave, json.loads(valor_json))
+    return n, suma % MODULO
+
+
+def verificar(ruta):
+    """Comprueba los registros y la suma de cada club y los totales de una exportación"""
+    club, registros_club, suma_club = None, 0, 0
+    clubes, registros, suma = 0, 0, 0
+    primera = True
+    for _, registro in recorrer_archivo(ruta):
+        if primera:
+            comprobar_cabecera(registro, ruta)
+            primera = False
+        elif 's' in registro:
+            clave, valor = registro.get('k'), registro['v']
+            if not (clave is None and valor in ([], {})):
+                registros_club += 1
+                suma_club = (suma_club + huella(registro['s'], clave, valor)) % MODULO
+        elif 'club' in registro:
+            club, registros_club, suma_club = registro['club'], 0, 0
+        elif 'fin' in registro:
+            if (registro['fin'], registro['registros'], int(registro['suma'], 16)) != (club, registros_club, suma_club):
+                raise ValueError(f"El club {registro['fin']} no coincide con su cierre en {ruta}")
+            clubes += 1
+            registros += registros_club
+            suma = (suma + suma_club) % MODULO
+        elif 'total' in registro:
+            if (registro['total'], registro['registros'], int(registro['suma'], 16)) != (clubes, registros, suma):
+                raise ValueError(f"Los totales de {ruta} no coinciden con los de los clubes")
+            print(f"{ruta}: correcta, {clubes} clubes, {registros} registros, suma {suma:064x}")
+            return
+    raise ValueError(f"{ruta} está incompleta: falta la línea de totales")
+
+
+def main(argumentos):
+    parser = argparse.ArgumentParser(prog='migracion.py', description=__doc__.split('\n\n')[0])
+    parser.add_argument('orden', choices=('exportar', 'importar', 'verificar'))
+    parser.add_argument('archivo', help='exportación NDJSON')
+    parser.add_argument('--almacenamiento', default=os.getenv('ALMACENAMIENTO', 'json'),
+                        help='backend de origen al exportar o de destino al importar (json, binario, sqlite, postgres)')
+    parser.add_argument('--directorio', default='clubes', help='directorio de los backends json y binario')
+    parser.add_argument('--lote', type=int, default=LOTE, help='registros que se escriben de una vez')
+    parser.add_argument('--sin-comprobar', action='store_true',
+                        help='al importar, no releer cada club del destino para compararlo')
+    opciones = parser.parse_args(argumentos)
+
+    try:
+        if opciones.orden == 'verificar':
+            verificar(opciones.archivo)
+            return 0
+        almacen = crear_almacenamiento(opciones.almacenamiento, opciones.directorio)
+        try:
+            if opciones.orden == 'exportar':
+                exportar(almacen, opciones.archivo, opciones.lote)
+            else:
+                Importacion(almacen, opciones.archivo, opciones.lote, not opciones.sin_comprobar).ejecutar()
+        finally:
+            almacen.cerrar()
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
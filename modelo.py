@@ -0,0 +1,208 @@
+"""
+Modelo en memoria de los datos de un club
+
+Los miembros, sugerencias, libros, citas y preguntas se guardan como objetos con
+__slots__ en lugar de dicts: no repiten los nombres de los campos en cada
+registro, los nombres de usuario repetidos se comparten (sys.intern) y las fechas
+son enteros (microsegundos desde 1970, en la misma hora local sin zona con que se
+guardaban), así que no hay que volver a interpretarlas en cada consulta.
+
+Lo que se guarda sigue siendo el JSON de siempre: a_json() y desde_json()
+convierten sin pérdidas en los dos sentidos y los campos desconocidos se
+conservan tal cual.
+"""
+
+import sys
+from datetime import datetime, timedelta
+
+EPOCA = datetime(1970, 1, 1)
+MICROSEGUNDOS_POR_DIA = 86_400_000_000
+
+
+def a_epoca(fecha):
+    """datetime o texto ISO (sin zona horaria) -> microsegundos desde 1970"""
+    if isinstance(fecha, str):
+        fecha = datetime.fromisoformat(fecha)
+    diferencia = fecha - EPOCA
+    return (diferencia.days * 86_400 + diferencia.seconds) * 1_000_000 + diferencia.microseconds
+
+
+def a_fecha(epoca):
+    """Microsegundos desde 1970 -> datetime sin zona horaria"""
+    return EPOCA + timedelta(microseconds=epoca)
+
+
+def ahora():
+    return a_epoca(datetime.now())
+
+
+def dias_desde(epoca):
+    """Días completos transcurridos desde una fecha en microsegundos"""
+    return (ahora() - epoca) // MICROSEGUNDOS_POR_DIA
+
+
+class Registro:
+    """
+    Base de los registros. CAMPOS indica el tipo de cada campo del JSON:
+    'texto' (se comparte con sys.intern), 'fecha' (ISO <-> epoca), 'contador'
+    (entero, 0 si falta) o 'valor' (tal cual). Los campos a None no se escriben,
+    salvo los de NULOS.
+    """
+
+    __slots__ = ('extra',)
+    CAMPOS = {}
+    NULOS = frozenset()
+
+    def __init__(self, **valores):
+        for campo, tipo in self.CAMPOS.items():
+            valor = valores.pop(campo, 0 if tipo == 'contador' else None)
+            if tipo == 'texto' and valor is not None:
+                valor = sys.intern(valor)
+            setattr(self, campo, valor)
+        self.extra = valores or None
+
+    @classmethod
+    def desde_json(cls, datos):
+        registro = cls.__new__(cls)
+        for campo, tipo in cls.CAMPOS.items():
+            valor = datos.get(campo)
+            if valor is None:
+                valor = 0 if tipo == 'contador' else None
+            elif tipo == 'texto':
+                valor = sys.intern(valor)
+            elif tipo == 'fecha':
+                valor = a_epoca(valor)
+            setattr(registro, campo, valor)
+        registro.extra = {k: v for k, v in datos.items() if k not in cls.CAMPOS} or None
+        return registro
+
+    def a_json(self):
+        datos = {}
+        for campo, tipo in self.CAMPOS.items():
+            valor = getattr(self, campo)
+            if valor is None:
+                if campo in self.NULOS:
+                    datos[campo] = None
+            elif tipo == 'fecha':
+                datos[campo] = a_fecha(valor).isoformat()
+            else:
+                datos[campo] = valor
+        if self.extra:
+            datos.update(self.extra)
+        return datos
+
+    def __eq__(self, otro):
+        return type(self) is type(otro) and self.a_json() == otro.a_json()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.a_json()!r})"
+
+
+class Miembro(Registro):
+    __slots__ = (
+        'nombre', 'libros_leidos', 'participaciones', 'citas', 'sugerencias', 'votaciones', 'fecha_union', 'epoca'
+    )
+    CAMPOS = {
+        'nombre': 'texto',
+        'libros_leidos': 'contador',
+        # Preguntas, asistencias confirmadas y votaciones en que votó
+        'participaciones': 'contador',
+        'citas': 'contador',
+        'sugerencias': 'contador',
+        'votaciones': 'contador',
+        'fecha_union': 'fecha',
+        # Libros terminados por el club cuando se unió; ver ClubLecturaBot.libros_leidos
+        'epoca': 'contador'
+    }
+
+
+class Sugerencia(Registro):
+    __slots__ = ('id', 'titulo_autor', 'sugerido_por', 'user_id', 'fecha', 'votos')
+    CAMPOS = {
+        'id': 'valor',
+        'titulo_autor': 'texto',
+        'sugerido_por': 'texto',
+        'user_id': 'valor',
+        'fecha': 'fecha',
+        'votos': 'contador'
+    }
+
+
+class Libro(Sugerencia):
+    """Sugerencia elegida como libro del club: el actual o uno del historial"""
+
+    __slots__ = ('fecha_inicio', 'fecha_fin', 'paginas_totales', 'progreso')
+    CAMPOS = {
+        **Sugerencia.CAMPOS,
+        'fecha_inicio': 'fecha',
+        'fecha_fin': 'fecha',
+        'paginas_totales': 'valor',
+        'progreso': 'valor'
+    }
+    NULOS = frozenset({'paginas_totales'})
+
+    @classmethod
+    def elegido(cls, sugerencia, fecha_inicio):
+        """Libro nuevo del club a partir de la sugerencia ganadora"""
+        libro = cls.desde_json(sugerencia.a_json())
+        libro.fecha_inicio = fecha_inicio
+        libro.paginas_totales = None
+        libro.progreso = {}
+        return libro
+
+
+class Cita(Registro):
+    __slots__ = ('cita', 'compartida_por', 'user_id', 'fecha')
+    CAMPOS = {
+        'cita': 'valor',
+        'compartida_por': 'texto',
+        'user_id': 'valor',
+        'fecha': 'fecha'
+    }
+
+
+class Pregunta(Registro):
+    __slots__ = ('pregunta', 'autor', 'user_id', 'fecha', 'respondida')
+    CAMPOS = {
+        'pregunta': 'valor',
+        'autor': 'texto',
+        # Las preguntas anteriores no lo guardaban; ver analitica.calcular
+        'user_id': 'valor',
+        'fecha': 'fecha',
+        'respondida': 'valor'
+    }
+
+
+# Secciones de un club que se guardan como registros: sección -> clase
+SECCIONES = {
+    'miembros': Miembro,
+    'libros_sugeridos': Sugerencia,
+    'libro_actual': Libro,
+    'libros_leidos': Libro,
+    'citas': Cita,
+    'discusiones': Pregunta
+}
+
+
+def cargar_registros(data):
+    """Convierte en registros las secciones de SECCIONES de unos datos recién cargados"""
+    for seccion, clase in SECCIONES.items():
+        valor = data.get(seccion)
+        if isinstance(valor, list):
+            data[seccion] = [clase.desde_json(elemento) for elemento in valor]
+        elif hasattr(valor, 'convertir_con'):
+            # Sección de una instantánea binaria: cada elemento se convierte al leerlo
+            valor.convertir_con(clase.desde_json)
+        elif isinstance(valor, dict) and seccion == 'miembros':
+            data[seccion] = {clave: clase.desde_json(elemento) for clave, elemento in valor.items()}
+        elif isinstance(valor, dict):
+            data[seccion] = clase.desde_json(valor)
+    return data
+
+
+def a_json(valor):
+    """Forma JSON de un registro (o de una sección de instantanea.py); para json.dumps(default=...)"""
+    convertir = getattr(valor, 'a_json', None)
+    if convertir is None:
+        raise TypeError(f"{type(valor).__name__} no se puede guardar en JSON")
+    return convertir()
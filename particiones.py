@@ -0,0 +1,294 @@
+"""
+Modo particiones: varios procesos trabajadores, cada uno con sus propios chats
+
+Un proceso frontal recibe el webhook y pasa cada actualización al trabajador de
+su chat (crc32 del id del chat módulo el nº de trabajadores). Cada trabajador es
+el bot de siempre, pero solo con los clubes de su partición: las actualizaciones
+de un chat llegan siempre al mismo proceso y en orden, sin cerrojos entre procesos,
+y cada proceso usa su propio núcleo.
+
+Frontal y trabajador hablan por un socketpair con una línea por mensaje: el Update
+en JSON en un sentido y su update_id, ya procesado y guardado, en el otro. El frontal guarda
+cada actualización hasta que se confirma; si un trabajador termina (por un fallo o
+porque se le envía SIGTERM para reiniciarlo) se vuelve a arrancar y recibe de nuevo
+todo lo que no había confirmado. Con SIGHUP, el frontal reinicia los trabajadores
+de uno en uno, por ejemplo tras desplegar código nuevo.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import zlib
+from collections import OrderedDict
+from http import HTTPStatus
+
+from telegram import Update
+
+from webhook import secreto_valido
+
+logger = logging.getLogger(__name__)
+
+# Actualizaciones sin confirmar por trabajador; por encima se responde 503 y Telegram reintenta
+MAX_PENDIENTES = 10000
+# Segundos de espera antes de volver a arrancar un trabajador que ha terminado
+ESPERA_REINICIO = 1.0
+# Segundos que se espera a que los trabajadores terminen lo pendiente al cerrar
+ESPERA_CIERRE = 30.0
+
+
+def particion(club_id, total):
+    """Nº del trabajador de un club; igual en todos los procesos (hash() de str no lo es)"""
+    return zlib.crc32(str(club_id).encode()) % total
+
+
+def chat_de(datos):
+    """
+    Id del chat de una actualización en JSON. Las respuestas a encuestas no lo traen:
+    se devuelve ('encuesta', id) para buscar el club de la encuesta. Si no hay chat
+    (botones de mensajes inline) se usa el usuario; None si tampoco hay usuario.
+    """
+    for clave, contenido in datos.items():
+        if not isinstance(contenido, dict):
+            continue
+        chat = contenido.get('chat') or (contenido.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        if clave == 'poll_answer':
+            return 'encuesta', contenido['poll_id']
+        usuario = contenido.get('from')
+        if usuario:
+            return usuario['id']
+    return None
+
+
+class Trabajador:
+    """Lo que el proceso frontal sabe de un trabajador: su proceso y lo que aún no ha confirmado"""
+
+    def __init__(self, numero):
+        self.numero = numero
+        self.proceso = None
+        self.escritor = None
+        # update_id -> línea enviada y sin confirmar, en orden de llegada
+        self.pendientes = OrderedDict()
+        self.tarea = None
+
+    def enviar(self, update_id, linea):
+        # Telegram reenvía una actualización si no recibió la respuesta a tiempo
+        if update_id in self.pendientes:
+            return
+        self.pendientes[update_id] = linea
+        if self.escritor is not None:
+            self.escritor.write(linea)
+
+
+class Distribuidor:
+    """
+    Proceso frontal: arranca los trabajadores, los vigila y les reparte las
+    actualizaciones. `comando` es la orden que arranca un trabajador; recibe su nº,
+    el total y el descriptor del socket en TRABAJADOR, TRABAJADORES y TRABAJADOR_FD.
+    """
+
+    def __init__(self, comando, total, buscar_encuesta, max_pendientes=MAX_PENDIENTES):
+        self.comando = comando
+        self.total = total
+        # Función (bloqueante) id de encuesta -> club, del almacenamiento compartido
+        self.buscar_encuesta = buscar_encuesta
+        self.max_pendientes = max_pendientes
+        self.trabajadores = [Trabajador(numero) for numero in range(total)]
+        self.encuestas = {}
+        self.parando = False
+        self.estadisticas = {
+            'recibidas': 0,
+            'sin_chat': 0,
+            'rechazadas': 0,
+            'saturadas': 0,
+            'reenviadas': 0,
+            'reinicios': 0
+        }
+
+    def pendientes(self):
+        """Actualizaciones sin confirmar de cada trabajador"""
+        return {str(t.numero): len(t.pendientes) for t in self.trabajadores}
+
+    async def iniciar(self):
+        for trabajador in self.trabajadores:
+            trabajador.tarea = asyncio.create_task(self.vigilar(trabajador))
+
+    async def arrancar(self, trabajador):
+        """Arranca el proceso de un trabajador y devuelve el extremo del socket del frontal"""
+        propio, suyo = socket.socketpair()
+        entorno = dict(
+            os.environ,
+            TRABAJADOR=str(trabajador.numero),
+            TRABAJADORES=str(self.total),
+            TRABAJADOR_FD=str(suyo.fileno())
+        )
+        # En su propia sesión: el Ctrl+C de la terminal solo llega al frontal, que los cierra en orden
+        trabajador.proceso = await asyncio.create_subprocess_exec(
+            *self.comando, env=entorno, pass_fds=(suyo.fileno(),), start_new_session=True
+        )
+        suyo.close()
+        return propio
+
+    async def vigilar(self, trabajador):
+        """Mantiene vivo un trabajador: al terminar se arranca otro con lo que quedó sin confirmar"""
+        while not self.parando:
+            lector, escritor = await asyncio.open_connection(sock=await self.arrancar(trabajador))
+            for linea in trabajador.pendientes.values():
+                escritor.write(linea)
+            if trabajador.pendientes:
+                self.estadisticas['reenviadas'] += len(trabajador.pendientes)
+            trabajador.escritor = escritor
+            try:
+                while True:
+                    linea = await lector.readline()
+                    if not linea:
+                        break
+                    trabajador.pendientes.pop(int(linea), None)
+            except ConnectionError:
+                pass
+            finally:
+                trabajador.escritor = None
+                escritor.close()
+            codigo = await trabajador.proceso.wait()
+            if self.parando:
+                break
+            logger.warning(
+                f"El trabajador {trabajador.numero} terminó (código {codigo}); se vuelve a arrancar "
+                f"con {len(trabajador.pendientes)} actualizaciones pendientes"
+            )
+            self.estadisticas['reinicios'] += 1
+            await asyncio.sleep(ESPERA_REINICIO)
+
+    async def reiniciar(self):
+        """Reinicia los trabajadores de uno en uno; mientras, los demás siguen atendiendo"""
+        for trabajador in self.trabajadores:
+            anterior = trabajador.proceso
+            if anterior is None or anterior.returncode is not None:
+                continue
+            logger.info(f"Reiniciando el trabajador {trabajador.numero}")
+            anterior.terminate()
+            await anterior.wait()
+            while not self.parando and (trabajador.proceso is anterior or trabajador.escritor is None):
+                await asyncio.sleep(0.1)
+
+    async def cerrar(self):
+        """
+        Cierra el envío a cada trabajador: procesa lo que ya tiene, lo guarda y termina.
+        Lo que no llegó a enviarse (un trabajador a medio reiniciar) se pierde.
+        """
+        self.parando = True
+        for trabajador in self.trabajadores:
+            if trabajador.escritor is not None and trabajador.escritor.can_write_eof():
+                trabajador.escritor.write_eof()
+            elif trabajador.proceso is not None and trabajador.proceso.returncode is None:
+                trabajador.proceso.terminate()
+        tareas = [t.tarea for t in self.trabajadores if t.tarea is not None]
+        if tareas:
+            _, sin_terminar = await asyncio.wait(tareas, timeout=ESPERA_CIERRE)
+            for trabajador in self.trabajadores:
+                if trabajador.proceso is not None and trabajador.proceso.returncode is None:
+                    logger.warning(f"El trabajador {trabajador.numero} no terminó a tiempo")
+                    trabajador.proceso.kill()
+            for tarea in sin_terminar:
+                tarea.cancel()
+        perdidas = sum(len(t.pendientes) for t in self.trabajadores)
+        if perdidas:
+            logger.warning(f"{perdidas} actualizaciones quedaron sin procesar al cerrar")
+
+    async def club_de_encuesta(self, encuesta_id):
+        club_id = self.encuestas.get(encuesta_id)
+        if club_id is None:
+            club_id = await asyncio.to_thread(self.buscar_encuesta, encuesta_id)
+            if club_id is not None:
+                self.encuestas[encuesta_id] = club_id
+        return club_id
+
+    def ruta_http(self, secreto=None):
+        """Ruta de webhook.ServidorHTTP que reparte los Updates que envía Telegram"""
+        async def recibir(cabeceras, cuerpo):
+            if not secreto_valido(cabeceras, secreto):
+                self.estadisticas['rechazadas'] += 1
+                return HTTPStatus.FORBIDDEN, 'text/plain', 'Secreto incorrecto'
+            try:
+                datos = json.loads(cuerpo)
+                update_id = int(datos['update_id'])
+            except (ValueError, TypeError, KeyError):
+                self.estadisticas['rechazadas'] += 1
+                return HTTPStatus.BAD_REQUEST, 'text/plain', 'Update no válido'
+            chat = chat_de(datos)
+            if isinstance(chat, tuple):
+                chat = await self.club_de_encuesta(chat[1])
+            if chat is None:
+                # Ningún trabajador sabría qué hacer con ella
+                self.estadisticas['sin_chat'] += 1
+                return HTTPStatus.OK, 'text/plain', 'OK'
+            trabajador = self.trabajadores[particion(chat, self.total)]
+            if len(trabajador.pendientes) >= self.max_pendientes:
+                self.estadisticas['saturadas'] += 1
+                return HTTPStatus.SERVICE_UNAVAILABLE, 'text/plain', 'Saturado'
+            # Los saltos de línea de un JSON válido solo pueden ser espacios entre elementos
+            trabajador.enviar(update_id, cuerpo.strip().replace(b'\n', b' ') + b'\n')
+            self.estadisticas['recibidas'] += 1
+            return HTTPStatus.OK, 'text/plain', 'OK'
+        return recibir
+
+
+async def atender_particion(application, fd, parar, guardado=None):
+    """
+    Trabajador: procesa los Updates que llegan por el socket fd con la aplicación ya
+    arrancada y confirma cada uno al terminarlo y, si se indica la corrutina
+    `guardado`, cuando esta dice que sus cambios ya están escritos: si el trabajador
+    cae, se repite lo que no se llegó a guardar. Se detiene cuando el frontal cierra
+    el socket, tras procesar todo lo recibido, o al activarse `parar`, sin leer más:
+    lo que quede en el socket se le reenvía al siguiente trabajador.
+    """
+    lector, escritor = await asyncio.open_connection(sock=socket.socket(fileno=fd))
+    en_curso = set()
+
+    async def procesar(update_id, datos):
+        try:
+            update = Update.de_json(datos, application.bot)
+            # Con el límite de ACTUALIZACIONES_CONCURRENTES, como el bucle de PTB
+            await application.update_processor.process_update(update, application.process_update(update))
+        except Exception:
+            logger.exception(f"Error al procesar la actualización {update_id}")
+        if guardado is not None:
+            await guardado()
+        escritor.write(f'{update_id}\n'.encode())
+
+    espera = asyncio.ensure_future(parar.wait())
+    try:
+        while True:
+            lectura = asyncio.ensure_future(lector.readline())
+            await asyncio.wait({lectura, espera}, return_when=asyncio.FIRST_COMPLETED)
+            if not lectura.done():
+                lectura.cancel()
+                break
+            linea = lectura.result()
+            if not linea:
+                break
+            datos = json.loads(linea)
+            tarea = asyncio.create_task(procesar(datos['update_id'], datos))
+            en_curso.add(tarea)
+            tarea.add_done_callback(en_curso.discard)
+        if en_curso:
+            await asyncio.wait(en_curso)
+        await escritor.drain()
+    except ConnectionError:
+        logger.warning("Se perdió la conexión con el proceso frontal")
+    finally:
+        espera.cancel()
+        escritor.close()
+
+
+def senales_de_parada(parar, reiniciar=None):
+    """SIGINT y SIGTERM activan `parar`; SIGHUP llama a la corrutina `reiniciar` si se indica"""
+    bucle = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        bucle.add_signal_handler(senal, parar.set)
+    if reiniciar is not None:
+        bucle.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(reiniciar()))
@@ -0,0 +1,167 @@
+"""
+Recordatorios automáticos de las reuniones del Club de Lectura
+
+Un único montículo ordenado por hora guarda los recordatorios de todos los clubes
+y una sola tarea duerme hasta el más próximo. Reprogramar una reunión añade sus
+entradas nuevas en O(log n); las de la fecha anterior se descartan al salir del
+montículo (borrado perezoso). Al arrancar, el montículo se rehace con las fechas
+anotadas en el almacenamiento, sin cargar ningún club.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Recordatorios de cada reunión: tipo -> antelación, de más a menos antelación
+RECORDATORIOS = {
+    '24h': timedelta(hours=24),
+    '1h': timedelta(hours=1)
+}
+
+
+def momentos(fecha):
+    """(momento epoch, tipo) de cada recordatorio de una reunión en fecha ISO"""
+    reunion = datetime.fromisoformat(fecha)
+    return [((reunion - antelacion).timestamp(), tipo) for tipo, antelacion in RECORDATORIOS.items()]
+
+
+class PlanificadorRecordatorios:
+    """Envía a cada club los recordatorios de su próxima reunión"""
+
+    def __init__(self, gestor, enviar):
+        self.gestor = gestor
+        # Corrutina (chat_id, texto) -> bool que envía respetando los límites de Telegram
+        self.enviar = enviar
+        # Entradas (momento, club, fecha, tipo)
+        self.monticulo = []
+        # Fecha vigente de la reunión de cada club; las entradas de otra fecha caducan
+        self.reuniones = {}
+        self.cambio = None
+        self.tarea = None
+        self.envios = set()
+        self.estadisticas = {'programados': 0, 'enviados': 0, 'caducados': 0}
+
+    async def iniciar(self):
+        """Rehace el montículo con las reuniones anotadas y arranca la tarea"""
+        self.cambio = asyncio.Event()
+        ahora = time.time()
+        pasadas = []
+        for club_id, fecha in await asyncio.to_thread(self.gestor.almacen.reuniones_programadas):
+            if not self.gestor.es_propio(club_id):
+                # Es de otro trabajador (modo particiones)
+                continue
+            if datetime.fromisoformat(fecha).timestamp() <= ahora:
+                pasadas.append(club_id)
+                continue
+            self.reuniones[club_id] = fecha
+            for momento, tipo in momentos(fecha):
+                self.monticulo.append((momento, club_id, fecha, tipo))
+        heapq.heapify(self.monticulo)
+        for club_id in pasadas:
+            await asyncio.to_thread(self.gestor.almacen.anotar_reunion, club_id, None)
+        self.estadisticas['programados'] = len(self.monticulo)
+        logger.info(f"Recordatorios: {len(self.reuniones)} reuniones programadas")
+        self.tarea = asyncio.create_task(self.ciclo())
+
+    async def cerrar(self):
+        tareas = list(self.envios)
+        if self.tarea:
+            tareas.append(self.tarea)
+            self.tarea = None
+        for tarea in tareas:
+            tarea.cancel()
+        # recordar() atrapa los errores, pero no la cancelación
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+    async def programar(self, club_id, fecha):
+        """Programa los recordatorios de la nueva reunión de un club (None los anula)"""
+        if fecha is None:
+            self.reuniones.pop(club_id, None)
+        else:
+            self.reuniones[club_id] = fecha
+            ahora = time.time()
+            for momento, tipo in momentos(fecha):
+                # Con una reunión a menos de 24h, el recordatorio de 24h ya no toca
+                if momento <= ahora:
+                    continue
+                heapq.heappush(self.monticulo, (momento, club_id, fecha, tipo))
+                self.estadisticas['programados'] += 1
+        await asyncio.to_thread(self.gestor.almacen.anotar_reunion, club_id, fecha)
+        if self.cambio is not None:
+            self.cambio.set()
+
+    async def ciclo(self):
+        """Duerme hasta el recordatorio más próximo, o hasta que se programe otro antes"""
+        while True:
+            if not self.monticulo:
+                await self.cambio.wait()
+                self.cambio.clear()
+                continue
+            espera = self.monticulo[0][0] - time.time()
+            if espera > 0:
+                # Con asyncio.timeout y no wait_for: si cambio se activa a la vez que se
+                # cancela la tarea, wait_for (3.11) se traga la cancelación y cerrar() no vuelve
+                try:
+                    async with asyncio.timeout(espera):
+                        await self.cambio.wait()
+                except TimeoutError:
+                    pass
+                self.cambio.clear()
+                continue
+            momento, club_id, fecha, tipo = heapq.heappop(self.monticulo)
+            if self.reuniones.get(club_id) != fecha:
+                self.estadisticas['caducados'] += 1
+                continue
+            # Cada envío sigue por su cuenta para no retrasar los siguientes recordatorios
+            envio = asyncio.create_task(self.recordar(club_id, fecha, tipo))
+            self.envios.add(envio)
+            envio.add_done_callback(self.envios.discard)
+
+    async def recordar(self, club_id, fecha, tipo):
+        try:
+            # Con el cerrojo del club, como los comandos: si no, se podría anotar el envío
+            # en una copia del club ya descargada
+            async with self.gestor.cerrojo(club_id):
+                club = await self.gestor.obtener(club_id)
+                if club.data['proxima_reunion'] != fecha or tipo in club.data['recordatorios_enviados']:
+                    return
+                ultimo = tipo == list(RECORDATORIOS)[-1]
+                if ultimo:
+                    self.reuniones.pop(club_id, None)
+                    await asyncio.to_thread(self.gestor.almacen.anotar_reunion, club_id, None)
+                # Si el bot estuvo parado, solo se envía el recordatorio más cercano que ya tocaba
+                ahora = time.time()
+                if any(t != tipo and m <= ahora and RECORDATORIOS[t] < RECORDATORIOS[tipo]
+                       for m, t in momentos(fecha)):
+                    return
+                club.recordatorio_enviado(tipo)
+                texto = self.texto(club, fecha)
+            # El envío, fuera del cerrojo: puede esperar por los límites de Telegram
+            if await self.enviar(int(club_id), texto):
+                self.estadisticas['enviados'] += 1
+        except Exception:
+            logger.exception(f"Error enviando el recordatorio {tipo} al club {club_id}")
+
+    def texto(self, club, fecha):
+        reunion = datetime.fromisoformat(fecha)
+        # Según lo que falta de verdad: si el bot estuvo parado puede salir tarde
+        horas = round((reunion - datetime.now()).total_seconds() / 3600)
+        if horas >= 20:
+            cuando = "mañana"
+        elif horas >= 2:
+            cuando = f"dentro de {horas} horas"
+        elif horas == 1:
+            cuando = "dentro de una hora"
+        else:
+            cuando = "en unos minutos"
+        texto = (
+            f"⏰ Recordatorio: la reunión del club es {cuando}, "
+            f"el {reunion.strftime('%d/%m/%Y a las %H:%M')}.\n"
+        )
+        confirmados = len(club.data.get('confirmaciones', []))
+        texto += f"✅ Confirmados: {confirmados}. Usa /confirmar si vas a venir."
+        return texto
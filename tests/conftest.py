@@ -0,0 +1,62 @@
+"""
+Las pruebas ejecutan los handlers reales con el transporte falso de benchmark.py
+(sin red) y guardan los clubes en un directorio temporal. Cada prueba usa su
+propio chat, porque los clubes del bot son globales.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def bot(tmp_path_factory):
+    # El almacenamiento se crea al importar el bot, en el directorio actual
+    os.chdir(tmp_path_factory.mktemp('datos'))
+    import club_lectura_bot
+    logging.getLogger().setLevel(logging.WARNING)
+    return club_lectura_bot
+
+
+@pytest.fixture
+def ejecutar(bot):
+    """
+    Ejecuta prueba(application, actualizaciones) con el bot arrancado y devuelve las
+    excepciones que hayan lanzado los handlers
+    """
+    from telegram.ext import Application
+    from benchmark import Actualizaciones, TransporteFalso
+
+    def ejecutar(prueba):
+        async def principal():
+            application = (
+                Application.builder()
+                .token('1:pruebas')
+                .request(TransporteFalso())
+                .get_updates_request(TransporteFalso())
+                .build()
+            )
+            bot.registrar_handlers(application)
+            errores = []
+
+            async def anotar_error(update, context):
+                errores.append(context.error)
+
+            application.add_error_handler(anotar_error)
+            await application.initialize()
+            await bot.iniciar_persistencia(application)
+            try:
+                await prueba(application, Actualizaciones(application.bot))
+            finally:
+                await bot.cerrar_persistencia(application)
+                await application.shutdown()
+            return errores
+
+        return asyncio.run(principal())
+
+    return ejecutar
@@ -0,0 +1,23 @@
+from modelo import MICROSEGUNDOS_POR_DIA, ahora
+
+CHAT = -1000000000301
+
+
+def test_estadisticas_al_cambiar_de_mes(bot, ejecutar, monkeypatch):
+    async def prueba(application, actualizaciones):
+        async def informe():
+            await application.process_update(actualizaciones.comando('/estadisticas_club', 1, CHAT))
+            # El último texto generado o servido de la caché
+            return next(reversed(club.renders.values()))[1]
+
+        for texto in ('/sugerir Libro - Autor', '/seleccionar_libro', '/terminar_libro'):
+            await application.process_update(actualizaciones.comando(texto, 1, CHAT))
+        club = await bot.clubes.obtener(CHAT)
+        assert '(1 en los últimos 12 meses)' in await informe()
+
+        # El club no cambia, pero trece meses después el libro ya no entra en el informe
+        despues = ahora() + 400 * MICROSEGUNDOS_POR_DIA
+        monkeypatch.setattr(bot, 'ahora', lambda: despues)
+        assert '(0 en los últimos 12 meses)' in await informe()
+
+    assert ejecutar(prueba) == []
@@ -0,0 +1,51 @@
+CHAT = -1000000000101
+
+
+def test_reabrir_votacion_empieza_de_cero(bot, ejecutar):
+    votantes = (1, 2, 3)
+
+    async def prueba(application, actualizaciones):
+        async def comando(texto, user_id=1):
+            await application.process_update(actualizaciones.comando(texto, user_id, CHAT))
+
+        async def votar_todos(votacion_id, sugerencia_id):
+            for user_id in votantes:
+                datos = f'vote_{votacion_id}_{sugerencia_id}'
+                await application.process_update(actualizaciones.boton(datos, user_id, CHAT))
+
+        for user_id in votantes:
+            await comando('/start', user_id)
+        await comando('/sugerir Primero - Autor')
+        await comando('/sugerir Segundo - Autora')
+        club = await bot.clubes.obtener(CHAT)
+        primero, segundo = (libro.id for libro in club.data['libros_sugeridos'])
+
+        await comando('/iniciar_votacion botones')
+        await votar_todos(club.votacion_abierta(), primero)
+        await comando('/finalizar_votacion')
+        assert club.votacion_abierta() is None
+
+        await comando('/iniciar_votacion botones')
+        await votar_todos(club.votacion_abierta(), segundo)
+        assert [libro.votos for libro in club.data['libros_sugeridos']] == [0, 3]
+        assert club.ganador().id == segundo
+
+        await comando('/seleccionar_libro')
+        assert club.data['libro_actual'].id == segundo
+        for user_id in votantes:
+            assert club.data['miembros'][str(user_id)].votaciones == 1
+
+    assert ejecutar(prueba) == []
+
+
+def test_boton_de_voto_caducado(bot, ejecutar):
+    chat = CHAT - 1
+
+    async def prueba(application, actualizaciones):
+        await application.process_update(actualizaciones.comando('/sugerir Libro - Autor', 1, chat))
+        await application.process_update(actualizaciones.comando('/iniciar_votacion botones', 1, chat))
+        club = await bot.clubes.obtener(chat)
+        await application.process_update(actualizaciones.boton(f'vote_{club.votacion_abierta()}_abc', 1, chat))
+        assert [libro.votos for libro in club.data['libros_sugeridos']] == [0]
+
+    assert ejecutar(prueba) == []
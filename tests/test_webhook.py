@@ -0,0 +1,51 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import urllib.error
+import urllib.request
+
+CHAT = -1000000000201
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_webhook_local_sin_url(bot, ejecutar, monkeypatch):
+    puerto = puerto_libre()
+    monkeypatch.setattr(bot, 'PUERTO', puerto)
+    monkeypatch.setattr(bot, 'WEBHOOK_URL', None)
+    monkeypatch.setattr(bot, 'WEBHOOK_SECRETO', 'prueba')
+
+    def post(datos, secreto='prueba'):
+        peticion = urllib.request.Request(
+            f'http://127.0.0.1:{puerto}{bot.WEBHOOK_RUTA}', data=json.dumps(datos).encode(),
+            headers={'X-Telegram-Bot-Api-Secret-Token': secreto, 'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(peticion, timeout=5) as respuesta:
+                return respuesta.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    async def prueba(application, actualizaciones):
+        tarea = asyncio.create_task(bot.ejecutar_webhook(application, '1:pruebas'))
+        await asyncio.sleep(0.2)
+        grabado = actualizaciones.datos_comando('/sugerir Libro grabado - Autor', 1, CHAT)
+        assert await asyncio.to_thread(post, grabado, 'otro') == 403
+        assert await asyncio.to_thread(post, {'sin': 'update_id'}) == 400
+        assert await asyncio.to_thread(post, grabado) == 200
+        club = await bot.clubes.obtener(CHAT)
+        for _ in range(50):
+            if club.data['libros_sugeridos']:
+                break
+            await asyncio.sleep(0.02)
+        assert [libro.titulo_autor for libro in club.data['libros_sugeridos']] == ['Libro grabado - Autor']
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(tarea, 5)
+
+    assert ejecutar(prueba) == []
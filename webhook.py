@@ -0,0 +1,114 @@
+"""
+Servidor HTTP del Club de Lectura sobre tornado (el extra python-telegram-bot[webhooks])
+
+En el modo webhook, ServidorHTTP recibe los Updates que envía Telegram (Receptor)
+y los deja en la cola de la aplicación, como el webhook de python-telegram-bot,
+junto a las rutas propias: GET / para las comprobaciones de salud de Render y las
+métricas. Con polling, y en el proceso frontal del modo particiones, sirve solo
+las rutas propias.
+
+Cada ruta es una corrutina que recibe (cabeceras, cuerpo) y devuelve
+(estado, tipo de contenido, cuerpo).
+"""
+
+import hmac
+import json
+import logging
+from http import HTTPStatus
+
+import tornado.web
+from telegram import Update
+from tornado.httpserver import HTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Tamaño máximo del cuerpo de una petición; un Update ocupa unos pocos KB
+TAMANO_MAXIMO_CUERPO = 1024 * 1024
+
+
+def secreto_valido(cabeceras, secreto):
+    """Si la petición trae el secreto que se dio a Telegram (sin secreto se acepta todo)"""
+    recibido = cabeceras.get('x-telegram-bot-api-secret-token', '')
+    return not secreto or hmac.compare_digest(recibido, secreto)
+
+
+async def salud(cabeceras, cuerpo):
+    return HTTPStatus.OK, 'text/plain', 'OK'
+
+
+class Ruta(tornado.web.RequestHandler):
+    """Adapta una ruta (corrutina) a un manejador de tornado para un único método"""
+
+    def initialize(self, metodo, manejador):
+        self.metodo = metodo
+        self.manejador = manejador
+
+    async def atender(self):
+        if self.request.method != self.metodo:
+            raise tornado.web.HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+        estado, tipo, cuerpo = await self.manejador(self.request.headers, self.request.body)
+        self.set_status(estado)
+        self.set_header('Content-Type', tipo)
+        self.finish(cuerpo)
+
+    get = atender
+    post = atender
+
+    def log_exception(self, tipo, valor, traza):
+        if not isinstance(valor, tornado.web.HTTPError):
+            logger.error("Error en la ruta HTTP", exc_info=(tipo, valor, traza))
+
+
+def agregar_rutas(aplicacion, rutas):
+    """Añade a una aplicación tornado las rutas (método, ruta, corrutina)"""
+    aplicacion.add_handlers(r'.*$', [
+        (ruta, Ruta, {'metodo': metodo, 'manejador': manejador})
+        for metodo, ruta, manejador in rutas
+    ])
+
+
+class Receptor:
+    """Ruta del webhook: pone en la cola de la aplicación los Updates que envía Telegram"""
+
+    def __init__(self, application, secreto=None):
+        self.application = application
+        self.secreto = secreto
+        self.estadisticas = {'actualizaciones': 0, 'rechazadas': 0}
+
+    async def recibir(self, cabeceras, cuerpo):
+        if not secreto_valido(cabeceras, self.secreto):
+            self.estadisticas['rechazadas'] += 1
+            return HTTPStatus.FORBIDDEN, 'text/plain', 'Secreto incorrecto'
+        try:
+            update = Update.de_json(json.loads(cuerpo), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Update no válido en el webhook: {e}")
+            self.estadisticas['rechazadas'] += 1
+            return HTTPStatus.BAD_REQUEST, 'text/plain', 'Update no válido'
+        await self.application.update_queue.put(update)
+        self.estadisticas['actualizaciones'] += 1
+        return HTTPStatus.OK, 'text/plain', 'OK'
+
+
+class ServidorHTTP:
+    """Servidor tornado con GET / y las rutas que se le añadan"""
+
+    def __init__(self, rutas=()):
+        self.aplicacion = tornado.web.Application([])
+        agregar_rutas(self.aplicacion, [('GET', '/', salud), *rutas])
+        self.servidor = None
+
+    def agregar_ruta(self, metodo, ruta, manejador):
+        agregar_rutas(self.aplicacion, [(metodo, ruta, manejador)])
+
+    async def iniciar(self, host, puerto):
+        self.servidor = HTTPServer(self.aplicacion, max_body_size=TAMANO_MAXIMO_CUERPO)
+        self.servidor.listen(puerto, address=host)
+        logger.info(f"Servidor HTTP escuchando en {host}:{puerto}")
+
+    async def cerrar(self):
+        if self.servidor is None:
+            return
+        self.servidor.stop()
+        await self.servidor.close_all_connections()
+        self.servidor = None